@@ -21,7 +21,9 @@ setup(name='dvcz',
       py_modules=[],
       include_package_data=False,
       zip_safe=False,
-      scripts=['src/dvc_adduser', 'src/dvc_check_builds', 'src/dvc_commit'],
+      scripts=['src/dvc_adduser', 'src/dvc_admin', 'src/dvc_check_builds',
+               'src/dvc_commit', 'src/dvc_keypool', 'src/dvc_log',
+               'src/dvc_workspace'],
       description='distributed version control system',
       url='https://jddixon.github.io/dvcz',
       classifiers=[
@@ -0,0 +1,229 @@
+# dvcz/bl_cache.py
+
+"""
+Cache of parsed BuildLists, keyed by content hash.
+
+A BuildList is stored under the hash of its text, so the BuildList for a
+given key never changes and once parsed need never be parsed again.
+Parsed BuildLists are kept in memory in least-recently-used order and
+pickled to disk, by default under the user's .dvcz/ directory:
+
+    $HOME/.dvcz/
+        cache/
+            buildlists/
+                SHA1/
+                SHA2/
+                    00/
+                    ...
+                    ff/
+                        ffa3...
+
+The in-memory cache holds at most max_entries BuildLists.  The on-disk
+cache is kept under max_bytes by discarding the least recently used
+files.  A file which cannot be unpickled is discarded and the BuildList
+parsed again.
+
+The cache saves parsing, not the store lookup: a BuildList is returned
+only while the store still holds its key.
+"""
+
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+from dvcz import DvczError
+from xlattice import HashTypes
+
+__all__ = ['BL_CACHE_DIR', 'MAX_ENTRIES', 'MAX_BYTES', 'BuildListCache']
+
+# relative to the user's .dvcz/ directory
+BL_CACHE_DIR = os.path.join('cache', 'buildlists')
+
+MAX_ENTRIES = 1024                      # BuildLists held in memory
+MAX_BYTES = 64 * 1024 * 1024            # bytes of pickles on disk
+
+# bump this if what is pickled changes
+_FORMAT = 1
+
+
+class BuildListCache(object):
+    """
+    Map content keys to parsed BuildLists, reading and parsing a
+    BuildList from the content-keyed store only if it is not already
+    cached in memory or on disk.
+    """
+
+    def __init__(self, cache_path, hashtype=HashTypes.SHA2,
+                 max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        if not isinstance(hashtype, HashTypes):
+            raise DvczError("not a valid hashtype: '%s'" % hashtype)
+        if max_entries < 1:
+            raise DvczError("cache must hold at least one BuildList")
+        self._path = os.path.join(cache_path, hashtype.name)
+        self._hashtype = hashtype
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lru = OrderedDict()       # key -> BuildList, oldest first
+        self._disk_bytes = None         # computed when first needed
+        self.mem_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        """ Return the path to the on-disk cache for this hash type. """
+        return self._path
+
+    @property
+    def hashtype(self):
+        """ Return the hash type of the keys cached. """
+        return self._hashtype
+
+    def __len__(self):
+        """ Return the number of BuildLists held in memory. """
+        return len(self._lru)
+
+    def _path_for_key(self, key):
+        """ Return the path to the pickle for the key. """
+        return os.path.join(self._path, key[:2], key)
+
+    def get(self, key, u_dir, data=None):
+        """
+        Return the BuildList whose text has the content key, or None if
+        it is not in the content-keyed store u_dir.
+
+        A cached BuildList is returned only if u_dir still holds the
+        key, so that one deleted from the store is not reported as
+        present.  A caller which has already read the BuildList's text
+        from the store, and checked that it hashes to the key, may pass
+        it as data; the store is then not consulted again.
+
+        BuildList.parse() may raise BLError; nothing is cached in that
+        case.
+        """
+        if data is None and not u_dir.exists(key):
+            return None
+        blist = self._lru.get(key)
+        if blist is not None:
+            self._lru.move_to_end(key)
+            self.mem_hits += 1
+            return blist
+
+        blist = self._load(key)
+        if blist is not None:
+            self.disk_hits += 1
+        else:
+            if data is None:
+                data = u_dir.get_data(key)
+            if not data:
+                return None
+            self.misses += 1
+            from buildlist import BuildList
+            blist = BuildList.parse(data.decode('utf-8'), self._hashtype)
+            self._save(key, blist)
+        self._remember(key, blist)
+        return blist
+
+    def _remember(self, key, blist):
+        """ Add the BuildList to the in-memory LRU, evicting if full. """
+        self._lru[key] = blist
+        while len(self._lru) > self._max_entries:
+            self._lru.popitem(last=False)
+
+    def clear(self):
+        """ Forget everything held in memory; the disk cache remains. """
+        self._lru.clear()
+
+    # DISK CACHE ----------------------------------------------------
+
+    def _load(self, key):
+        """ Return the pickled BuildList for the key or None. """
+        path = self._path_for_key(key)
+        try:
+            with open(path, 'rb') as file:
+                (fmt, pickled_key, blist) = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, pickle.UnpicklingError):
+            self._discard(path)
+            return None
+        if fmt != _FORMAT or pickled_key != key:
+            self._discard(path)
+            return None
+        try:
+            os.utime(path)              # most recently used
+        except OSError:
+            pass
+        return blist
+
+    def _save(self, key, blist):
+        """
+        Pickle the BuildList to disk.  A BuildList which cannot be
+        pickled is simply not cached on disk.
+        """
+        try:
+            data = pickle.dumps((_FORMAT, key, blist),
+                                pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if len(data) > self._max_bytes:
+            return
+        dir_path = os.path.dirname(self._path_for_key(key))
+        os.makedirs(dir_path, 0o700, exist_ok=True)
+        (fd_, tmp_path) = tempfile.mkstemp(dir=dir_path, prefix='.tmp')
+        try:
+            with os.fdopen(fd_, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, self._path_for_key(key))
+        except OSError:
+            self._discard(tmp_path)
+            return
+        self._evict(len(data))
+
+    def _discard(self, path):
+        """ Remove a file from the disk cache if it is still there. """
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        """ Return (mtime, size, path) for each pickle on disk. """
+        files = []
+        if not os.path.isdir(self._path):
+            return files
+        for sub_dir in os.scandir(self._path):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue            # removed by another process
+                files.append((info.st_mtime, info.st_size, entry.path))
+        return files
+
+    def _evict(self, added):
+        """
+        Having added a file of the given size, discard the least
+        recently used files if the disk cache has grown too large,
+        bringing it down to 90% of max_bytes.
+        """
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(_[1] for _ in self._scan())
+        else:
+            self._disk_bytes += added
+        if self._disk_bytes <= self._max_bytes:
+            return
+        files = sorted(self._scan())
+        self._disk_bytes = sum(_[1] for _ in files)
+        target = self._max_bytes * 9 // 10
+        for _, size, path in files:
+            if self._disk_bytes <= target:
+                break
+            self._discard(path)
+            self._disk_bytes -= size
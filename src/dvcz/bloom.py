@@ -0,0 +1,243 @@
+# dvcz/bloom.py
+
+"""
+A persistent Bloom filter over the content keys in a Store.
+
+Most keys looked up while committing or syncing are not yet in the
+store, and each such lookup otherwise costs a miss in the directory
+tree.  A BloomFilter answers "definitely absent" for almost all of them
+without touching the tree.  It may wrongly answer "maybe present", at a
+rate fixed when the filter is built, but never wrongly answers absent.
+
+The filter is a file, u_path/idx/bloom, holding a header and the bit
+array, which is mapped into memory and updated in place, so that every
+process using the store sees keys as soon as they are added.  Setting
+bits holds an exclusive lock on the file, which keeps other processes
+out, and a lock on the BloomFilter, which keeps out other threads
+sharing it: setting a bit is a read-modify-write of its byte, and a bit
+lost to a race would make the filter wrongly answer absent.  Keys
+cannot be removed: after keys are deleted from the store, the filter
+answers "maybe" for them until it is rebuilt.
+
+Content keys are already uniformly distributed, so the bits for a key
+are chosen by double hashing over the first 16 bytes of its digest
+rather than by hashing it again.
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from dvcz import DvczError
+
+__all__ = ['BLOOM_FILE', 'DEFAULT_FP_RATE', 'MIN_CAPACITY', 'BloomFilter']
+
+BLOOM_FILE = 'bloom'                # in u_path/idx/
+DEFAULT_FP_RATE = 0.01
+MIN_CAPACITY = 1024
+
+_MAGIC = b'DVBF'
+# magic, hash count, bit count, capacity, keys added, false-positive rate
+_HEADER = struct.Struct('<4sIQQQd')
+_COUNT_AT = 4 + 4 + 8 + 8           # offset of keys added in the header
+
+
+def _sizes(capacity, fp_rate):
+    """
+    Return (hash count, bit count) for a filter holding capacity keys
+    with a false-positive rate of fp_rate.
+    """
+    bits = int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+    bits = max(64, (bits + 7) // 8 * 8)
+    hashes = max(1, int(round(bits / capacity * math.log(2))))
+    return (hashes, bits)
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter over content keys, mapped from the file at path.
+    Use create() to make a new one and open() to use an existing one.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()   # among threads sharing the filter
+        self.hashes = 0
+        self.bits = 0
+        self.capacity = 0
+        self.fp_rate = 0.0
+        self.hits = 0               # lookups answered "absent"
+        self.misses = 0             # lookups answered "maybe present"
+        self.false_positives = 0    # misses found not to be present
+
+    @property
+    def path(self):
+        """ Return the path to the file holding the filter. """
+        return self._path
+
+    @classmethod
+    def create(cls, path, keys, capacity=None, fp_rate=DEFAULT_FP_RATE):
+        """
+        Write a filter holding the keys to path, replacing any filter
+        there, and return it opened.  The filter is sized for capacity
+        keys, by default twice the number of keys.
+        """
+        if not 0.0 < fp_rate < 1.0:
+            raise DvczError("false-positive rate must be between 0 and 1")
+        # Hold the lock on any existing filter while the keys are read
+        # and the new filter written, so that keys added meanwhile by
+        # other processes go into the new filter.
+        try:
+            old = open(path, 'rb')
+        except FileNotFoundError:
+            old = None
+        try:
+            if old is not None and fcntl is not None:
+                fcntl.flock(old.fileno(), fcntl.LOCK_EX)
+            cls._write(path, list(keys), capacity, fp_rate)
+        finally:
+            if old is not None:
+                old.close()         # releasing the lock
+        return cls(path).open()
+
+    @classmethod
+    def _write(cls, path, keys, capacity, fp_rate):
+        """ Write a filter holding the keys to path. """
+        if capacity is None:
+            capacity = 2 * len(keys)
+        capacity = max(capacity, MIN_CAPACITY, len(keys))
+        (hashes, bits) = _sizes(capacity, fp_rate)
+        array = bytearray(bits // 8)
+        for key in keys:
+            for pos in cls._positions(key, hashes, bits):
+                array[pos >> 3] |= 1 << (pos & 7)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, hashes, bits, capacity,
+                                    len(keys), fp_rate))
+            file.write(array)
+        os.replace(tmp_path, path)
+
+    def open(self):
+        """ Map the filter into memory.  Return the BloomFilter. """
+        self.close()
+        file = open(self._path, 'r+b')
+        try:
+            header = file.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise DvczError("damaged Bloom filter %s" % self._path)
+            (magic, self.hashes, self.bits, self.capacity, _,
+             self.fp_rate) = _HEADER.unpack(header)
+            if magic != _MAGIC or os.fstat(file.fileno()).st_size != \
+                    _HEADER.size + self.bits // 8:
+                raise DvczError("damaged Bloom filter %s" % self._path)
+            self._map = mmap.mmap(file.fileno(), 0)
+        except BaseException:
+            file.close()
+            raise
+        self._file = file
+        return self
+
+    def close(self):
+        """ Unmap the filter. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reopen_if_replaced(self):
+        """
+        If the file has been replaced since it was opened, as by a
+        rebuild in another process, open the new one.  Return whether
+        it was replaced.
+        """
+        with self._lock:
+            if self._file is not None and \
+                    os.fstat(self._file.fileno()).st_nlink > 0:
+                return False
+            self.open()
+            return True
+
+    @staticmethod
+    def _positions(key, hashes, bits):
+        """ Return the bit positions for a hex content key. """
+        digest = bytes.fromhex(key)
+        first = int.from_bytes(digest[0:8], 'little')
+        step = int.from_bytes(digest[8:16], 'little') | 1
+        return [(first + ndx * step) % bits for ndx in range(hashes)]
+
+    @property
+    def count(self):
+        """ Return the number of keys added, counting repeats. """
+        return struct.unpack_from('<Q', self._map, _COUNT_AT)[0]
+
+    def expected_fp_rate(self):
+        """
+        Return the false-positive rate to be expected with the number of
+        keys added so far.  Once this is well above fp_rate the filter
+        should be rebuilt with a larger capacity.
+        """
+        return (1.0 - math.exp(-self.hashes * self.count / self.bits)) ** \
+            self.hashes
+
+    def might_contain(self, key):
+        """
+        Return False if the key is certainly not in the filter, True if
+        it may be.
+        """
+        with self._lock:
+            data = self._map
+            offset = _HEADER.size
+            for pos in self._positions(key, self.hashes, self.bits):
+                if not data[offset + (pos >> 3)] & (1 << (pos & 7)):
+                    self.hits += 1
+                    return False
+            self.misses += 1
+            return True
+
+    def add(self, key):
+        """ Add a key to the filter. """
+        self.add_many([key])
+
+    def add_many(self, keys):
+        """ Add each of the keys to the filter. """
+        keys = list(keys)
+        if not keys:
+            return
+        with self._lock:
+            while fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                if os.fstat(self._file.fileno()).st_nlink > 0:
+                    break
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                self.open()             # replaced by a rebuild
+            try:
+                data = self._map
+                offset = _HEADER.size
+                for key in keys:
+                    for pos in self._positions(key, self.hashes, self.bits):
+                        data[offset + (pos >> 3)] |= 1 << (pos & 7)
+                struct.pack_into('<Q', data, _COUNT_AT,
+                                 self.count + len(keys))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def __str__(self):
+        return ("bloom filter:   %d keys, capacity %d, %d bits, %d hashes\n"
+                "fp rate:        %g configured, %g expected\n"
+                "lookups:        %d absent, %d maybe, %d false positives" % (
+                    self.count, self.capacity, self.bits, self.hashes,
+                    self.fp_rate, self.expected_fp_rate(), self.hits,
+                    self.misses, self.false_positives))
@@ -0,0 +1,438 @@
+# dvcz/build_index.py
+
+"""
+A sidecar index of .dvcz/builds, allowing builds to be looked up by
+version number or by timestamp without scanning the log.
+
+The index lives in .dvcz/buildsIndex.  It begins with a header
+
+    MAGIC COUNT LOG_LEN TAIL_HASH RUNS RUN_COUNT...
+
+where LOG_LEN is the length of the prefix of the builds log which has
+been indexed, TAIL_HASH is the SHA2 hash of the last TAIL_BYTES of that
+prefix, and RUNS is the number of runs which follow, each holding
+RUN_COUNT entries.  A run is RUN_COUNT fixed-size entries in log order,
+
+    TIMESTAMP VERSION OFFSET
+
+where TIMESTAMP is in seconds since the epoch, VERSION is the four-part
+version number packed into 64 bits, and OFFSET is that of the line in
+the log, followed by two arrays of RUN_COUNT entry numbers, the first
+sorted by version and the second by timestamp, ties being in log order.
+The index is memory-mapped and lookups are binary searches over each
+run's arrays, so only a handful of pages is read whatever the size of
+the log.
+
+The index is brought up to date whenever it is opened.  Only the header
+is read; lines appended to the log since are indexed as a new run,
+written to the end of the index before the header is rewritten to
+count it.  When there would be more than MAX_RUNS runs they are merged
+into one, in a new file which replaces the old.  If the log no longer
+matches the index, the index is rebuilt from scratch.  Since a run is
+never changed once written and a merged index replaces the file rather
+than rewriting it, an index mapped by one process is not disturbed by
+another bringing it up to date.  Processes bringing the index up to
+date take turns, holding an exclusive lock on the log while they do.
+"""
+
+import calendar
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from dvcz import DvczError
+from dvcz.builds import BuildRecord, line_re, scan_builds
+from dvcz.hashing import new_sha
+from xlattice import HashTypes
+from xlutil import timestamp_now
+
+__all__ = ['INDEX_FILE', 'MAX_RUNS', 'pack_version', 'pack_timestamp',
+           'BuildIndex', 'append_build']
+
+INDEX_FILE = 'buildsIndex'
+BUILDS_FILE = 'builds'
+
+MAX_RUNS = 16                           # runs before merging them
+
+MAGIC = b'DVBY'
+# magic, count, log_len, tail_hash, runs, then the count in each run
+HEADER = struct.Struct('<4sIQ32sI%dI' % MAX_RUNS)
+ENTRY = struct.Struct('<qQQ')           # timestamp, version, offset
+POSITION = struct.Struct('<I')          # entry number within its run
+
+# the length of the tail of the indexed log which is hashed
+TAIL_BYTES = 4096
+
+# field numbers in an ENTRY
+_TIMESTAMP = 0
+_VERSION = 1
+
+
+def pack_version(version):
+    """
+    Pack a three- or four-part version number, with or without the
+    leading 'v', into an int which sorts the way version numbers do.
+    A missing fourth part, the build number, is taken to be zero.
+    """
+    parts = version.lstrip('v').split('.')
+    if len(parts) == 3:
+        parts.append('0')
+    if len(parts) != 4:
+        raise DvczError("not a valid version number: '%s'" % version)
+    packed = 0
+    for part in parts:
+        try:
+            value = int(part)
+        except ValueError:
+            raise DvczError("not a valid version number: '%s'" % version)
+        if value < 0 or value > 0xffff:
+            raise DvczError("version number part out of range: '%s'" %
+                            version)
+        packed = (packed << 16) | value
+    return packed
+
+
+def pack_timestamp(timestamp):
+    """
+    Convert a CCYY-MM-DD HH:MM:SS UTC timestamp to seconds since the
+    epoch.
+    """
+    try:
+        return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+    except ValueError:
+        raise DvczError("not a valid timestamp: '%s'" % timestamp)
+
+
+def _tail_hash(file, log_len):
+    """ Return the SHA2 digest of the TAIL_BYTES before log_len. """
+    start = max(0, log_len - TAIL_BYTES)
+    file.seek(start)
+    sha = new_sha(HashTypes.SHA2)
+    sha.update(file.read(log_len - start))
+    return sha.digest()
+
+
+def _run_size(count):
+    """ Return the length in bytes of a run of count entries. """
+    return count * (ENTRY.size + 2 * POSITION.size)
+
+
+def _pack_run(entries):
+    """ Return a run holding the entries, given in log order. """
+    count = len(entries)
+    by_version = sorted(range(count),
+                        key=lambda _: (entries[_][_VERSION], _))
+    by_timestamp = sorted(range(count),
+                          key=lambda _: (entries[_][_TIMESTAMP], _))
+    return b''.join([b''.join(ENTRY.pack(*_) for _ in entries),
+                     b''.join(POSITION.pack(_) for _ in by_version),
+                     b''.join(POSITION.pack(_) for _ in by_timestamp)])
+
+
+# where a run is in the mapped index: its offset, the number in the log
+# of its first entry, and the number of entries it holds
+_Run = namedtuple('_Run', ['offset', 'first', 'count'])
+
+
+class BuildIndex(object):
+    """
+    Look up builds in a project's .dvcz/builds by version number or
+    timestamp.
+
+    refresh() brings the index up to date with the log and must be
+    called before any lookup; close() releases the mapped index.  The
+    index may also be used as a context manager, which does both.
+    """
+
+    def __init__(self, dvcz_path, hashtype=HashTypes.SHA2):
+        self._log_path = os.path.join(dvcz_path, BUILDS_FILE)
+        self._path = os.path.join(dvcz_path, INDEX_FILE)
+        self._regexp = line_re(hashtype)
+        self._count = 0
+        self._runs = []
+        self._map = None
+        self._log = None
+        self.rebuilt = False        # whether refresh() started from scratch
+
+    @property
+    def path(self):
+        """ Return the path to the on-disk index. """
+        return self._path
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self.refresh()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Release the mapped index and the log. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        self._count = 0
+        self._runs = []
+
+    # MAINTENANCE -------------------------------------------------
+
+    def _read_header(self, log):
+        """
+        Return (run counts, log_len) from the header of the index on
+        disk if it is consistent with the log, or None if the index
+        must be rebuilt.  Only the header is read.
+        """
+        try:
+            with open(self._path, 'rb') as file:
+                data = file.read(HEADER.size)
+                size = os.fstat(file.fileno()).st_size
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        fields = HEADER.unpack(data)
+        (magic, count, log_len, tail_hash, runs) = fields[:5]
+        counts = list(fields[5:5 + runs])
+        if magic != MAGIC or runs > MAX_RUNS or sum(counts) != count or \
+                size < HEADER.size + _run_size(count):
+            return None
+        log_size = os.fstat(log.fileno()).st_size
+        if log_size < log_len or _tail_hash(log, log_len) != tail_hash:
+            return None
+        return (counts, log_len)
+
+    @staticmethod
+    def _header(log, counts, log_len):
+        """ Return the header for runs of counts entries. """
+        return HEADER.pack(MAGIC, sum(counts), log_len,
+                           _tail_hash(log, log_len), len(counts),
+                           *(counts + [0] * (MAX_RUNS - len(counts))))
+
+    def _append_run(self, log, counts, entries, log_len):
+        """
+        Write the entries, if there are any, as a new run at the end of
+        the index, and then rewrite the header to count it and the
+        first log_len bytes of the log.
+        """
+        with open(self._path, 'r+b') as file:
+            if entries:
+                end = HEADER.size + _run_size(sum(counts))
+                file.truncate(end)      # whatever a failed append left
+                file.seek(end)
+                file.write(_pack_run(entries))
+                file.flush()
+                os.fsync(file.fileno())
+                counts = counts + [len(entries)]
+            file.seek(0)
+            file.write(self._header(log, counts, log_len))
+
+    def _entries(self, counts):
+        """ Return every entry in the index on disk, in log order. """
+        entries = []
+        with open(self._path, 'rb') as file:
+            offset = HEADER.size
+            for count in counts:
+                file.seek(offset)
+                entries.extend(ENTRY.iter_unpack(
+                    file.read(count * ENTRY.size)))
+                offset += _run_size(count)
+        return entries
+
+    def _save(self, log, entries, log_len):
+        """
+        Replace the index with one of a single run holding the entries
+        for the first log_len bytes of the log.
+        """
+        counts = [len(entries)] if entries else []
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(self._header(log, counts, log_len))
+            file.write(_pack_run(entries))
+        os.replace(tmp_path, self._path)
+
+    def _map_index(self):
+        """ Map the index and locate its runs from its header. """
+        with open(self._path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self._map)
+        (self._count, runs) = (fields[1], fields[4])
+        offset = HEADER.size
+        first = 0
+        for count in fields[5:5 + runs]:
+            self._runs.append(_Run(offset, first, count))
+            offset += _run_size(count)
+            first += count
+
+    def refresh(self):
+        """
+        Bring the index up to date with the log, rebuilding it if it is
+        missing or no longer matches the log, and map it.  Return self.
+        """
+        self.close()
+        if not os.path.exists(self._log_path):
+            return self
+        log = open(self._log_path, 'rb')
+        try:
+            if fcntl is not None:
+                fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+            header = self._read_header(log)
+            self.rebuilt = header is None
+            (counts, indexed_len) = ([], 0) if self.rebuilt else header
+            # index any lines appended since the index was written
+            entries = []
+            log.seek(indexed_len)
+            log_len = indexed_len
+            for offset, line in scan_builds(log):
+                matches = self._regexp.match(line.decode('utf-8', 'replace'))
+                if matches:
+                    (timestamp, version, _) = matches.groups()
+                    try:
+                        entries.append((pack_timestamp(timestamp),
+                                        pack_version(version), log_len))
+                    except DvczError:
+                        pass            # like any other malformed line
+                log_len = offset
+            if self.rebuilt:
+                self._save(log, entries, log_len)
+            elif entries and len(counts) >= MAX_RUNS:
+                self._save(log, self._entries(counts) + entries, log_len)
+            elif log_len != indexed_len:
+                self._append_run(log, counts, entries, log_len)
+            self._map_index()
+        except BaseException:
+            self.close()
+            log.close()
+            raise
+        if fcntl is not None:
+            fcntl.flock(log.fileno(), fcntl.LOCK_UN)
+        self._log = log
+        return self
+
+    # LOOKUP ------------------------------------------------------
+
+    def _entry(self, run, ndx):
+        """ Return the (timestamp, version, offset) for entry ndx. """
+        return ENTRY.unpack_from(self._map, run.offset + ndx * ENTRY.size)
+
+    def _position(self, run, field, ndx):
+        """
+        Return the entry number at ndx in the run's array of entry
+        numbers sorted by field.
+        """
+        base = run.offset + run.count * ENTRY.size
+        if field == _TIMESTAMP:
+            base += run.count * POSITION.size
+        return POSITION.unpack_from(self._map, base + ndx * POSITION.size)[0]
+
+    def _bisect(self, run, field, value):
+        """
+        Return the number of entries in the run whose field is no
+        greater than value, that is, where value would be inserted in
+        the array sorted by field to the right of any equal values.
+        """
+        low, high = 0, run.count
+        while low < high:
+            mid = (low + high) // 2
+            if value < self._entry(run, self._position(run, field, mid))[
+                    field]:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def _record(self, run, ndx):
+        """ Return the BuildRecord for the run's entry ndx. """
+        self._log.seek(self._entry(run, ndx)[2])
+        line = self._log.readline().rstrip(b'\n').decode('utf-8', 'replace')
+        return BuildRecord(*self._regexp.match(line).groups())
+
+    def _check_open(self):
+        """ Complain if lookups are attempted before refresh(). """
+        if self._map is None and os.path.exists(self._log_path):
+            raise DvczError("build index %s has not been refreshed" %
+                            self._path)
+
+    def by_version(self, version):
+        """
+        Return a list of the BuildRecords for a version number in the
+        order logged.  A three-part version N.N.N matches every build
+        of that version, whatever its build number, in version order;
+        a four-part version matches only that build.
+        """
+        self._check_open()
+        low_ver = pack_version(version)
+        high_ver = low_ver
+        if len(version.lstrip('v').split('.')) == 3:
+            high_ver += 0xffff
+        found = []                  # (version, number in log, run, ndx)
+        for run in self._runs:
+            low = self._bisect(run, _VERSION, low_ver - 1)
+            high = self._bisect(run, _VERSION, high_ver)
+            for pos in range(low, high):
+                ndx = self._position(run, _VERSION, pos)
+                found.append((self._entry(run, ndx)[_VERSION],
+                              run.first + ndx, run, ndx))
+        found.sort(key=lambda _: _[:2])
+        return [self._record(_[2], _[3]) for _ in found]
+
+    def before(self, timestamp):
+        """
+        Return the BuildRecord for the latest build at or before the
+        CCYY-MM-DD HH:MM:SS timestamp, or None if there is none.  Of
+        builds with the same timestamp, the last logged is returned.
+        """
+        self._check_open()
+        packed = pack_timestamp(timestamp)
+        best = None                 # (timestamp, number in log, run, ndx)
+        for run in self._runs:
+            pos = self._bisect(run, _TIMESTAMP, packed)
+            if pos:
+                ndx = self._position(run, _TIMESTAMP, pos - 1)
+                found = (self._entry(run, ndx)[_TIMESTAMP], run.first + ndx,
+                         run, ndx)
+                if best is None or found[:2] > best[:2]:
+                    best = found
+        if best is None:
+            return None
+        return self._record(best[2], best[3])
+
+    def latest(self):
+        """
+        Return the BuildRecord for the last build logged, or None if
+        there is none.
+        """
+        self._check_open()
+        if self._count == 0:
+            return None
+        run = self._runs[-1]
+        return self._record(run, run.count - 1)
+
+
+def append_build(dvcz_path, version, bl_hash, hashtype=HashTypes.SHA2,
+                 timestamp=None):
+    """
+    Append a line "TIMESTAMP vVERSION HASH" to the project's builds
+    log and bring the build index up to date.  If no timestamp is
+    supplied, the current time is used.
+
+    Return the BuildRecord for the line.
+    """
+    if timestamp is None:
+        timestamp = timestamp_now()
+    version = version.lstrip('v')
+    with open(os.path.join(dvcz_path, BUILDS_FILE), 'a') as file:
+        file.write("%s v%s %s\n" % (timestamp, version, bl_hash))
+    BuildIndex(dvcz_path, hashtype).refresh().close()
+    return BuildRecord(timestamp, version, bl_hash)
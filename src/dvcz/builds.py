@@ -2,75 +2,446 @@
 
 import os
 import re
+import time
+from collections import namedtuple
+from itertools import islice, repeat
 
-from buildlist import BLError, BuildList
 from dvcz import DvczError
+from dvcz.bl_cache import BuildListCache
+from dvcz.hashing import BUF_SIZE, new_sha
+from dvcz.key_index import digest_len
 from xlattice import HashTypes
-from xlu import UDir
 
-__all__ = ['check_builds', ]
+__all__ = ['BuildRecord', 'line_re', 'scan_builds', 'read_builds',
+           'next_build_number', 'listed_files', 'files_not_found',
+           'CheckSummary', 'check_builds', ]
 
 TIMESTAMP_PAT = r'(\d\d\d\d\-\d\d\-\d\d \d\d:\d\d:\d\d)'
-VERSION_PAT = r'v(\d+\.\d+\.\d+)'
+# three or four parts, the optional fourth being the build number
+VERSION_PAT = r'v(\d+\.\d+\.\d+(?:\.\d+)?)'
 HASH1_PAT = r'([0-9a-fA-F]{40})'
 HASH2_PAT = r'([0-9a-fA-F]{64})'
-LINE1_PAT = TIMESTAMP_PAT + ' ' + VERSION_PAT + ' ' + HASH1_PAT
-LINE2_PAT = TIMESTAMP_PAT + ' ' + VERSION_PAT + ' ' + HASH2_PAT
+LINE1_PAT = TIMESTAMP_PAT + ' ' + VERSION_PAT + ' ' + HASH1_PAT + '$'
+LINE2_PAT = TIMESTAMP_PAT + ' ' + VERSION_PAT + ' ' + HASH2_PAT + '$'
 LINE1_RE = re.compile(LINE1_PAT)
 LINE2_RE = re.compile(LINE2_PAT)
 
+# the pattern matching a line of .dvcz/builds, by hash type
+_LINE_RES = {
+    HashTypes.SHA1: LINE1_RE,
+    HashTypes.SHA2: LINE2_RE,
+    HashTypes.SHA3: LINE2_RE,
+    HashTypes.BLAKE2B: LINE2_RE,
+}
 
-def _check_builds_line(line, u_dir, hashtype, verbose=False):
-    u_path = u_dir.u_path
+# lines handed to each worker process at a time
+CHUNK_SIZE = 16
+
+# under .dvcz/, records how much of the builds file has been verified
+CHECKPOINT_FILE = 'buildsCheckpoint'
+
+# content-keyed stores opened in a worker process, by u_path
+_WORKER_STORES = {}
+
+# BuildList caches opened in a worker process, by (path, hashtype)
+_WORKER_BL_CACHES = {}
+
+# committers' public keys imported in a worker process, by PEM digest
+_WORKER_PUB_KEYS = {}
+
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+# One line of .dvcz/builds.  The version lacks the leading 'v'.
+BuildRecord = namedtuple('BuildRecord', ['timestamp', 'version', 'hash'])
+
+
+def line_re(hashtype=HashTypes.SHA2):
+    """ Return the compiled pattern matching a builds line. """
+    try:
+        return _LINE_RES[hashtype]
+    except KeyError:
+        raise DvczError("not a valid hashtype: '%s'" % hashtype)
+
+
+def scan_builds(file):
+    """
+    Given a builds file opened in binary mode, yield (offset, line)
+    for each complete line from the current position on, where offset
+    is that of the end of the line and line is bytes, without the
+    newline.  An incomplete last line, one still being written, is
+    ignored.
+
+    The file is read a line at a time, so memory used does not depend
+    on the length of the log.
+    """
+    offset = file.tell()
+    for line in file:
+        if not line.endswith(b'\n'):
+            break
+        offset += len(line)
+        yield (offset, line[:-1])
+
+
+def read_builds(path, hashtype=HashTypes.SHA2):
+    """
+    Yield a BuildRecord for each line of the builds file at path,
+    skipping lines which cannot be parsed.
+    """
+    regexp = line_re(hashtype)
+    with open(path, 'rb') as file:
+        for _, line in scan_builds(file):
+            matches = regexp.match(line.decode('utf-8', 'replace'))
+            if matches:
+                yield BuildRecord(*matches.groups())
+
+
+def next_build_number(path, version, hashtype=HashTypes.SHA2):
+    """
+    Return the build number for the next commit of version N.N.N: zero
+    if the builds file at path has no earlier build of that version,
+    and otherwise one more than the highest build number logged.
+    A three-part version in the log has build number zero.
+
+    path must be a project's .dvcz/builds: the answer is looked up in
+    the BuildIndex beside it, which is first brought up to date.
+    """
+    from dvcz.build_index import BuildIndex     # which imports this module
+    base = '.'.join(version.lstrip('v').split('.')[:3])
+    with BuildIndex(os.path.dirname(path), hashtype) as index:
+        records = index.by_version(base)
+    if not records:
+        return 0
+    parts = records[-1].version.split('.')
+    return (int(parts[3]) if len(parts) > 3 else 0) + 1
+
+
+def listed_files(text, hashtype=HashTypes.SHA2):
+    """
+    Yield (rel_path, key) for each file listed in the text of a
+    BuildList, as bytes or str, in the order listed.
+
+    The NLHTree in a BuildList has a line per directory and file,
+    indented by its depth; a file's line ends with its content key.
+    Lines outside the tree do not end in a key, so need not be found.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    hex_len = 2 * digest_len(hashtype)
+    dirs = []
+    for line in text.split('\n'):
+        name = line.lstrip(' ')
+        depth = len(line) - len(name)
+        del dirs[depth:]
+        parts = name.rsplit(' ', 1)
+        if len(parts) == 2 and len(parts[1]) == hex_len and \
+                _HEX_DIGITS.issuperset(parts[1]):
+            yield ('/'.join(dirs[1:] + [parts[0]]), parts[1])
+        elif name:
+            dirs.append(name)
+
+
+def files_not_found(text, store, committer_id=None):
+    """
+    Return (rel_path, key) for each file listed in the BuildList text
+    which is neither in the Store, loose or packed, nor in the staging
+    areas of committer_id, an ID or a list of them, if given.
+    """
+    # pylint: disable=no-member
+    listed = list(listed_files(text, store.hashtype))
+    missing = set(store.has_keys([_[1] for _ in listed], committer_id))
+    return [_ for _ in listed if _[1] in missing]
+
+
+class CheckSummary(object):
+    """
+    What check_builds() did: the number of lines checked, the number of
+    BuildList signatures verified and failed, and the seconds spent in
+    each phase, summed over the worker processes.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.verified = 0
+        self.failed = 0
+        self.load_secs = 0.0        # reading and parsing BuildLists
+        self.import_secs = 0.0      # importing committers' public keys
+        self.verify_secs = 0.0      # verifying their signatures
+        self.content_secs = 0.0     # looking for their files in the store
+        self.total_secs = 0.0       # elapsed time for the whole check
+
+    def add(self, sig_ok, timings):
+        """ Record the results for one line. """
+        self.lines += 1
+        if sig_ok is True:
+            self.verified += 1
+        elif sig_ok is False:
+            self.failed += 1
+        (load_secs, import_secs, verify_secs, content_secs) = timings
+        self.load_secs += load_secs
+        self.import_secs += import_secs
+        self.verify_secs += verify_secs
+        self.content_secs += content_secs
+
+    def __str__(self):
+        return "\n".join([
+            "lines checked:  %d" % self.lines,
+            "signatures:     %d verified, %d failed" % (
+                self.verified, self.failed),
+            "time (seconds): %.3f loading, %.3f importing keys, "
+            "%.3f verifying, %.3f checking contents, %.3f elapsed" % (
+                self.load_secs, self.import_secs, self.verify_secs,
+                self.content_secs, self.total_secs), ])
+
+
+def _committer_key(data, hashtype):
+    """
+    Return the committer's public key which heads the serialized
+    BuildList in data, or None if there is none.  Each key is imported
+    only the first time this process sees it; after that it is found
+    by the digest of its PEM-formatted text.
+    """
+    try:
+        end = data.index(b'KEY-----', data.index(b'-----END ')) + 8
+    except ValueError:
+        return None
+    sha = new_sha(hashtype)
+    sha.update(data[:end])
+    digest = sha.hexdigest()
+    key = _WORKER_PUB_KEYS.get(digest)
+    if key is None:
+        from Crypto.PublicKey import RSA        # slow to import
+        key = RSA.importKey(data[:end])
+        _WORKER_PUB_KEYS[digest] = key
+    return key
+
+
+def _check_builds_line(line, store, hashtype, regexp, verbose=False,
+                       bl_cache=None, verify_sigs=True):
+    """
+    Check one line of .dvcz/builds, returning (msgs, notes, sig_ok,
+    timings) where msgs is a list of messages describing any problems
+    found, an empty list meaning the line is OK; notes is a list of
+    informational messages, empty unless verbose; sig_ok is True or
+    False if the BuildList's signature was verified and None if it was
+    not; and timings are the seconds spent (loading, importing the
+    committer's key, verifying, checking contents).
+
+    regexp is the pattern returned by line_re() for the hashtype.  The
+    BuildList is read from the Store, or from any of its staging areas,
+    and checked against its key; if a BuildListCache is supplied, it is
+    then taken from the cache rather than parsed.  The files it lists
+    are likewise looked for in the store and its staging areas, since
+    committed files stay in in/COMMITTER_ID until moved into the store.
+
+    The signature is verified against the key from _committer_key(), so
+    that each committer's key is imported once per process, not once
+    per BuildList.
+    """
+    from buildlist import BLError, BuildList     # slow to import
+
+    u_path = store.u_path
+    in_ids = store.staging_ids()
+    msgs = []
+    notes = []
+    sig_ok = None
+    timings = [0.0, 0.0, 0.0, 0.0]
 
-    if hashtype == HashTypes.SHA1:
-        regexp = LINE1_RE
-    elif hashtype == HashTypes.SHA2 or \
-            hashtype == HashTypes.SHA3 or \
-            hashtype == hashTypes.BLAKE2B:
-        regexp = LINE2_RE
-    else:
-        print("BAD HASH FIELD:\n  %s" % line)
-        return
     matches = regexp.match(line)
     if matches:
-        timestamp = matches.group(1)
-        version = matches.group(2)
-        my_hash = matches.group(3)
+        (timestamp, version, my_hash) = matches.groups()
         if verbose:
-            print("timestamp: %s" % timestamp)
-            print("version:   v%s" % version)
-            print("my_hash:   %s" % my_hash)
+            notes.append("timestamp: %s" % timestamp)
+            notes.append("version:   v%s" % version)
+            notes.append("my_hash:   %s" % my_hash)
     else:
-        print("\nCANNOT PARSE LINE:\n  %s" % line)
-        return
+        msgs.append("\nCANNOT PARSE LINE:\n  %s" % line)
+        return (msgs, notes, sig_ok, timings)
+
+    # The BuildList is always read from the store and rehashed, so that
+    # one deleted or damaged since it was cached is noticed.
+    start = time.perf_counter()
+    try:
+        data = store.get_data(my_hash, in_ids)
+        if not data:
+            msgs.append("\nCANNOT FIND BUILD LIST AT %s IN %s" % (
+                my_hash, u_path))
+            return (msgs, notes, sig_ok, timings)
+        sha = new_sha(hashtype)
+        sha.update(data)
+        if sha.hexdigest() != my_hash.lower():
+            msgs.append("\nLINE: %s" % line)
+            msgs.append("BUILD LIST %s IN %s DOES NOT MATCH ITS KEY" % (
+                my_hash, u_path))
+            return (msgs, notes, sig_ok, timings)
+        if bl_cache is not None:
+            blist = bl_cache.get(my_hash, store, data)
+        else:
+            # POSSIBLE DECODE ERROR
+            blist = BuildList.parse(data.decode('utf-8'), hashtype)
+    except BLError as exc:
+        msgs.append("EXCEPTION %s PARSING LINE:\n  %s" % (exc, line))
+        return (msgs, notes, sig_ok, timings)
+    finally:
+        timings[0] = time.perf_counter() - start
 
-    data = u_dir.get_data(my_hash)
-    if not data:
-        print("\nCANNOT FIND BUILD LIST AT %s IN %s" % (my_hash, u_path))
-        return
+    if verify_sigs:
+        start = time.perf_counter()
+        key = _committer_key(data, hashtype)
+        if key is not None:
+            # pylint: disable=protected-access
+            blist._public_key = key
+        timings[1] = time.perf_counter() - start
+        start = time.perf_counter()
+        sig_ok = bool(blist.verify())
+        timings[2] = time.perf_counter() - start
+        if not sig_ok:
+            msgs.append("\nLINE: %s" % line)
+            msgs.append("BAD SIGNATURE ON BUILD LIST %s" % my_hash)
 
-    # POSSIBLE DECODE ERROR
-    text = data.decode('utf-8')
+    start = time.perf_counter()
+    not_found = files_not_found(data, store, in_ids)
+    timings[3] = time.perf_counter() - start
+    if not_found:
+        msgs.append("\nLINE: %s" % line)
+        msgs.append("SOME BUILD LIST FILES NOT FOUND:")
+        for rel_path, key in not_found:
+            msgs.append("  %s %s" % (rel_path, key))
+    return (msgs, notes, sig_ok, timings)
 
+
+def _check_line_in_worker(line, u_path, hashtype, bl_cache_path=None,
+                          verify_sigs=True, verbose=False):
+    """
+    Check a line in a worker process, opening the content-keyed store
+    and any BuildList cache the first time the process sees them.
+    """
+    store = _WORKER_STORES.get(u_path)
+    if store is None:
+        from dvcz.store import Store
+        store = Store.discover('U', u_path)
+        _WORKER_STORES[u_path] = store
+    bl_cache = None
+    if bl_cache_path:
+        bl_cache = _WORKER_BL_CACHES.get((bl_cache_path, hashtype))
+        if bl_cache is None:
+            bl_cache = BuildListCache(bl_cache_path, hashtype)
+            _WORKER_BL_CACHES[(bl_cache_path, hashtype)] = bl_cache
+    return _check_builds_line(line, store, hashtype, line_re(hashtype),
+                              verbose, bl_cache, verify_sigs)
+
+
+def _hash_prefix(file, offset):
+    """
+    Hash the first offset bytes of the file, returning the hashlib
+    object, or None if the file is shorter than that.
+    """
+    sha = new_sha(HashTypes.SHA2)
+    file.seek(0)
+    remaining = offset
+    while remaining > 0:
+        chunk = file.read(min(remaining, BUF_SIZE))
+        if not chunk:
+            return None
+        sha.update(chunk)
+        remaining -= len(chunk)
+    return sha
+
+
+def _read_checkpoint(path):
+    """
+    Return the (offset, prefix_hash, u_path) recorded in a checkpoint
+    file, or None if there is no usable checkpoint.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        parts = file.read().rstrip('\n').split(' ', 2)
+    if len(parts) != 3:
+        return None
     try:
-        blist = BuildList.parse(text, hashtype)
-    except BLError as exc:
-        print("EXCEPTION %s PARSING LINE:\n  %s" % (exc, line))
-        return
+        offset = int(parts[0])
+    except ValueError:
+        return None
+    return (offset, parts[1], parts[2])
+
+
+def _write_checkpoint(path, offset, prefix_hash, u_path):
+    """
+    Record that the first offset bytes of the builds file, which hash
+    to prefix_hash, have been verified against the store at u_path.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write("%d %s %s\n" % (offset, prefix_hash,
+                                    os.path.abspath(u_path)))
+    os.replace(tmp_path, path)
+
+
+def _verified_prefix(checkpoint_file, file, u_path):
+    """
+    Return (offset, sha) where offset is the length of the prefix of the
+    builds file known to have been verified against the store at u_path
+    and sha the hashlib object for that prefix.  The file is left
+    positioned at offset.
+
+    If the prefix recorded in the checkpoint no longer matches, the
+    builds file has been truncated or tampered with: say so and
+    return (0, sha) for the empty prefix.
+    """
+    checkpoint = _read_checkpoint(checkpoint_file)
+    if checkpoint is not None:
+        (offset, prefix_hash, ck_u_path) = checkpoint
+        if ck_u_path == os.path.abspath(u_path):
+            sha = _hash_prefix(file, offset)
+            if sha is not None and sha.hexdigest() == prefix_hash:
+                return (offset, sha)
+            print("WARNING: builds file has been truncated or modified "
+                  "since it was last verified; checking every build")
+    file.seek(0)
+    return (0, new_sha(HashTypes.SHA2))
+
 
-    files_not_found = blist.check_in_u_dir(u_path)
-    if files_not_found:
-        print("\nLINE: %s" % line)
-        print("SOME BUILD LIST FILES NOT FOUND:")
-        for file in files_not_found:
-            print("  %s %s" % (file[0], file[1]))
+def _windows(iterable, size):
+    """ Yield successive lists of up to size items from iterable. """
+    iterator = iter(iterable)
+    while True:
+        window = list(islice(iterator, size))
+        if not window:
+            return
+        yield window
 
 
-def check_builds(proj_path='./', u_path='/var/app/sharedev/U', verbose=False):
+def check_builds(proj_path='./', u_path='/var/app/sharedev/U', verbose=False,
+                 workers=1, full=False, bl_cache_path=None, verify_sigs=True,
+                 summary=None):
     """
     Verify that the BuildLists in .dvcz/builds are correct and that
     files listed are in uDir, the content-keyed store
+
+    If workers is greater than 1, lines are checked concurrently by
+    that many processes.  Results are reported in the order in which
+    lines appear in the builds file, whatever the number of workers.
+
+    The builds file is append-only, so once a line has been verified
+    it need not be checked again.  The length of the verified prefix
+    and its hash are recorded in .dvcz/buildsCheckpoint, and unless
+    full is set only lines appended since are checked.  If the prefix
+    no longer matches, every line is checked.
+
+    The builds file is read a line at a time, so memory used does not
+    depend on its length.
+
+    If bl_cache_path is set, parsed BuildLists are cached there by
+    content key, so that a BuildList checked before is not parsed again.
+
+    Unless verify_sigs is False, the digital signature on each BuildList
+    is verified.  A check which skips signatures neither advances nor
+    replaces the checkpoint, which covers only lines whose signatures
+    have been verified.  If a CheckSummary is supplied, the numbers of lines
+    checked and signatures verified, and the time spent in each phase,
+    are recorded there.
+
+    Return the number of lines with problems.
     """
 
     builds_file = os.path.join(proj_path, '.dvcz', 'builds')
@@ -80,19 +451,93 @@ def check_builds(proj_path='./', u_path='/var/app/sharedev/U', verbose=False):
     if not os.path.exists(u_path):
         raise DvczError("cannot locate content-keyed store %s" % u_path)
 
-    u_dir = UDir.discover(u_path)
-    dirstruc = u_dir.dir_struc
-    hashtype = u_dir.hashtype
+    if summary is None:
+        summary = CheckSummary()
+    began = time.perf_counter()
+    from dvcz.store import Store
+    # the store's name is nominal; what matters is u_path
+    store = Store.discover('U', u_path)
+    dirstruc = store.dir_struc
+    hashtype = store.hashtype
+    regexp = line_re(hashtype)
+    bl_cache = None
+    if bl_cache_path:
+        bl_cache = BuildListCache(bl_cache_path, hashtype)
+    checkpoint_file = os.path.join(proj_path, '.dvcz', CHECKPOINT_FILE)
+
+    with open(builds_file, 'rb') as file:
+        if full:
+            (start, sha) = (0, new_sha(HashTypes.SHA2))
+        else:
+            (start, sha) = _verified_prefix(checkpoint_file, file, u_path)
+
+        if verbose:
+            print("check_builds: proj_path   = %s" % proj_path)
+            print("              builds_file = %s" % builds_file)
+            print("              dirstruc    = %s" % dirstruc.name)
+            print("              hashtype    = %s" % hashtype.name)
+            print("              workers     = %d" % workers)
+            print("              starting at = %d" % start)
+            if bl_cache is not None:
+                print("              bl_cache    = %s" % bl_cache.path)
+
+        # (offset, raw line, decoded line) for each line to be checked
+        todo = ((offset, raw, raw.decode('utf-8', 'replace'))
+                for offset, raw in scan_builds(file))
+
+        if workers > 1:
+            # importing this loads multiprocessing, so only if needed
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = None
 
-    if verbose:
-        print("check_builds: proj_path   = %s" % proj_path)
-        print("              builds_file = %s" % builds_file)
-        print("              dirstruc    = %s" % dirstruc.name)
-        print("              hashtype    = %s" % hashtype.name)
+        def check_all():
+            """
+            Yield (offset, raw line, result) for each line in order, where
+            result is what _check_builds_line() returns.  Lines
+            are handed to the worker processes a window at a time so
+            that only a window's worth of lines is held in memory.
+            """
+            if executor is None:
+                for offset, raw, line in todo:
+                    yield (offset, raw, _check_builds_line(
+                        line, store, hashtype, regexp, verbose, bl_cache,
+                        verify_sigs))
+                return
+            for window in _windows(todo, workers * CHUNK_SIZE * 4):
+                # map() yields results in the order lines were submitted
+                results = executor.map(
+                    _check_line_in_worker, [_[2] for _ in window],
+                    repeat(u_path), repeat(hashtype),
+                    repeat(bl_cache_path), repeat(verify_sigs),
+                    repeat(verbose), chunksize=CHUNK_SIZE)
+                for (offset, raw, _), result in zip(window, results):
+                    yield (offset, raw, result)
 
-    with open(builds_file, 'r') as file:
-        data = file.read()
-    lines = data.split('\n')[:-1]       # skip the last empty line
+        # the checkpoint advances over the lines verified without problems
+        verified = start
+        contiguous = True
+        bad_lines = 0
+        try:
+            for offset, raw, (msgs, notes, sig_ok, timings) in check_all():
+                summary.add(sig_ok, timings)
+                for note in notes:
+                    print(note)
+                if msgs:
+                    bad_lines += 1
+                    contiguous = False
+                    for msg in msgs:
+                        print(msg)
+                elif contiguous:
+                    sha.update(raw + b'\n')
+                    verified = offset
+        finally:
+            if executor:
+                executor.shutdown()
 
-    for line in lines:
-        _check_builds_line(line, u_dir, hashtype)
+    # start is 0 after a full check, which may replace a stale checkpoint
+    if verify_sigs and (verified > start or start == 0):
+        _write_checkpoint(checkpoint_file, verified, sha.hexdigest(), u_path)
+    summary.total_secs += time.perf_counter() - began
+    return bad_lines
@@ -0,0 +1,349 @@
+# dvcz/commit.py
+
+"""
+Generate a project BuildList and commit it, reusing cached content keys.
+
+This is dvcz's counterpart to BuildList.list_gen().  list_gen() hashes
+every file in the project on every call.  Here the project tree is
+walked once, content keys are taken from a StatCache where the stat()
+information still matches, and only new or changed files are hashed.
+The BuildList is then assembled from the serialized NLHTree, signed,
+written to .dvcz/lastBuildList, and logged to .dvcz/builds.
+
+When committing to a Store, content the store does not already hold is
+staged in the committer's in/COMMITTER_ID subdirectory using
+Store.ingest().
+"""
+
+import os
+import stat as statmod
+from concurrent.futures import ThreadPoolExecutor
+
+from dvcz import DvczError
+from dvcz.build_index import INDEX_FILE, append_build
+from dvcz.builds import CHECKPOINT_FILE
+from dvcz.hashing import hash_file, new_sha
+from dvcz.stat_cache import STAT_CACHE_DIR
+from xlattice import HashTypes
+from xlutil import make_ex_re
+
+__all__ = ['walk_proj', 'run_batches', 'hash_entries', 'make_tree_lines',
+           'CommitSummary', 'stage_entries', 'list_gen']
+
+# When hashing in parallel, files smaller than BATCH_BYTES are handed to
+# the worker threads in batches of up to BATCH_FILES files or BATCH_BYTES
+# bytes, whichever comes first.
+BATCH_BYTES = 4 * 1024 * 1024
+BATCH_FILES = 256
+
+# dvcz's own working files under a project's .dvcz/, which are never
+# committed: relative paths within the project
+_SIDECARS = frozenset(os.path.join('.dvcz', _) for _ in [
+    STAT_CACHE_DIR, CHECKPOINT_FILE, INDEX_FILE, INDEX_FILE + '.tmp'])
+
+
+def walk_proj(proj_path, excl=None):
+    """
+    Walk the project tree, yielding (depth, name, rel_path, stat) for
+    each directory and regular file in NLHTree order: entries in a
+    directory are sorted by name, and a directory's contents follow it.
+
+    Directories have a stat of None.  Names matching any of the
+    exclusion patterns are skipped, as are symbolic links, special
+    files, and dvcz's own working files in .dvcz/, such as the stat
+    cache and the build index.
+    """
+
+    ex_re = make_ex_re(excl) if excl else None
+
+    def walk(dir_path, rel_dir, depth):
+        """ Recurse through one directory. """
+        names = sorted(os.listdir(dir_path))
+        for name in names:
+            if ex_re and ex_re.match(name):
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if rel_path in _SIDECARS:
+                continue
+            path = os.path.join(dir_path, name)
+            info = os.lstat(path)
+            if statmod.S_ISDIR(info.st_mode):
+                yield (depth, name, rel_path, None)
+                yield from walk(path, rel_path, depth + 1)
+            elif statmod.S_ISREG(info.st_mode):
+                yield (depth, name, rel_path, info)
+
+    yield from walk(proj_path, '', 1)
+
+
+def _do_batch(batch, func):
+    """
+    Apply func to each abs_path in a list of (rel_path, abs_path),
+    returning a list of (rel_path, result).
+    """
+    return [(rel_path, func(abs_path)) for rel_path, abs_path in batch]
+
+
+def _make_batches(todo):
+    """
+    Group the (rel_path, abs_path, stat) triples in todo into batches
+    for the worker pool.  Large files are hashed on their own; small
+    files are grouped so that per-task overhead does not dominate.
+    The largest batches come first.
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for rel_path, abs_path, info in todo:
+        if info.st_size >= BATCH_BYTES:
+            batches.append((info.st_size, [(rel_path, abs_path)]))
+            continue
+        batch.append((rel_path, abs_path))
+        batch_size += info.st_size
+        if batch_size >= BATCH_BYTES or len(batch) >= BATCH_FILES:
+            batches.append((batch_size, batch))
+            batch = []
+            batch_size = 0
+    if batch:
+        batches.append((batch_size, batch))
+    batches.sort(key=lambda _: _[0], reverse=True)
+    return [_[1] for _ in batches]
+
+
+def run_batches(todo, func, jobs=1):
+    """
+    Apply func to the abs_path of each (rel_path, abs_path, stat) in
+    todo and return a dictionary mapping rel_path to the result.
+
+    If jobs is greater than 1, the work is spread across that many
+    threads.  hashlib releases the GIL while hashing, so this keeps
+    several cores busy.
+    """
+    results = {}
+    if jobs > 1 and len(todo) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_do_batch, batch, func)
+                       for batch in _make_batches(todo)]
+            for future in futures:
+                results.update(future.result())
+    else:
+        for rel_path, abs_path, _ in todo:
+            results[rel_path] = func(abs_path)
+    return results
+
+
+def hash_entries(proj_path, entries, hashtype=HashTypes.SHA2, cache=None,
+                 jobs=1, hash_func=None):
+    """
+    Given the entries from walk_proj(), return a dictionary mapping the
+    relative path of each file to its content key.
+
+    If a StatCache is supplied, keys are reused where the file has not
+    changed and the cache is updated with any keys computed.  If jobs
+    is greater than 1, files needing to be hashed are hashed in parallel.
+    The result does not depend on jobs.
+
+    hash_func, if supplied, is called with the path to each file which
+    needs hashing and must return its content key.
+    """
+    if hash_func is None:
+        def hash_func(abs_path):
+            """ Hash the file using the hashtype passed. """
+            return hash_file(abs_path, hashtype)
+
+    hashes = {}
+    todo = []
+    for _, _, rel_path, info in entries:
+        if info is None:
+            continue
+        if cache is not None:
+            hex_hash = cache.lookup(rel_path, info)
+            if hex_hash is not None:
+                hashes[rel_path] = hex_hash
+                continue
+        todo.append((rel_path, os.path.join(proj_path, rel_path), info))
+
+    hashes.update(run_batches(todo, hash_func, jobs))
+
+    if cache is not None:
+        for rel_path, _, info in todo:
+            cache.update(rel_path, info, hashes[rel_path])
+    return hashes
+
+
+def make_tree_lines(root_name, entries, hashes):
+    """
+    Return the serialized NLHTree for the project as a list of lines:
+    the root name, then one line per entry indented by depth, with
+    file lines ending in the content key.
+    """
+    lines = [root_name]
+    for depth, name, rel_path, info in entries:
+        if info is None:
+            lines.append("%s%s" % (' ' * depth, name))
+        else:
+            lines.append("%s%s %s" % (' ' * depth, name, hashes[rel_path]))
+    return lines
+
+
+class CommitSummary(object):
+    """
+    What list_gen() did when staging files: for each file staged, the
+    Store.ingest() method used to copy it; the number of files not
+    staged because their content was already in the store; and the
+    number of bytes copied into the store.
+    """
+
+    def __init__(self):
+        self.methods = {}           # rel_path -> INGEST_* method
+        self.deduped = 0
+        self.bytes_staged = 0
+
+    def method_counts(self):
+        """ Return a dictionary mapping ingest method to file count. """
+        counts = {}
+        for method in self.methods.values():
+            counts[method] = counts.get(method, 0) + 1
+        return counts
+
+
+def stage_entries(store, committer_id, proj_path, entries,
+                  cache=None, jobs=1, zero_copy=False, hardlink=False,
+                  summary=None):
+    """
+    Stage the files listed in entries in the committer's in/COMMITTER_ID
+    subdirectory of the store, returning a dictionary mapping the
+    relative path of each file to its content key.
+
+    Keys for files the StatCache knows are checked against the store
+    and staging area in one batched has_keys() call, and only content
+    not already there is staged, once per key.  Every other file is
+    streamed straight into Store.ingest(), hashed as it is copied, and
+    the copy dropped if its key turns out to be present already; so
+    each file is read at most once, and with zero_copy perhaps not at
+    all.
+    """
+    if not committer_id:
+        raise DvczError("committer ID required to commit to a store")
+    if summary is None:
+        summary = CommitSummary()
+    methods = {}                # abs_path -> ingest method
+    lengths = {}                # abs_path -> bytes staged
+    known = {}                  # abs_path -> key already computed
+
+    def ingest(abs_path):
+        """ Stage the file, returning its content key. """
+        key = known.get(abs_path)
+        (key, length, method) = store.ingest(
+            abs_path, committer_id, key, zero_copy, hardlink,
+            dedup=key is None)
+        methods[abs_path] = method
+        lengths[abs_path] = length
+        return key
+
+    hashes = {}
+    by_key = {}                 # key -> (rel_path, abs_path, stat)
+    todo = []                   # files not in the StatCache
+    files = 0
+    for _, _, rel_path, info in entries:
+        if info is None:
+            continue
+        files += 1
+        abs_path = os.path.join(proj_path, rel_path)
+        key = cache.lookup(rel_path, info) if cache is not None else None
+        if key is None:
+            todo.append((rel_path, abs_path, info))
+        else:
+            hashes[rel_path] = key
+            by_key.setdefault(key, (rel_path, abs_path, info))
+    # what is found is freshened, protecting it from a concurrent gc
+    for key in store.has_keys(by_key.keys(), committer_id, freshen=True):
+        known[by_key[key][1]] = key
+        todo.append(by_key[key])
+    staged = run_batches(todo, ingest, jobs)
+    # a file changed since it was hashed is staged under its new key
+    hashes.update(staged)
+    if cache is not None:
+        for rel_path, _, info in todo:
+            cache.update(rel_path, info, staged[rel_path])
+
+    # files racing to stage the same content count once
+    credited = set()
+    for rel_path, abs_path, _ in todo:
+        if methods[abs_path] is None or staged[rel_path] in credited:
+            continue
+        credited.add(staged[rel_path])
+        summary.methods[rel_path] = methods[abs_path]
+        summary.bytes_staged += lengths[abs_path]
+    summary.deduped += files - len(credited)
+    return hashes
+
+
+def list_gen(title, proj_path, dvcz_path, list_file, key_path, excl,
+             logging=False, store=None, committer_id='',
+             hashtype=HashTypes.SHA2, version='0.0.0', cache=None, jobs=1,
+             zero_copy=False, hardlink=False, summary=None, sk_priv=None):
+    """
+    Create a signed BuildList for the project at proj_path.
+
+    The BuildList is written to dvcz_path/list_file.  If logging, a line
+    "TIMESTAMP vVERSION HASH" is appended to dvcz_path/builds and the
+    build index brought up to date.  If jobs is greater than 1, files
+    are hashed in parallel.
+
+    If a Store is supplied, the project files and the BuildList itself
+    are staged in the committer's in/COMMITTER_ID subdirectory of the
+    store using stage_entries().  zero_copy and hardlink are passed to
+    Store.ingest().  If a CommitSummary is supplied, what was staged is
+    recorded there.
+
+    The BuildList is signed with sk_priv if it is supplied and otherwise
+    with the RSA key read from key_path.
+
+    Return the BuildList.
+    """
+
+    if not os.path.isdir(proj_path):
+        raise DvczError("project directory %s does not exist" % proj_path)
+
+    entries = list(walk_proj(proj_path, excl))
+    if store is None:
+        hashes = hash_entries(proj_path, entries, hashtype, cache, jobs)
+    else:
+        # pylint: disable=no-member
+        if store.hashtype != hashtype:
+            raise DvczError("store %s uses %s, not %s" % (
+                store.name, store.hashtype.name, hashtype.name))
+        hashes = stage_entries(store, committer_id, proj_path, entries,
+                               cache, jobs, zero_copy, hardlink, summary)
+
+    if cache is not None:
+        cache.save()
+
+    # buildlist and nlhtree are slow to import; only list_gen needs them
+    from buildlist import BuildList, read_rsa_key
+    from nlhtree import NLHTree
+
+    root_name = os.path.basename(os.path.abspath(proj_path))
+    lines = make_tree_lines(root_name, entries, hashes)
+    tree = NLHTree.create_from_string_array(lines, hashtype)
+
+    if sk_priv is None:
+        sk_priv = read_rsa_key(key_path)
+    blist = BuildList(title, sk_priv.publickey(), tree)
+    blist.sign(sk_priv)
+    data = blist.__str__().encode('utf-8')
+    sha = new_sha(hashtype)
+    sha.update(data)
+    bl_hash = sha.hexdigest()
+
+    with open(os.path.join(dvcz_path, list_file), 'wb') as file:
+        file.write(data)
+
+    if store is not None:
+        store.ingest_data(data, committer_id)
+
+    if logging:
+        append_build(dvcz_path, version, bl_hash, hashtype)
+
+    return blist
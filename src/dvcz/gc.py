@@ -0,0 +1,348 @@
+# dvcz/gc.py
+
+"""
+Mark-and-sweep garbage collection for a content-keyed Store.
+
+Nothing else ever removes content from a store.  A collection first
+marks every key which is live:
+
+* the key of each BuildList logged in a project's .dvcz/builds,
+* every key listed in such a BuildList, and
+* every key in a staging area, u_path/in/COMMITTER_ID.
+
+Projects are marked in parallel by a pool of worker processes, each
+writing the keys it finds as a sorted run (see dvcz/key_index.py).  The
+runs are merged into u_path/gc/marked.  If a BuildList cannot be found
+the collection stops, since what it lists cannot be marked, unless
+forced.
+
+The sweep then walks the store's keys in order, from the store's
+KeyIndex, and deletes each object which is not marked and was last
+modified more than a grace period before the mark began.  The grace
+period protects objects put into the store by commits running while the
+collection runs, and objects such commits find already stored, which
+they freshen (see Store.freshen()) rather than storing again.  A packed
+object is taken to have been modified when its pack was last written
+or freshened, and is only marked deleted; a full repack reclaims its
+space.  Progress is recorded every CHECKPOINT_EVERY objects in
+u_path/gc/state, one line
+
+    MARK_TIME LAST_KEY SWEPT BYTES
+
+so an interrupted collection can be resumed where it stopped, reusing
+the mark.  A dry run deletes nothing and reports the bytes which would
+be reclaimed; its mark may then be used by a resumed collection.
+
+A BuildList is not parsed to find the keys it lists.  Every
+whitespace-separated token of the right length made up of hex digits
+is taken to be a key.  This may mark a few more objects than needed but
+never fewer, and avoids importing buildlist and its RSA code.
+"""
+
+import heapq
+import os
+import time
+
+from dvcz import DvczError
+from dvcz.builds import read_builds
+from dvcz.key_index import KeyIndex, SortedRun, digest_len, write_run
+
+__all__ = ['GC_DIR', 'GRACE_SECS', 'CHECKPOINT_EVERY', 'GCSummary',
+           'GarbageCollector', 'mark_project']
+
+GC_DIR = 'gc'                       # relative to u_path
+GRACE_SECS = 7 * 24 * 3600          # default grace period
+CHECKPOINT_EVERY = 1024             # objects swept between checkpoints
+
+_HEX_DIGITS = frozenset(b'0123456789abcdef')
+
+
+def _keys_in(data, hex_len):
+    """ Yield the binary digests of the hex keys in a BuildList. """
+    for token in data.split():
+        if len(token) == hex_len and _HEX_DIGITS.issuperset(token):
+            yield bytes.fromhex(token.decode('ascii'))
+
+
+def _read_build_list(key, store, in_paths):
+    """
+    Return the BuildList with the key, from the store or from a staging
+    area, as bytes, or None if it cannot be found.
+    """
+    data = store.get_data(key)
+    if data:
+        return data
+    for in_path in in_paths:
+        try:
+            with open(os.path.join(in_path, key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def mark_project(proj_path, run_path, u_path, dir_struc, hashtype,
+                 in_paths):
+    """
+    Write the keys live in one project as a sorted run at run_path.
+    Return (number of keys, number of BuildLists, keys of BuildLists
+    which could not be found).  This is run in the worker processes.
+    """
+    from dvcz.store import Store
+
+    builds_file = os.path.join(proj_path, '.dvcz', 'builds')
+    if not os.path.exists(builds_file):
+        raise DvczError("builds file at %s does not exist" % builds_file)
+    # a Store rather than a UDir, so that packed BuildLists are found
+    store = Store('U', u_path, dir_struc, hashtype)
+    hex_len = 2 * digest_len(hashtype)
+    live = set()
+    build_lists = 0
+    missing = []
+    for record in read_builds(builds_file, hashtype):
+        if len(record.hash) != hex_len:
+            continue
+        build_lists += 1
+        live.add(bytes.fromhex(record.hash))
+        data = _read_build_list(record.hash, store, in_paths)
+        if data is None:
+            missing.append(record.hash)
+            continue
+        live.update(_keys_in(data, hex_len))
+    count = write_run(run_path, sorted(live), digest_len(hashtype))
+    return (count, build_lists, missing)
+
+
+def _merged_unique(iterables):
+    """ Yield each digest in the sorted iterables once, in order. """
+    last = None
+    for digest in heapq.merge(*iterables):
+        if digest != last:
+            yield digest
+        last = digest
+
+
+class GCSummary(object):
+    """ What a garbage collection found and did. """
+
+    def __init__(self):
+        self.projects = 0
+        self.build_lists = 0
+        self.missing = []               # (proj_path, key) not found
+        self.marked = 0
+        self.staged = 0
+        self.scanned = 0
+        self.swept = 0
+        self.bytes_swept = 0
+        self.young = 0
+        self.mark_secs = 0.0
+        self.sweep_secs = 0.0
+        self.dry_run = False
+        self.resumed = False
+
+    def __str__(self):
+        action = 'reclaimable' if self.dry_run else 'deleted'
+        return '\n'.join([
+            "projects:       %d, %d build lists, %d missing" % (
+                self.projects, self.build_lists, len(self.missing)),
+            "marked:         %d keys, %d staged" % (
+                self.marked, self.staged),
+            "swept:          %d scanned, %d %s, %d within grace period" % (
+                self.scanned, self.swept, action, self.young),
+            "%-15s %d bytes" % (action + ':', self.bytes_swept),
+            "time (seconds): %.3f marking, %.3f sweeping%s" % (
+                self.mark_secs, self.sweep_secs,
+                ' (resumed)' if self.resumed else ''), ])
+
+
+class GarbageCollector(object):
+    """
+    Collect garbage in a Store.  Objects younger than grace seconds
+    when the mark began are never deleted; jobs is the number of worker
+    processes marking projects.
+    """
+
+    def __init__(self, store, grace=GRACE_SECS, jobs=4):
+        if grace < 0:
+            raise DvczError("grace period may not be negative")
+        self._store = store
+        self._grace = grace
+        self._jobs = jobs
+        self._path = os.path.join(store.u_path, GC_DIR)
+        self._marked_path = os.path.join(self._path, 'marked')
+        self._state_path = os.path.join(self._path, 'state')
+
+    @property
+    def path(self):
+        """ Return the directory holding the mark and progress. """
+        return self._path
+
+    # STATE ---------------------------------------------------------
+
+    def read_state(self):
+        """
+        Return (mark_time, last_key, swept, bytes_swept) for the
+        collection in progress, or None if there is none.  last_key is
+        '' if the sweep has not begun.
+        """
+        if not os.path.exists(self._marked_path):
+            return None
+        try:
+            with open(self._state_path, 'r') as file:
+                parts = file.read().split()
+            (mark_time, last_key, swept, bytes_swept) = parts
+            return (int(mark_time), '' if last_key == '-' else last_key,
+                    int(swept), int(bytes_swept))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_state(self, mark_time, last_key, swept, bytes_swept):
+        """ Record the progress of the collection. """
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write("%d %s %d %d\n" % (mark_time, last_key or '-',
+                                          swept, bytes_swept))
+        os.replace(tmp_path, self._state_path)
+
+    def _clear(self):
+        """ Remove the mark and progress of a finished collection. """
+        for name in os.listdir(self._path):
+            os.unlink(os.path.join(self._path, name))
+
+    # MARK ----------------------------------------------------------
+
+    def mark(self, proj_paths, summary, force=False):
+        """
+        Mark the keys live in the projects and the staging areas,
+        writing them to gc/marked and starting a new collection.  Raise
+        DvczError if a BuildList is missing, unless force, or if there
+        are no projects, since then everything not staged is garbage.
+        """
+        if not proj_paths:
+            raise DvczError("no projects to mark")
+        store = self._store
+        # pylint: disable=no-member
+        hashtype = store.hashtype
+        dlen = digest_len(hashtype)
+        os.makedirs(self._path, 0o755, exist_ok=True)
+        self._clear()
+        mark_time = int(time.time())
+        began = time.perf_counter()
+
+        in_root = os.path.join(store.u_path, 'in')
+        in_paths = [_.path for _ in os.scandir(in_root) if _.is_dir()]
+        run_paths = [os.path.join(self._path, 'proj-%d' % ndx)
+                     for ndx in range(len(proj_paths))]
+        args = (run_paths, [store.u_path] * len(proj_paths),
+                # pylint: disable=no-member
+                [store.dir_struc] * len(proj_paths),
+                [hashtype] * len(proj_paths), [in_paths] * len(proj_paths))
+        if self._jobs > 1 and len(proj_paths) > 1:
+            # importing this loads multiprocessing, so only if needed
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self._jobs) as executor:
+                results = list(executor.map(mark_project, proj_paths, *args))
+        else:
+            results = list(map(mark_project, proj_paths, *args))
+        for proj_path, (_, build_lists, missing) in zip(proj_paths, results):
+            summary.projects += 1
+            summary.build_lists += build_lists
+            summary.missing.extend((proj_path, _) for _ in missing)
+
+        staged_path = os.path.join(self._path, 'staged')
+        summary.staged = write_run(
+            staged_path,
+            sorted(set(bytes.fromhex(_) for _ in store.staged_keys())), dlen)
+
+        runs = [SortedRun(_, dlen) for _ in run_paths + [staged_path]]
+        summary.marked = write_run(self._marked_path,
+                                   _merged_unique(iter(_) for _ in runs),
+                                   dlen)
+        for run in runs:
+            run.close()
+            os.unlink(run.path)
+        summary.mark_secs += time.perf_counter() - began
+
+        if summary.missing and not force:
+            os.unlink(self._marked_path)
+            raise DvczError("%d BuildLists not found, first %s in %s" % (
+                len(summary.missing), summary.missing[0][1],
+                summary.missing[0][0]))
+        self._write_state(mark_time, '', 0, 0)
+
+    # SWEEP ---------------------------------------------------------
+
+    def sweep(self, summary, dry_run=False):
+        """
+        Delete objects in the store which are neither marked nor within
+        the grace period, continuing from where any earlier sweep of
+        the same mark stopped.  If dry_run, delete nothing but count
+        what would be deleted.
+        """
+        state = self.read_state()
+        if state is None:
+            raise DvczError("no garbage collection to sweep in %s" %
+                            self._path)
+        (mark_time, last_key, swept, bytes_swept) = state
+        summary.dry_run = dry_run
+        summary.swept += swept
+        summary.bytes_swept += bytes_swept
+        store = self._store
+        # pylint: disable=no-member
+        dlen = digest_len(store.hashtype)
+        cutoff = mark_time - self._grace
+        began = time.perf_counter()
+
+        marked = SortedRun(self._marked_path, dlen)
+        # The store's own index, built if need be, records deletions;
+        # the walk uses a second KeyIndex so that they do not disturb it.
+        store.key_index(self._jobs)
+        # pylint: disable=no-member
+        index = KeyIndex(store.u_path, store.dir_struc.name,
+                         store.hashtype).load()
+        since_checkpoint = 0
+        try:
+            for key in index:
+                if key <= last_key:
+                    continue
+                summary.scanned += 1
+                if bytes.fromhex(key) in marked:
+                    continue
+                info = store.stat_key(key)
+                if info is None:
+                    continue
+                (mtime, length) = info
+                if mtime > cutoff:
+                    summary.young += 1
+                    continue
+                if not dry_run:
+                    store.delete(key)
+                summary.swept += 1
+                summary.bytes_swept += length
+                since_checkpoint += 1
+                if since_checkpoint >= CHECKPOINT_EVERY and not dry_run:
+                    self._write_state(mark_time, key, summary.swept,
+                                      summary.bytes_swept)
+                    since_checkpoint = 0
+        finally:
+            marked.close()
+            index.close()
+            summary.sweep_secs += time.perf_counter() - began
+        if not dry_run:
+            self._clear()
+
+    def collect(self, proj_paths, dry_run=False, resume=False, force=False,
+                summary=None):
+        """
+        Mark and sweep, returning a GCSummary.  If resume and there is
+        a collection in progress, its mark is reused and its sweep
+        continued; otherwise the projects are marked afresh.
+        """
+        if summary is None:
+            summary = GCSummary()
+        if resume and self.read_state() is not None:
+            summary.resumed = True
+        else:
+            self.mark(proj_paths, summary, force)
+        self.sweep(summary, dry_run)
+        return summary
@@ -0,0 +1,51 @@
+# dvcz/hashing.py
+
+""" Content hashing shared by the dvcz commands. """
+
+import hashlib
+import sys
+
+from xlattice import HashTypes
+
+if sys.version_info < (3, 6):
+    # pylint: disable=unused-import
+    import sha3
+    assert sha3     # suppress warning
+
+__all__ = ['BUF_SIZE', 'new_sha', 'hash_file']
+
+BUF_SIZE = 1024 * 1024      # bytes read from disk at a time
+
+
+def new_sha(hashtype=HashTypes.SHA2):
+    """
+    Return a fresh hashlib object of the type used for content keys.
+
+    If the hashtype is not one we know about, raise NotImplementedError.
+    """
+    if hashtype == HashTypes.SHA1:
+        sha = hashlib.sha1()
+    elif hashtype == HashTypes.SHA2:
+        sha = hashlib.sha256()
+    elif hashtype == HashTypes.SHA3:
+        sha = hashlib.sha3_256()
+    elif hashtype == HashTypes.BLAKE2B:
+        sha = hashlib.blake2b(digest_size=32)
+    else:
+        raise NotImplementedError
+    return sha
+
+
+def hash_file(path, hashtype=HashTypes.SHA2):
+    """
+    Return the content key of the file at path, a 40- or 64-character
+    hex value.
+    """
+    sha = new_sha(hashtype)
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(BUF_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -0,0 +1,541 @@
+# dvcz/key_index.py
+
+"""
+Persistent index of the content keys in a Store.
+
+Asking whether a key is in a store means a stat() in the store's
+directory tree, and on a large store that tree's metadata is rarely in
+memory.  A KeyIndex keeps the binary digests of the keys in the store
+next to it:
+
+    u_path/
+        idx/
+            built           # present once the index is complete
+            lock
+            log             # records appended as keys come and go
+            run-00000001    # sorted binary digests
+            run-00000002
+            ...
+
+A run is a header followed by the digests it holds in ascending order,
+and is searched by bisection through an mmap.  Most runs list keys
+added to the store; a tombstone run lists keys removed from it.  A key
+is in the index if the newest run listing it is not a tombstone run.
+
+Keys added or removed are appended to the log, one byte, '+' or '-',
+followed by the digest, and held in memory.  When the log grows to
+FLUSH_AT records the keys added are written out as a new run and those
+removed as a tombstone run; if there would then be more than MAX_RUNS
+runs, the runs are merged into one instead, dropping the tombstones.
+The log is then replaced by an empty one.  The log's header carries a
+generation number, bumped each time the log is replaced, so that a
+process can tell a new log from the one it read before, whatever inode
+the new one has.
+
+The index knows only what it has been told.  Store keeps it up to date
+as keys are put into or deleted from the store, but files added to or
+removed from u_path in any other way are not seen until the index is
+rebuilt.  rebuild() scans the store's directories using a pool of
+threads.
+
+Appends hold a shared lock on idx/lock and flushes an exclusive one, so
+several processes may update the same index.  A process notices keys
+added by another when it fails to find a key or counts the keys.
+"""
+
+import heapq
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from dvcz import DvczError
+from xlattice import HashTypes
+
+__all__ = ['IDX_DIR', 'FLUSH_AT', 'MAX_RUNS', 'KeyIndex', 'SortedRun',
+           'digest_len', 'write_run']
+
+IDX_DIR = 'idx'                 # relative to u_path
+
+FLUSH_AT = 64 * 1024            # log records before writing a run
+MAX_RUNS = 8                    # runs before merging them into one
+
+_MAGIC = b'DVKX'
+# magic, digest length, whether a tombstone run, count
+_HEADER = struct.Struct('<4sBBxxQ')
+_LOG_MAGIC = b'DVKL'
+_LOG_HEADER = struct.Struct('<4sxxxxQ')  # magic, generation
+_ADD = b'+'
+_DEL = b'-'
+
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+def digest_len(hashtype):
+    """ Return the length in bytes of a content key of this hashtype. """
+    return 20 if hashtype == HashTypes.SHA1 else 32
+
+
+def _unique(digests):
+    """ Yield each of the sorted digests once. """
+    last = None
+    for digest in digests:
+        if digest != last:
+            yield digest
+        last = digest
+
+
+def _is_key(name, hex_len):
+    """ Return whether a file name is a content key. """
+    return len(name) == hex_len and _HEX_DIGITS.issuperset(name)
+
+
+def _key_dirs(u_path, dir_struc_name):
+    """
+    Return the directories of the store which may hold content keys.
+    """
+    if dir_struc_name == 'DIR_FLAT':
+        return [u_path]
+    width = 1 if dir_struc_name == 'DIR16x16' else 2
+    dirs = []
+    for top in os.scandir(u_path):
+        if len(top.name) != width or not top.is_dir() or \
+                not _HEX_DIGITS.issuperset(top.name):
+            continue
+        dirs.extend(_.path for _ in os.scandir(top.path)
+                    if len(_.name) == width and _.is_dir() and
+                    _HEX_DIGITS.issuperset(_.name))
+    return dirs
+
+
+def _scan_dir(dir_path, hex_len):
+    """ Return the binary digests of the keys in one directory. """
+    return [bytes.fromhex(_.name) for _ in os.scandir(dir_path)
+            if _is_key(_.name, hex_len) and _.is_file()]
+
+
+def write_run(path, digests, dlen, removes=False):
+    """
+    Write the sorted digests, each dlen bytes long, as a run at path,
+    returning how many there were.  If removes is set, the run is a
+    tombstone run.  The run is written to a temporary file which then
+    replaces path.
+    """
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, dlen, removes, 0))
+        for digest in digests:
+            file.write(digest)
+            count += 1
+        file.seek(0)
+        file.write(_HEADER.pack(_MAGIC, dlen, removes, count))
+    os.replace(tmp_path, path)
+    return count
+
+
+class SortedRun(object):
+    """ A sorted run of digests on disk, searched through an mmap. """
+
+    def __init__(self, path, dlen):
+        self.path = path
+        self._dlen = dlen
+        with open(path, 'rb') as file:
+            (magic, run_dlen, removes, count) = _HEADER.unpack(
+                file.read(_HEADER.size))
+            if magic != _MAGIC or run_dlen != dlen or \
+                    os.fstat(file.fileno()).st_size != \
+                    _HEADER.size + count * dlen:
+                raise DvczError("damaged key index run %s" % path)
+            self.removes = bool(removes)    # a tombstone run
+            self.count = count
+            self._map = None
+            if count:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+
+    def _at(self, ndx):
+        """ Return the ndx-th digest. """
+        offset = _HEADER.size + ndx * self._dlen
+        return self._map[offset:offset + self._dlen]
+
+    def __contains__(self, digest):
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._at(mid) < digest:
+                low = mid + 1
+            else:
+                high = mid
+        return low < self.count and self._at(low) == digest
+
+    def __iter__(self):
+        for ndx in range(self.count):
+            yield self._at(ndx)
+
+    def close(self):
+        """ Release the mmap. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class KeyIndex(object):
+    """
+    Index of the keys in the store at u_path, whose layout is named by
+    dir_struc_name ('DIR_FLAT', 'DIR16x16', or 'DIR256x256').
+    """
+
+    def __init__(self, u_path, dir_struc_name, hashtype=HashTypes.SHA2):
+        self._u_path = u_path
+        self._dir_struc_name = dir_struc_name
+        self._dlen = digest_len(hashtype)
+        self._path = os.path.join(u_path, IDX_DIR)
+        self._log_path = os.path.join(self._path, 'log')
+        self._runs = []
+        self._added = set()         # digests added since the last flush
+        self._removed = set()       # digests removed since the last flush
+        self._log_gen = None        # generation of the log read
+        self._log_stamp = None      # (inode, size, mtime) when last read
+        self._log_offset = _LOG_HEADER.size
+        self._lock_fd = None
+        self.refreshes = 0
+
+    @property
+    def path(self):
+        """ Return the path to the directory holding the index. """
+        return self._path
+
+    def is_built(self):
+        """ Return whether a complete index exists on disk. """
+        return os.path.exists(os.path.join(self._path, 'built'))
+
+    # LOCKING -------------------------------------------------------
+
+    def _lock(self, exclusive):
+        """ Take the index lock, shared or exclusive. """
+        if fcntl is None:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(os.path.join(self._path, 'lock'),
+                                    os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd,
+                    fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _unlock(self):
+        """ Release the index lock. """
+        if fcntl is not None and self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # LOADING -------------------------------------------------------
+
+    def _run_paths(self):
+        """ Return the paths to the runs, oldest first. """
+        return [os.path.join(self._path, _)
+                for _ in sorted(os.listdir(self._path))
+                if _.startswith('run-')]
+
+    def load(self, jobs=4, extra=()):
+        """
+        Read the index, rebuilding it with jobs threads if it is
+        missing.  Return the KeyIndex.  extra is as for rebuild().
+        """
+        if not self.is_built():
+            return self.rebuild(jobs, extra)
+        self._lock(False)
+        try:
+            self._load()
+        finally:
+            self._unlock()
+        return self
+
+    def _load(self):
+        """ Map the runs and replay the log, holding the lock. """
+        self._close_runs()
+        self._runs = [SortedRun(_, self._dlen) for _ in self._run_paths()]
+        self._added = set()
+        self._removed = set()
+        self._log_gen = None
+        self._log_stamp = None
+        self._log_offset = _LOG_HEADER.size
+        self._read_log()
+
+    def _read_log(self):
+        """
+        Replay log records not yet seen.  A missing log is of
+        generation 0.  Return False, having replayed nothing, if the
+        log has been replaced since it was last read.
+        """
+        try:
+            with open(self._log_path, 'rb') as file:
+                header = file.read(_LOG_HEADER.size)
+                if len(header) < _LOG_HEADER.size or \
+                        header[:len(_LOG_MAGIC)] != _LOG_MAGIC:
+                    raise DvczError("damaged key index log %s" %
+                                    self._log_path)
+                generation = _LOG_HEADER.unpack(header)[1]
+                if self._log_gen is not None and \
+                        generation != self._log_gen:
+                    return False
+                info = os.fstat(file.fileno())
+                file.seek(self._log_offset)
+                data = file.read()
+        except FileNotFoundError:
+            if self._log_gen not in (None, 0):
+                return False
+            self._log_gen = 0
+            self._log_stamp = None
+            return True
+        self._log_gen = generation
+        self._log_stamp = (info.st_ino, info.st_size, info.st_mtime_ns)
+        rec_len = 1 + self._dlen
+        whole = len(data) - len(data) % rec_len     # ignore a partial record
+        for offset in range(0, whole, rec_len):
+            digest = data[offset + 1:offset + rec_len]
+            if data[offset:offset + 1] == _ADD:
+                self._added.add(digest)
+                self._removed.discard(digest)
+            else:
+                self._added.discard(digest)
+                self._removed.add(digest)
+        self._log_offset += whole
+        return True
+
+    def _log_generation(self):
+        """ Return the generation of the log on disk. """
+        try:
+            with open(self._log_path, 'rb') as file:
+                header = file.read(_LOG_HEADER.size)
+        except FileNotFoundError:
+            return 0
+        if len(header) < _LOG_HEADER.size:
+            return 0
+        return _LOG_HEADER.unpack(header)[1]
+
+    def _new_log(self, generation):
+        """
+        Replace the log with an empty one of the given generation.
+        """
+        tmp_path = self._log_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(_LOG_HEADER.pack(_LOG_MAGIC, generation))
+        os.replace(tmp_path, self._log_path)
+
+    def refresh(self):
+        """
+        Pick up changes made by other processes.  Return whether there
+        may have been any.
+        """
+        try:
+            info = os.stat(self._log_path)
+            stamp = (info.st_ino, info.st_size, info.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._log_stamp:
+            return False
+        self.refreshes += 1
+        self._lock(False)
+        try:
+            if not self._read_log():
+                self._load()            # flushed by another process
+        finally:
+            self._unlock()
+        return True
+
+    # QUERIES -------------------------------------------------------
+
+    def _in_runs(self, digest):
+        """ Return whether the runs say the digest is in the store. """
+        for run in reversed(self._runs):
+            if digest in run:
+                return not run.removes
+        return False
+
+    def _has(self, digest):
+        """ Look the digest up in memory and in the runs. """
+        if digest in self._added:
+            return True
+        if digest in self._removed:
+            return False
+        return self._in_runs(digest)
+
+    def __contains__(self, key):
+        digest = bytes.fromhex(key)
+        if self._has(digest):
+            return True
+        return self.refresh() and self._has(digest)
+
+    def missing(self, keys):
+        """ Return those of the keys which are not in the index. """
+        absent = [_ for _ in keys if not self._has(bytes.fromhex(_))]
+        if absent and self.refresh():
+            absent = [_ for _ in absent if not self._has(bytes.fromhex(_))]
+        return absent
+
+    def _merged(self):
+        """ Yield every digest in the index, in order, once. """
+        def tagged(digests, age, removed):
+            """ Yield (digest, age, removed) for each digest. """
+            for digest in digests:
+                yield (digest, age, removed)
+
+        # for each digest the newest record, the one of least age, wins
+        sources = [tagged(sorted(self._added), 0, False),
+                   tagged(sorted(self._removed), 0, True)]
+        for age, run in enumerate(reversed(self._runs), 1):
+            sources.append(tagged(run, age, run.removes))
+        last = None
+        for digest, _, removed in heapq.merge(*sources):
+            if digest != last and not removed:
+                yield digest
+            last = digest
+
+    def __iter__(self):
+        """ Yield the keys in the index in ascending order. """
+        self.refresh()
+        for digest in self._merged():
+            yield digest.hex()
+
+    def __len__(self):
+        self.refresh()
+        return sum(1 for _ in self._merged())
+
+    # UPDATES -------------------------------------------------------
+
+    def _append(self, records):
+        """ Append records to the log, flushing it if it is long. """
+        os.makedirs(self._path, 0o755, exist_ok=True)
+        if not os.path.exists(self._log_path):
+            self._lock(True)
+            try:
+                if not os.path.exists(self._log_path):
+                    self._new_log(0)
+            finally:
+                self._unlock()
+        self._lock(False)
+        try:
+            fd_ = os.open(self._log_path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd_, b''.join(records))
+            finally:
+                os.close(fd_)
+            if not self._read_log():
+                self._load()            # flushed by another process
+        finally:
+            self._unlock()
+        if len(self._added) + len(self._removed) >= FLUSH_AT:
+            self.flush()
+
+    def add(self, key):
+        """ Record that the key is in the store. """
+        self.add_many([key])
+
+    def add_many(self, keys):
+        """ Record that each of the keys is in the store. """
+        records = [_ADD + bytes.fromhex(_) for _ in keys]
+        if records:
+            self._append(records)
+
+    def discard(self, key):
+        """ Record that the key is no longer in the store. """
+        self._append([_DEL + bytes.fromhex(key)])
+
+    def _write_run(self, digests, removes=False):
+        """
+        Write the sorted digests as the next run, returning its path.
+        """
+        paths = self._run_paths()
+        seq = int(paths[-1].rsplit('-', 1)[1]) + 1 if paths else 1
+        path = os.path.join(self._path, 'run-%08d' % seq)
+        write_run(path, digests, self._dlen, removes)
+        return path
+
+    def flush(self):
+        """
+        Write the keys added since the last flush as a new run and
+        those removed as a tombstone run, or if there would be more
+        than MAX_RUNS runs, merge everything into one run.  The log is
+        then replaced by an empty one.
+        """
+        self._lock(True)
+        try:
+            if not self._read_log():
+                self._load()
+            if not self._added and not self._removed:
+                return
+            # only what changes the runs' answer need be written
+            added = sorted(_ for _ in self._added if not self._in_runs(_))
+            removed = sorted(_ for _ in self._removed if self._in_runs(_))
+            old_paths = [_.path for _ in self._runs]
+            if len(self._runs) + bool(added) + bool(removed) > MAX_RUNS:
+                self._write_run(self._merged())
+                doomed = old_paths
+            else:
+                if added:
+                    self._write_run(added)
+                if removed:
+                    self._write_run(removed, removes=True)
+                doomed = []
+            self._new_log(self._log_gen + 1)
+            for path in doomed:
+                os.unlink(path)
+            self._load()
+        finally:
+            self._unlock()
+
+    def rebuild(self, jobs=4, extra=()):
+        """
+        Scan the store and replace the index with what is found,
+        listing directories with jobs threads.  Keys held elsewhere
+        than in the directory tree, as in pack files, are passed as
+        extra, an iterable of hex keys.  Return the KeyIndex.
+        """
+        os.makedirs(self._path, 0o755, exist_ok=True)
+        built_path = os.path.join(self._path, 'built')
+        self._lock(True)
+        try:
+            if os.path.exists(built_path):
+                os.unlink(built_path)
+            dirs = _key_dirs(self._u_path, self._dir_struc_name)
+            hex_len = 2 * self._dlen
+            if jobs > 1 and len(dirs) > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    found = executor.map(_scan_dir, dirs,
+                                         [hex_len] * len(dirs))
+                    digests = sorted(d for _ in found for d in _)
+            else:
+                digests = sorted(d for _ in dirs
+                                 for d in _scan_dir(_, hex_len))
+            more = sorted(set(bytes.fromhex(_) for _ in extra))
+            if more:
+                digests = list(_unique(heapq.merge(digests, more)))
+            old_paths = self._run_paths()
+            self._close_runs()
+            self._write_run(digests)
+            for path in old_paths:
+                os.unlink(path)
+            self._new_log(self._log_generation() + 1)
+            with open(built_path, 'w'):
+                pass
+            self._load()
+        finally:
+            self._unlock()
+        return self
+
+    def _close_runs(self):
+        """ Release the mmaps of the runs. """
+        for run in self._runs:
+            run.close()
+        self._runs = []
+
+    def close(self):
+        """ Release the runs and the lock file. """
+        self._close_runs()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
@@ -0,0 +1,187 @@
+# dvcz/key_pool.py
+
+"""
+A pool of pre-generated RSA keys.
+
+Generating a 2048-bit RSA key takes long enough that adding many users
+at once spends most of its time in RSA.generate().  A KeyPool holds keys
+generated ahead of time, by default under the user's .dvcz/ directory:
+
+    $HOME/.dvcz/
+        keyPool/
+            1024/
+            2048/
+                0123456789abcdef.pem
+                ...
+
+Each key is a PEM-formatted file readable only by its owner, in a
+directory accessible only by its owner.  A key is taken from the pool
+by renaming it, so that no two processes can take the same key, and is
+then deleted from the pool.  A key left renamed by a process which died
+before deleting it is deleted by the next fill().
+
+Filling holds an exclusive lock on keyPool/KEY_BITS.lock, so that two
+processes filling the pool at once do not both generate the keys it
+lacks.
+"""
+
+import os
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from dvcz import DvczError
+
+__all__ = ['KEY_POOL_DIR', 'KeyPool']
+
+# relative to the user's .dvcz/ directory
+KEY_POOL_DIR = 'keyPool'
+
+_SUFFIX = '.pem'
+_TAKEN = '.taken-'
+
+
+def _generate_pem(key_bits):
+    """ Generate an RSA key in a worker process, returning it as PEM. """
+    from Crypto.PublicKey import RSA
+    return RSA.generate(key_bits).exportKey('PEM')
+
+
+class KeyPool(object):
+    """ RSA keys of one size, generated before they are needed. """
+
+    def __init__(self, pool_path, key_bits=2048):
+        if key_bits < 1024:
+            raise DvczError("key_bits too small: %d" % key_bits)
+        self._path = os.path.join(pool_path, str(key_bits))
+        self._key_bits = key_bits
+        os.makedirs(self._path, 0o700, exist_ok=True)
+        info = os.stat(self._path)
+        if stat.S_IMODE(info.st_mode) != 0o700:
+            os.chmod(self._path, 0o700)
+
+    @property
+    def path(self):
+        """ Return the path to the directory holding the keys. """
+        return self._path
+
+    @property
+    def key_bits(self):
+        """ Return the size of the keys in the pool. """
+        return self._key_bits
+
+    def _names(self):
+        """ Return the names of the key files in the pool. """
+        return [_ for _ in os.listdir(self._path)
+                if _.endswith(_SUFFIX) and not _.startswith('.')]
+
+    def depth(self):
+        """ Return the number of keys in the pool. """
+        return len(self._names())
+
+    def add_pem(self, pem):
+        """ Add a PEM-formatted key to the pool. """
+        if isinstance(pem, str):
+            pem = pem.encode('utf-8')
+        while True:
+            name = os.urandom(8).hex() + _SUFFIX
+            path = os.path.join(self._path, name)
+            try:
+                fd_ = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                              0o600)
+                break
+            except FileExistsError:
+                continue
+        with os.fdopen(fd_, 'wb') as file:
+            file.write(pem)
+
+    def _reap(self):
+        """
+        Delete keys claimed by processes which no longer exist.  Return
+        the number deleted.
+        """
+        reaped = 0
+        for name in os.listdir(self._path):
+            if not name.startswith(_TAKEN):
+                continue
+            try:
+                pid = int(name[len(_TAKEN):].split('-', 1)[0])
+                os.kill(pid, 0)
+            except ValueError:
+                continue                # not a name take_pem() made
+            except ProcessLookupError:
+                try:
+                    os.unlink(os.path.join(self._path, name))
+                    reaped += 1
+                except FileNotFoundError:
+                    pass
+            except PermissionError:
+                pass                    # alive, but not ours to signal
+        return reaped
+
+    def fill(self, depth, jobs=1):
+        """
+        Generate keys until the pool holds at least depth of them,
+        using jobs worker processes.  Return the number of keys added.
+        """
+        lock_fd = None
+        if fcntl is not None:
+            lock_fd = os.open(self._path + '.lock', os.O_RDWR | os.O_CREAT,
+                              0o600)
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            self._reap()
+            return self._fill(depth - self.depth(), jobs)
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)       # releasing the lock
+
+    def _fill(self, wanted, jobs):
+        """ Add wanted keys to the pool, holding the fill lock. """
+        if wanted <= 0:
+            return 0
+        if jobs > 1 and wanted > 1:
+            from concurrent.futures import (ProcessPoolExecutor,
+                                            as_completed)
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(_generate_pem, self._key_bits)
+                           for _ in range(wanted)]
+                for future in as_completed(futures):
+                    self.add_pem(future.result())
+        else:
+            for _ in range(wanted):
+                self.add_pem(_generate_pem(self._key_bits))
+        return wanted
+
+    def take_pem(self):
+        """
+        Remove a key from the pool, returning it as PEM-formatted text,
+        or return None if the pool is empty.
+        """
+        for name in self._names():
+            path = os.path.join(self._path, name)
+            claimed = os.path.join(self._path,
+                                   "%s%d-%s" % (_TAKEN, os.getpid(), name))
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue                # another process took it
+            with open(claimed, 'r') as file:
+                pem = file.read()
+            os.unlink(claimed)
+            return pem
+        return None
+
+    def take(self):
+        """
+        Remove a key from the pool and return it, generating a new key
+        if the pool is empty.
+        """
+        from Crypto.PublicKey import RSA
+        pem = self.take_pem()
+        if pem is None:
+            return RSA.generate(self._key_bits)
+        return RSA.importKey(pem)
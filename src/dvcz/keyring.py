@@ -0,0 +1,211 @@
+# dvcz/keyring.py
+
+"""
+A keyring of public committer keys, indexed by committer ID.
+
+Checking signatures made by many committers means finding the public
+keys of the committer who made each one.  A Keyring keeps one serialized
+PubCommitter per committer ID, by default under the user's .dvcz/
+directory, with an index listing the IDs held:
+
+    $HOME/.dvcz/
+        committers/
+            index
+            00/
+            ...
+            ff/
+                ffa3...
+
+Each line of the index is 'ID HANDLE LOGIN'.  New committers are
+appended to it, so the index is read once and afterwards kept in memory.
+A PubCommitter is read and parsed only when it is first looked up and
+is then kept in a least-recently-used cache of at most max_entries
+entries.
+"""
+
+import os
+import tempfile
+from collections import OrderedDict
+
+from dvcz import DvczError
+from dvcz.user import PubCommitter
+
+__all__ = ['KEYRING_DIR', 'MAX_ENTRIES', 'Keyring']
+
+# relative to the user's .dvcz/ directory
+KEYRING_DIR = 'committers'
+
+INDEX_FILE = 'index'
+MAX_ENTRIES = 4096                      # PubCommitters held in memory
+
+_HEX = frozenset('0123456789abcdef')
+
+
+def _check_id(committer_id):
+    """ Raise DvczError unless this is a 40- or 64-character hex value. """
+    if not isinstance(committer_id, str) or \
+            len(committer_id) not in (40, 64) or \
+            not _HEX.issuperset(committer_id):
+        raise DvczError("not a valid committer ID: '%s'" % committer_id)
+
+
+class Keyring(object):
+    """ Map committer IDs to the public keys of the committers. """
+
+    def __init__(self, keyring_path, max_entries=MAX_ENTRIES):
+        if max_entries < 1:
+            raise DvczError("keyring must cache at least one committer")
+        self._path = keyring_path
+        self._max_entries = max_entries
+        self._index = None              # ID -> (handle, login)
+        self._lru = OrderedDict()       # ID -> PubCommitter, oldest first
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(keyring_path, 0o755, exist_ok=True)
+
+    @property
+    def path(self):
+        """ Return the path to the directory holding the keyring. """
+        return self._path
+
+    def _path_for_id(self, committer_id):
+        """ Return the path to the serialized PubCommitter. """
+        return os.path.join(self._path, committer_id[:2], committer_id)
+
+    # INDEX ---------------------------------------------------------
+
+    def _load_index(self):
+        """
+        Return the index, reading it from disk if necessary.  If there
+        is no index file, one is made by scanning the keyring.
+        """
+        if self._index is not None:
+            return self._index
+        index_path = os.path.join(self._path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            self.rebuild_index()
+            return self._index
+        index = {}
+        with open(index_path, 'r') as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) != 3:
+                    continue            # a partly-written line
+                index[parts[0]] = (parts[1], parts[2])
+        self._index = index
+        return index
+
+    def _append_index(self, committer_id, pub):
+        """ Record a new committer in the index, in memory and on disk. """
+        with open(os.path.join(self._path, INDEX_FILE), 'a') as file:
+            file.write("%s %s %s\n" % (committer_id, pub.handle, pub.login))
+        self._index[committer_id] = (pub.handle, pub.login)
+
+    def rebuild_index(self):
+        """
+        Rewrite the index from the serialized PubCommitters in the
+        keyring, returning the number of committers indexed.
+        """
+        index = {}
+        for sub_dir in os.scandir(self._path):
+            if not sub_dir.is_dir() or len(sub_dir.name) != 2:
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.startswith('.'):
+                    continue
+                pub = PubCommitter.create_from_file(entry.path)
+                index[entry.name] = (pub.handle, pub.login)
+        (fd_, tmp_path) = tempfile.mkstemp(dir=self._path, prefix='.tmp')
+        with os.fdopen(fd_, 'w') as file:
+            for committer_id in sorted(index):
+                file.write("%s %s %s\n" % (
+                    (committer_id,) + index[committer_id]))
+        os.replace(tmp_path, os.path.join(self._path, INDEX_FILE))
+        self._index = index
+        return len(index)
+
+    # LOOKUP --------------------------------------------------------
+
+    def __len__(self):
+        """ Return the number of committers in the keyring. """
+        return len(self._load_index())
+
+    def __contains__(self, committer_id):
+        return committer_id in self._load_index() or \
+            os.path.exists(self._path_for_id(committer_id))
+
+    def ids(self):
+        """ Return a sorted list of the committer IDs in the keyring. """
+        return sorted(self._load_index())
+
+    def describe(self, committer_id):
+        """
+        Return (handle, login) for the committer without reading its
+        keys, or None if the committer is not in the keyring.
+        """
+        return self._load_index().get(committer_id)
+
+    def get(self, committer_id):
+        """
+        Return the PubCommitter with this ID, or None if there is no
+        such committer in the keyring.
+        """
+        pub = self._lru.get(committer_id)
+        if pub is not None:
+            self._lru.move_to_end(committer_id)
+            self.hits += 1
+            return pub
+        _check_id(committer_id)
+        try:
+            pub = PubCommitter.create_from_file(
+                self._path_for_id(committer_id))
+        except FileNotFoundError:
+            return None
+        self.misses += 1
+        index = self._load_index()
+        if committer_id not in index:
+            # added by another process since the index was read
+            index[committer_id] = (pub.handle, pub.login)
+        self._remember(committer_id, pub)
+        return pub
+
+    def _remember(self, committer_id, pub):
+        """ Add the PubCommitter to the LRU, evicting if full. """
+        self._lru[committer_id] = pub
+        while len(self._lru) > self._max_entries:
+            self._lru.popitem(last=False)
+
+    # UPDATE --------------------------------------------------------
+
+    def add(self, committer_id, pub):
+        """
+        Add a committer's public keys to the keyring.  The committer
+        may be a PubCommitter or a Committer, whose secret keys are not
+        stored.  Raise DvczError if a different committer already has
+        this ID.
+        """
+        _check_id(committer_id)
+        if not isinstance(pub, PubCommitter):
+            pub = PubCommitter.create_from_committer(pub)
+        old = self.get(committer_id)
+        if old is not None:
+            if old != pub:
+                raise DvczError(
+                    "committer ID %s is already in use" % committer_id)
+            return
+        self._load_index()              # before the new file is written
+        path = self._path_for_id(committer_id)
+        os.makedirs(os.path.dirname(path), 0o755, exist_ok=True)
+        (fd_, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                           prefix='.tmp')
+        with os.fdopen(fd_, 'w') as file:
+            file.write(pub.__str__())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        self._append_index(committer_id, pub)
+        self._remember(committer_id, pub)
+
+    def clear(self):
+        """ Forget everything held in memory; the keyring remains. """
+        self._index = None
+        self._lru.clear()
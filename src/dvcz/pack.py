@@ -0,0 +1,469 @@
+# dvcz/pack.py
+
+"""
+Pack files for the small objects in a Store.
+
+A project full of small source files turns a store into millions of
+small files, wasting space and making backups and directory scans slow.
+repack() moves small loose objects into pack files:
+
+    u_path/
+        pack/
+            deleted             # "PACK KEY" for each packed key deleted
+            pack-00000001.dat   # header, then objects end to end
+            pack-00000001.idx   # header, then sorted index entries
+            ...
+
+An index entry is a binary digest followed by the offset and length of
+the object in the .dat file, and the entries are sorted by digest, so
+that an object is found by bisection through an mmap of the index.  A
+pack is never changed once written.  Its .dat file is written first and
+its .idx last, so a pack is only seen once it is complete, and loose
+objects are removed only after the pack holding them is in place.
+
+Objects cannot be removed from a pack.  A packed object deleted from
+the store is listed in `deleted`, with the name of the newest pack
+holding it, until a full repack rewrites the packs without it.  The
+entry hides the key in that pack and any older one, but not in a newer
+pack, so an object put back after its deletion and packed again is
+found.
+
+Store looks in the packs for any object not found loose; see
+dvcz/store.py.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from dvcz import DvczError
+from dvcz.hashing import new_sha
+from dvcz.key_index import digest_len
+
+__all__ = ['PACK_DIR', 'SMALL_OBJECT', 'MAX_PACK_BYTES', 'Pack', 'PackSet',
+           'RepackSummary', 'repack']
+
+PACK_DIR = 'pack'                   # relative to u_path
+SMALL_OBJECT = 64 * 1024            # largest object packed, in bytes
+MAX_PACK_BYTES = 256 * 1024 * 1024  # pack files are closed at this size
+
+_DAT_MAGIC = b'DVPK'
+_IDX_MAGIC = b'DVPI'
+_DAT_HEADER = struct.Struct('<4sI')         # magic, format
+_IDX_HEADER = struct.Struct('<4sBxxxQ')     # magic, digest length, count
+_ENTRY_TAIL = struct.Struct('<QQ')          # offset, length
+_FORMAT = 1
+_DELETED_FILE = 'deleted'
+
+
+class Pack(object):
+    """ One pack: its data file and the mmap of its index. """
+
+    def __init__(self, dat_path, dlen):
+        self.dat_path = dat_path
+        self.idx_path = dat_path[:-len('.dat')] + '.idx'
+        # pack-NNNNNNNN, which sorts in the order packs were written
+        self.name = os.path.basename(dat_path)[:-len('.dat')]
+        self._dlen = dlen
+        self._entry_len = dlen + _ENTRY_TAIL.size
+        self._map = None
+        with open(self.idx_path, 'rb') as file:
+            (magic, idx_dlen, count) = _IDX_HEADER.unpack(
+                file.read(_IDX_HEADER.size))
+            if magic != _IDX_MAGIC or idx_dlen != dlen or \
+                    os.fstat(file.fileno()).st_size != \
+                    _IDX_HEADER.size + count * self._entry_len:
+                raise DvczError("damaged pack index %s" % self.idx_path)
+            self.count = count
+            if count:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        self._fd = os.open(dat_path, os.O_RDONLY)
+
+    @property
+    def mtime(self):
+        """
+        Return the modification time of the data file, which is changed
+        when an object in the pack is freshened.
+        """
+        return os.fstat(self._fd).st_mtime
+
+    def _digest_at(self, ndx):
+        """ Return the ndx-th digest in the index. """
+        offset = _IDX_HEADER.size + ndx * self._entry_len
+        return self._map[offset:offset + self._dlen]
+
+    def find(self, digest):
+        """ Return (offset, length) of the object or None. """
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._digest_at(mid) < digest:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.count and self._digest_at(low) == digest:
+            return _ENTRY_TAIL.unpack_from(
+                self._map, _IDX_HEADER.size + low * self._entry_len +
+                self._dlen)
+        return None
+
+    def __iter__(self):
+        """ Yield (digest, offset, length) for each object, in order. """
+        for ndx in range(self.count):
+            digest = self._digest_at(ndx)
+            (offset, length) = _ENTRY_TAIL.unpack_from(
+                self._map, _IDX_HEADER.size + ndx * self._entry_len +
+                self._dlen)
+            yield (digest, offset, length)
+
+    def read(self, offset, length):
+        """ Return the length bytes at offset in the data file. """
+        data = os.pread(self._fd, length, offset)
+        if len(data) != length:
+            raise DvczError("pack %s is truncated" % self.dat_path)
+        return data
+
+    def close(self):
+        """ Release the index mmap and the data file. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class PackSet(object):
+    """
+    The packs of the store at u_path.  The packs are read when first
+    needed and read again when a key is not found and the pack
+    directory has changed since.
+    """
+
+    def __init__(self, u_path, hashtype):
+        self._path = os.path.join(u_path, PACK_DIR)
+        self._dlen = digest_len(hashtype)
+        self._packs = None
+        self._deleted = {}          # key -> newest pack it is deleted from
+        self._seen = None           # what the directory looked like
+        self._lock = threading.RLock()  # packs may be shared by threads
+
+    @property
+    def path(self):
+        """ Return the directory holding the packs. """
+        return self._path
+
+    def _signature(self):
+        """ Return what changes when packs are added or deleted. """
+        try:
+            dir_mtime = os.stat(self._path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        try:
+            deleted = os.stat(os.path.join(self._path, _DELETED_FILE))
+            return (dir_mtime, deleted.st_size, deleted.st_mtime_ns)
+        except FileNotFoundError:
+            return (dir_mtime, 0, 0)
+
+    def _load(self):
+        """ Open every complete pack and read the deleted keys. """
+        self.close()
+        self._seen = self._signature()
+        self._packs = []
+        self._deleted = {}
+        if self._seen is None:
+            return
+        for name in sorted(os.listdir(self._path)):
+            if name.startswith('pack-') and name.endswith('.idx'):
+                dat_path = os.path.join(self._path, name[:-4] + '.dat')
+                try:
+                    self._packs.append(Pack(dat_path, self._dlen))
+                except FileNotFoundError:
+                    pass            # removed by a repack meanwhile
+        try:
+            with open(os.path.join(self._path, _DELETED_FILE), 'r') as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        (name, key) = parts
+                        self._deleted[key] = max(
+                            name, self._deleted.get(key, name))
+        except FileNotFoundError:
+            pass
+
+    def _visible(self, pack, key):
+        """ Return whether the key, if in the pack, is not deleted. """
+        deleted_from = self._deleted.get(key)
+        return deleted_from is None or pack.name > deleted_from
+
+    def refresh(self):
+        """
+        Reread the packs if they have changed.  Return whether they had.
+        """
+        if self._packs is not None and self._signature() == self._seen:
+            return False
+        self._load()
+        return True
+
+    def _find(self, key):
+        """ Return (Pack, offset, length) for the key or None. """
+        if self._packs is None:
+            self._load()
+        digest = bytes.fromhex(key)
+        for pack in reversed(self._packs):      # newest first
+            if not self._visible(pack, key):
+                break                   # nor is it in any older pack
+            found = pack.find(digest)
+            if found is not None:
+                return (pack, found[0], found[1])
+        return None
+
+    def find(self, key):
+        """
+        Return (Pack, offset, length) for the key, looking again if it
+        is not found and the packs have changed, or None.
+        """
+        with self._lock:
+            found = self._find(key)
+            if found is None and self.refresh():
+                found = self._find(key)
+            return found
+
+    def missing(self, keys):
+        """ Return those of the keys which are not packed. """
+        with self._lock:
+            absent = [_ for _ in keys if self._find(_) is None]
+            if absent and self.refresh():
+                absent = [_ for _ in absent if self._find(_) is None]
+            return absent
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def get_data(self, key):
+        """ Return the packed object with the key, or None. """
+        with self._lock:
+            found = self.find(key)
+            if found is None:
+                return None
+            (pack, offset, length) = found
+            return pack.read(offset, length)
+
+    def stat(self, key):
+        """
+        Return (mtime, length) for the packed object, where mtime is
+        that of its pack, or None.
+        """
+        found = self.find(key)
+        if found is None:
+            return None
+        return (found[0].mtime, found[2])
+
+    def hex_keys(self):
+        """ Yield the keys of every packed object not deleted. """
+        if self._packs is None:
+            self._load()
+        for pack in self._packs:
+            for digest, _, _ in pack:
+                key = digest.hex()
+                if self._visible(pack, key):
+                    yield key
+
+    def delete(self, key):
+        """
+        Record that a packed object has been deleted from the newest
+        pack holding it, and so from every pack.  Return whether the
+        key was packed.
+        """
+        with self._lock:
+            found = self._find(key)
+            if found is None:
+                return False
+            name = found[0].name
+            with open(os.path.join(self._path, _DELETED_FILE), 'a') as file:
+                file.write('%s %s\n' % (name, key))
+            self._deleted[key] = name
+            return True
+
+    def clear_deleted(self):
+        """
+        Forget the deleted keys, once the packs holding them are gone.
+        Return how many there were.
+        """
+        if self._packs is None:
+            self._load()
+        count = len(self._deleted)
+        path = os.path.join(self._path, _DELETED_FILE)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._deleted = {}
+        return count
+
+    @property
+    def packs(self):
+        """ Return the list of Packs. """
+        if self._packs is None:
+            self._load()
+        return self._packs
+
+    def close(self):
+        """ Close every pack. """
+        for pack in self._packs or []:
+            pack.close()
+        self._packs = None
+
+
+class RepackSummary(object):
+    """ What repack() did. """
+
+    def __init__(self):
+        self.loose = 0              # loose objects packed
+        self.repacked = 0           # objects copied from old packs
+        self.dropped = 0            # deleted objects dropped from packs
+        self.bad = []               # loose objects left as they hash wrong
+        self.packs_written = 0
+        self.packs_removed = 0
+        self.bytes_packed = 0
+        self.secs = 0.0
+
+    def __str__(self):
+        return '\n'.join([
+            "objects:        %d loose packed, %d repacked, %d dropped, "
+            "%d bad" % (self.loose, self.repacked, self.dropped,
+                        len(self.bad)),
+            "packs:          %d written, %d removed, %d bytes" % (
+                self.packs_written, self.packs_removed, self.bytes_packed),
+            "time (seconds): %.3f elapsed" % self.secs, ])
+
+
+class _PackWriter(object):
+    """ Write objects, in key order, into new packs. """
+
+    def __init__(self, path, dlen, max_bytes, summary):
+        self._path = path
+        self._dlen = dlen
+        self._max_bytes = max_bytes
+        self._summary = summary
+        names = [_ for _ in os.listdir(path) if _.startswith('pack-')]
+        self._seq = max([int(_[5:13]) for _ in names] or [0])
+        self._file = None
+        self._dat_path = None
+        self._entries = []
+        self._loose = []
+        self.done = []              # lists of loose paths in packs written
+
+    def add(self, key, data, loose_path=None):
+        """ Append an object to the current pack, starting one if needed. """
+        if self._file is None:
+            self._seq += 1
+            self._dat_path = os.path.join(self._path,
+                                          'pack-%08d.dat' % self._seq)
+            self._file = open(self._dat_path + '.tmp', 'wb')
+            self._file.write(_DAT_HEADER.pack(_DAT_MAGIC, _FORMAT))
+            self._loose = []
+        offset = self._file.tell()
+        self._file.write(data)
+        self._entries.append((bytes.fromhex(key), offset, len(data)))
+        if loose_path:
+            self._loose.append(loose_path)
+        self._summary.bytes_packed += len(data)
+        if self._file.tell() >= self._max_bytes:
+            self.finish()
+
+    def abandon(self):
+        """ Discard a pack left unfinished by an error. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.unlink(self._dat_path + '.tmp')
+
+    def finish(self):
+        """ Complete the current pack: data file first, index last. """
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._dat_path + '.tmp', self._dat_path)
+        idx_path = self._dat_path[:-len('.dat')] + '.idx'
+        with open(idx_path + '.tmp', 'wb') as file:
+            file.write(_IDX_HEADER.pack(_IDX_MAGIC, self._dlen,
+                                        len(self._entries)))
+            for digest, offset, length in self._entries:
+                file.write(digest + _ENTRY_TAIL.pack(offset, length))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(idx_path + '.tmp', idx_path)
+        self._entries = []
+        self._summary.packs_written += 1
+        self.done.append(self._loose)
+
+
+def repack(store, full=False, small=SMALL_OBJECT, max_bytes=MAX_PACK_BYTES,
+           summary=None):
+    """
+    Move the store's loose objects of at most small bytes into new
+    packs, in key order, and remove them once packed.  Each object is
+    rehashed as it is packed, and one which does not match its key is
+    left loose.  If full, the existing packs are rewritten too, less
+    any objects deleted from them, and removed.  Return a RepackSummary.
+
+    Keys are taken from the store's KeyIndex, which is built if there
+    is none.  Objects are read from wherever the store has them, so
+    only one repack should run on a store at a time.
+    """
+    if summary is None:
+        summary = RepackSummary()
+    began = time.perf_counter()
+    # pylint: disable=no-member
+    hashtype = store.hashtype
+    packs = store.packs
+    os.makedirs(packs.path, 0o755, exist_ok=True)
+    packs.refresh()
+    old_packs = list(packs.packs) if full else []
+    writer = _PackWriter(packs.path, digest_len(hashtype), max_bytes,
+                         summary)
+    try:
+        for key in store.keys():
+            loose_path = store.get_path_for_key(key)
+            try:
+                size = os.stat(loose_path).st_size
+            except FileNotFoundError:
+                size = None
+            if size is not None:
+                if size > small:
+                    continue
+                with open(loose_path, 'rb') as file:
+                    data = file.read()
+                sha = new_sha(hashtype)
+                sha.update(data)
+                if sha.hexdigest() != key:
+                    summary.bad.append(key)
+                    continue
+                writer.add(key, data, loose_path)
+                summary.loose += 1
+            elif full:
+                data = packs.get_data(key)
+                if data is not None:
+                    writer.add(key, data)
+                    summary.repacked += 1
+        writer.finish()
+    finally:
+        writer.abandon()
+
+    for loose_paths in writer.done:
+        for path in loose_paths:
+            os.unlink(path)
+    if full:
+        summary.dropped = packs.clear_deleted()
+        for pack in old_packs:
+            os.unlink(pack.idx_path)
+            os.unlink(pack.dat_path)
+            summary.packs_removed += 1
+    packs.refresh()
+    summary.secs += time.perf_counter() - began
+    return summary
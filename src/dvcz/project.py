@@ -2,12 +2,103 @@
 
 """ Project: a collection of code in and below a project root directory. """
 
+import errno
 import os
 import re
+import stat
+from collections import namedtuple
 
 from dvcz import DvczError
 
-__all__ = ['get_proj_info', 'Project']
+__all__ = ['ProjInfo', 'ProjectLocator', 'get_proj_info', 'Project']
+
+# what is known about a project: its name, root directory, and the
+# directory containing that
+ProjInfo = namedtuple('ProjInfo', ['name', 'path', 'parent'])
+
+
+class ProjectLocator(object):
+    """
+    Find the project directory containing a path.
+
+    The project directory is the first found searching upward which has
+    a .dvcz subdirectory.  Each directory visited costs one stat() of
+    its .dvcz, and the answer for every directory visited is remembered,
+    so that locating the projects of many paths in the same tree walks
+    each directory at most once.  The working directory is never
+    changed.
+
+    The user's home directory is not a valid project directory, even
+    though it has a .dvcz subdirectory.
+    """
+
+    def __init__(self, home=None):
+        if home is None:
+            home = os.environ.get('HOME', '')
+        self._home = os.path.abspath(home) if home else ''
+        self._roots = {}            # directory -> project directory or ''
+
+    def __len__(self):
+        """ Return the number of directories remembered. """
+        return len(self._roots)
+
+    def clear(self):
+        """ Forget everything found so far. """
+        self._roots.clear()
+
+    def _root_of(self, path):
+        """
+        Return the project directory containing the absolute path or
+        '' if there is none, remembering the answer for each directory
+        visited.
+        """
+        visited = []
+        curdir = path
+        while True:
+            root = self._roots.get(curdir)
+            if root is not None:
+                break
+            visited.append(curdir)
+            try:
+                info = os.stat(os.path.join(curdir, '.dvcz'))
+                if stat.S_ISDIR(info.st_mode):
+                    root = curdir
+                    break
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            parent = os.path.dirname(curdir)
+            if parent == curdir:
+                root = ''           # reached /
+                break
+            curdir = parent
+        for _ in visited:
+            self._roots[_] = root
+        return root
+
+    def locate(self, path=None):
+        """
+        Return the ProjInfo for the project containing path, by
+        default the current directory.
+
+        If path does not exist, raise FileNotFoundError; if it is not a
+        directory, NotADirectoryError.  If there is no project directory
+        above it, or the first found is the user's home directory,
+        raise DvczError.
+        """
+        if path is None:
+            path = os.getcwd()
+        path = os.path.abspath(path)
+        root = self._roots.get(path)
+        if root is None:
+            info = os.stat(path)            # may raise FileNotFoundError
+            if not stat.S_ISDIR(info.st_mode):
+                raise NotADirectoryError(
+                    errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            root = self._root_of(path)
+        if not root or root == self._home:
+            raise DvczError("no project directory found above %s" % path)
+        (parent, name) = os.path.split(root)
+        return ProjInfo(name, root, parent)
 
 
 def get_proj_info(options):
@@ -16,50 +107,24 @@ def get_proj_info(options):
     change to that directory, and return the project name, path, and
     parent path.
 
-    The candidate path is options.proj_path.  If this is not a valid
-    directory, raise DvczError.
+    The candidate path is options.proj_path, by default the current
+    directory.  If this does not exist, raise FileNotFoundError.
 
     The project directory is the first found searching upward which has
     a .dvcz subdirectory.   Make that the current working directory.
     If not found, raise DvczError.  If the user's home directory is the
-    first found, program exit: this is not a valid project directory.
-    Otherwise add project name and directory to the options Namespace.
+    first found, raise DvczError: this is not a valid project directory.
 
     The project name, path, and parent are added to the options
     Namespace as options.proj_name, options.proj_path, and
-    options.proj_parent respectively.
+    options.proj_parent respectively.  Tools which look up many paths
+    should use a ProjectLocator instead.
     """
-
-    proj_name = ''
-    proj_parent = ''
-    try:
-        proj_path = options.proj_path
-    except AttributeError:              # no such option
-        proj_path = os.getcwd()
-    os.chdir(proj_path)         # may raise FileNotFoundError
-
-    curdir = proj_path
-    start_dir = curdir
-
-    while curdir:
-        proj_parent, sep, proj_name = curdir.rpartition('/')    # parse path
-        if sep != '/':
-            raise DvczError("invalid working directory: '%s'" % curdir)
-        if os.path.exists(os.path.join(curdir, '.dvcz')):
-            # we have a .dvcz subdirectory, so this is a project directory
-            proj_path = curdir
-            os.chdir(proj_path)
-            break
-        # otherwise we need to loop
-        curdir = proj_parent
-
-    if curdir == os.environ['HOME'] or curdir == '' or curdir is None:
-        raise DvczError("no project directory found above %s" % start_dir)
-
-    options.proj_name = proj_name
-    options.proj_path = proj_path
-    options.proj_parent = proj_parent
-    os.chdir(proj_path)
+    info = ProjectLocator().locate(getattr(options, 'proj_path', None))
+    options.proj_name = info.name
+    options.proj_path = info.path
+    options.proj_parent = info.parent
+    os.chdir(info.path)
 
 
 class Project(object):
@@ -0,0 +1,307 @@
+# dvcz/scrub.py
+
+"""
+Scrub a content-keyed Store: rehash every object and check that it
+still hashes to its key.
+
+An object whose content no longer matches its name, through bit-rot or
+a bad write, would otherwise go unnoticed until someone checked it out.
+A Scrubber walks the store's keys in order, from its KeyIndex, and
+rehashes the objects using a pool of threads.  An object which does not
+match is moved to u_path/quarantine/, under its key or, if an earlier
+copy is already there, under KEY.N, and dropped from the index, so
+that the next commit of the same file puts a good copy back.  Packed
+objects are checked too; a bad one is copied to the quarantine and
+marked deleted in its pack.
+
+Keys are handed to the threads a window at a time.  When a window is
+done the last key in it is recorded in u_path/scrub/state, one line
+
+    STARTED LAST_KEY CHECKED BYTES BAD ERRORS
+
+so a scrub which is stopped, with ^C or otherwise, can be resumed at
+the window where it stopped, with the counts it had reached, of bad
+and of unreadable objects among them.  Reading may be limited to a
+number of bytes a second, shared by all of the threads, so that a
+scrub can run alongside commits without starving them.
+"""
+
+import os
+import threading
+import time
+from itertools import islice
+
+from dvcz import DvczError
+from dvcz.hashing import BUF_SIZE, new_sha
+from dvcz.key_index import KeyIndex
+
+__all__ = ['SCRUB_DIR', 'QUARANTINE_DIR', 'WINDOW_PER_JOB', 'Throttle',
+           'ScrubSummary', 'Scrubber']
+
+SCRUB_DIR = 'scrub'                 # relative to u_path
+QUARANTINE_DIR = 'quarantine'       # relative to u_path
+WINDOW_PER_JOB = 64                 # keys per thread between checkpoints
+
+
+class Throttle(object):
+    """
+    Limit reads by all threads to rate bytes a second, allowing bursts
+    of up to a second's worth.  A rate of zero means no limit.
+    """
+
+    def __init__(self, rate=0):
+        if rate < 0:
+            raise DvczError("bandwidth may not be negative")
+        self._rate = rate
+        self._lock = threading.Lock()
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self.waits = 0
+        self.secs_waited = 0.0
+
+    def consume(self, nbytes):
+        """ Wait until nbytes may be read. """
+        if not self._rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self._rate), self._tokens +
+                               (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            if wait:
+                self.waits += 1
+                self.secs_waited += wait
+        if wait:
+            time.sleep(wait)
+
+
+def _windows(iterable, size):
+    """ Yield successive lists of up to size items from iterable. """
+    iterator = iter(iterable)
+    while True:
+        window = list(islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+class ScrubSummary(object):
+    """ What a scrub found. """
+
+    def __init__(self):
+        self.checked = 0
+        self.bytes_read = 0
+        self.bad = []               # keys quarantined
+        self.bad_before = 0         # quarantined before a resumed scrub
+        self.errors = []            # (key, message) for unreadable objects
+        self.errors_before = 0      # unreadable before a resumed scrub
+        self.secs = 0.0
+        self.secs_throttled = 0.0
+        self.resumed = False
+        self.finished = False
+
+    @property
+    def bad_count(self):
+        """
+        Return the number of objects quarantined, counting those found
+        before the scrub was resumed.
+        """
+        return self.bad_before + len(self.bad)
+
+    @property
+    def error_count(self):
+        """
+        Return the number of objects which could not be read, counting
+        those found before the scrub was resumed.
+        """
+        return self.errors_before + len(self.errors)
+
+    def __str__(self):
+        return '\n'.join([
+            "objects:        %d checked, %d bad, %d unreadable" % (
+                self.checked, self.bad_count, self.error_count),
+            "read:           %d bytes" % self.bytes_read,
+            "time (seconds): %.3f elapsed, %.3f throttled%s%s" % (
+                self.secs, self.secs_throttled,
+                ' (resumed)' if self.resumed else '',
+                '' if self.finished else ' (stopped)'), ])
+
+
+class Scrubber(object):
+    """
+    Rehash the objects in a Store with jobs threads, reading at most
+    bandwidth bytes a second in all, or without limit if bandwidth is
+    zero.
+    """
+
+    def __init__(self, store, jobs=4, bandwidth=0):
+        if jobs < 1:
+            raise DvczError("jobs must be at least 1")
+        self._store = store
+        self._jobs = jobs
+        self._throttle = Throttle(bandwidth)
+        self._path = os.path.join(store.u_path, SCRUB_DIR)
+        self._state_path = os.path.join(self._path, 'state')
+        self._quarantine_path = os.path.join(store.u_path, QUARANTINE_DIR)
+
+    @property
+    def quarantine_path(self):
+        """ Return the directory to which bad objects are moved. """
+        return self._quarantine_path
+
+    # STATE ---------------------------------------------------------
+
+    def read_state(self):
+        """
+        Return (started, last_key, checked, bytes_read, bad, errors) for
+        the scrub in progress, or None if there is none.
+        """
+        try:
+            with open(self._state_path, 'r') as file:
+                (started, last_key, checked, bytes_read, bad, errors) = \
+                    file.read().split()
+            return (int(started), last_key, int(checked), int(bytes_read),
+                    int(bad), int(errors))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_state(self, started, last_key, summary):
+        """ Record that every key up to last_key has been checked. """
+        os.makedirs(self._path, 0o755, exist_ok=True)
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write("%d %s %d %d %d %d\n" % (
+                started, last_key, summary.checked, summary.bytes_read,
+                summary.bad_count, summary.error_count))
+        os.replace(tmp_path, self._state_path)
+
+    # CHECKING ------------------------------------------------------
+
+    def check(self, key):
+        """
+        Rehash the object with the key.  Return (key, length, hex
+        hash), where the hash is None if the object has gone, or (key,
+        0, OSError) if it cannot be read.
+        """
+        # pylint: disable=no-member
+        sha = new_sha(self._store.hashtype)
+        length = 0
+        try:
+            with open(self._store.get_path_for_key(key), 'rb') as file:
+                while True:
+                    chunk = file.read(BUF_SIZE)
+                    if not chunk:
+                        break
+                    self._throttle.consume(len(chunk))
+                    sha.update(chunk)
+                    length += len(chunk)
+        except FileNotFoundError:
+            try:
+                data = self._store.packs.get_data(key)
+            except (DvczError, OSError) as exc:
+                return (key, 0, OSError(str(exc)))
+            if data is None:
+                return (key, 0, None)       # deleted since indexed
+            self._throttle.consume(len(data))
+            sha.update(data)
+            length = len(data)
+        except OSError as exc:
+            return (key, 0, exc)
+        return (key, length, sha.hexdigest())
+
+    def quarantine(self, key):
+        """
+        Move the object with the key to the quarantine directory and
+        drop it from the store's index.  Return its new path, or None
+        if the object has gone from the store.  A copy quarantined
+        earlier is never overwritten.
+        """
+        os.makedirs(self._quarantine_path, 0o755, exist_ok=True)
+        src_path = self._store.get_path_for_key(key)
+        data = None
+        suffix = 0
+        path = os.path.join(self._quarantine_path, key)
+        while True:
+            try:
+                if data is None:
+                    os.link(src_path, path)
+                    os.unlink(src_path)
+                else:
+                    with open(path, 'xb') as file:
+                        file.write(data)
+                    self._store.packs.delete(key)
+                break
+            except FileExistsError:
+                suffix += 1
+                path = os.path.join(self._quarantine_path,
+                                    '%s.%d' % (key, suffix))
+            except FileNotFoundError:
+                if data is not None:
+                    raise
+                # a packed object is copied out and marked deleted
+                data = self._store.packs.get_data(key)
+                if data is None:
+                    path = None
+                    break
+        self._store.key_index().discard(key)
+        return path
+
+    def scrub(self, resume=False, summary=None):
+        """
+        Check every object in the store, continuing from where an
+        earlier scrub stopped if resume, and return a ScrubSummary.
+        KeyboardInterrupt stops the scrub after recording progress.
+        """
+        if summary is None:
+            summary = ScrubSummary()
+        state = self.read_state() if resume else None
+        if state is not None:
+            (started, last_key, summary.checked, summary.bytes_read,
+             summary.bad_before, summary.errors_before) = state
+            summary.resumed = True
+        else:
+            (started, last_key) = (int(time.time()), '')
+        began = time.perf_counter()
+        store = self._store
+        # The store's own index, built if need be, records quarantined
+        # keys; the walk uses a second KeyIndex which they do not disturb.
+        store.key_index(self._jobs)
+        # pylint: disable=no-member
+        index = KeyIndex(store.u_path, store.dir_struc.name,
+                         store.hashtype).load()
+        todo = (_ for _ in index if _ > last_key)
+        executor = None
+        if self._jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=self._jobs)
+        try:
+            for window in _windows(todo, self._jobs * WINDOW_PER_JOB):
+                if executor is None:
+                    results = map(self.check, window)
+                else:
+                    results = executor.map(self.check, window)
+                for key, length, hex_hash in results:
+                    if hex_hash is None:
+                        continue
+                    summary.checked += 1
+                    summary.bytes_read += length
+                    if isinstance(hex_hash, OSError):
+                        summary.errors.append((key, str(hex_hash)))
+                    elif hex_hash != key:
+                        self.quarantine(key)
+                        summary.bad.append(key)
+                self._write_state(started, window[-1], summary)
+            summary.finished = True
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            index.close()
+            summary.secs += time.perf_counter() - began
+            summary.secs_throttled = self._throttle.secs_waited
+        if summary.finished and os.path.exists(self._state_path):
+            os.unlink(self._state_path)
+        return summary
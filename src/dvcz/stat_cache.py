@@ -0,0 +1,161 @@
+# dvcz/stat_cache.py
+
+"""
+Persistent cache of file content keys, indexed by path and validated
+by stat() information.
+
+The cache lives under the project's .dvcz/ subdirectory, one file per
+hash type, so that stores using SHA1, SHA2, SHA3, and BLAKE2B never
+share entries:
+
+    .dvcz/
+        statCache/
+            SHA1
+            SHA2
+            ...
+
+Each line of a cache file looks like
+
+    SIZE MTIME_NS INODE HASH PATH
+
+where PATH is relative to the project directory and may contain spaces.
+If a file's size, modification time (in nanoseconds), and inode number
+all match the cached values, its content key is reused rather than
+recomputed.
+"""
+
+import os
+import time
+
+from dvcz import DvczError
+from dvcz.hashing import hash_file
+from xlattice import HashTypes
+
+__all__ = ['STAT_CACHE_DIR', 'StatCache']
+
+STAT_CACHE_DIR = 'statCache'
+
+# A file modified less than this long before we looked at it might be
+# modified again within the same mtime tick, so we don't cache its hash.
+RACY_NS = 2 * 1000 * 1000 * 1000
+
+
+class StatCache(object):
+    """
+    Map project-relative paths to (size, mtime_ns, inode, hash).
+
+    Load the cache with load(), call get_hash() for each file in the
+    project, and then save().  Entries for files which were not looked
+    up since the cache was loaded are dropped when the cache is saved.
+    """
+
+    def __init__(self, dvcz_path, hashtype=HashTypes.SHA2):
+        if not isinstance(hashtype, HashTypes):
+            raise DvczError("not a valid hashtype: '%s'" % hashtype)
+        self._path = os.path.join(dvcz_path, STAT_CACHE_DIR, hashtype.name)
+        self._hashtype = hashtype
+        self._entries = {}          # rel_path -> (size, mtime_ns, ino, hash)
+        self._seen = set()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        """ Return the path to the on-disk cache file. """
+        return self._path
+
+    @property
+    def hashtype(self):
+        """ Return the hash type of the content keys cached. """
+        return self._hashtype
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """
+        Read the cache from disk.  A missing cache is not an error;
+        lines which cannot be parsed are silently discarded.
+        """
+        self._entries = {}
+        self._seen = set()
+        self._dirty = False
+        if not os.path.exists(self._path):
+            return self
+        with open(self._path, 'r') as file:
+            for line in file:
+                parts = line.rstrip('\n').split(' ', 4)
+                if len(parts) != 5:
+                    continue
+                try:
+                    size, mtime_ns, ino = [int(_) for _ in parts[:3]]
+                except ValueError:
+                    continue
+                self._entries[parts[4]] = (size, mtime_ns, ino, parts[3])
+        return self
+
+    def save(self):
+        """
+        Write the cache back to disk if it has changed, dropping entries
+        not looked up since it was loaded.
+        """
+        stale = set(self._entries) - self._seen
+        if stale:
+            for rel_path in stale:
+                del self._entries[rel_path]
+            self._dirty = True
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self._path), 0o755, exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            for rel_path in sorted(self._entries):
+                size, mtime_ns, ino, hex_hash = self._entries[rel_path]
+                file.write("%d %d %d %s %s\n" % (
+                    size, mtime_ns, ino, hex_hash, rel_path))
+        os.replace(tmp_path, self._path)
+        self._dirty = False
+
+    def lookup(self, rel_path, stat):
+        """
+        Return the cached hash for rel_path if the stat information
+        matches, otherwise None.
+        """
+        self._seen.add(rel_path)
+        entry = self._entries.get(rel_path)
+        if entry and entry[:3] == (stat.st_size, stat.st_mtime_ns,
+                                   stat.st_ino):
+            self.hits += 1
+            return entry[3]
+        self.misses += 1
+        return None
+
+    def update(self, rel_path, stat, hex_hash):
+        """
+        Record the hash for rel_path unless the file was modified so
+        recently that the stat information cannot be trusted.
+        """
+        self._seen.add(rel_path)
+        if int(time.time() * 1e9) - stat.st_mtime_ns < RACY_NS:
+            if rel_path in self._entries:
+                del self._entries[rel_path]
+                self._dirty = True
+            return
+        entry = (stat.st_size, stat.st_mtime_ns, stat.st_ino, hex_hash)
+        if self._entries.get(rel_path) != entry:
+            self._entries[rel_path] = entry
+            self._dirty = True
+
+    def get_hash(self, rel_path, abs_path, stat=None):
+        """
+        Return the content key for the file, using the cached value if
+        it is still valid and otherwise hashing the file.
+        """
+        if stat is None:
+            stat = os.stat(abs_path)
+        hex_hash = self.lookup(rel_path, stat)
+        if hex_hash is None:
+            hex_hash = hash_file(abs_path, self._hashtype)
+            self.update(rel_path, stat, hex_hash)
+        return hex_hash
@@ -44,13 +44,57 @@ DIR_FLAT directory structure.  So the commit operation creates
 If N files are being committed, N new entries will appear below
 `in/USER_ID` when the operation is complete.`:
 
+Store.ingest() stages a file in a single pass: it is hashed while being
+copied to a temporary file under `tmp/`, and that file is then renamed
+to its content key under `in/USER_ID`.  Where the file and the store
+share a file system, ingest() can instead avoid copying the data, using
+a reflink, copy_file_range(), or a hard link.  Staged content is not
+in the store proper, so has_keys() and get_data() look in the staging
+areas only for the committer IDs passed, or every area if passed
+staging_ids().
+
+Listing the stores or reading their descriptors does not need a Store,
+whose constructor may touch the disk at u_path.  load_stores() reads
+every descriptor in stores/ into a StoreInfo in one pass, without
+looking at any u_path, and caches the result until the modification
+time of stores/ changes.  StoreInfo.open() then opens the one Store
+needed, trusting the recorded dir_struc and hashtype.
+
+A store may also keep a KeyIndex of its content keys under `idx/`; see
+dvcz/key_index.py.  If there is one, has_keys() consults it rather than
+the directory tree, and keys put into or deleted from the store through
+the Store are recorded in it.  contains() and keys() build the index if
+there is none.
+
+Beside the index a store may keep a BloomFilter, idx/bloom; see
+dvcz/bloom.py.  It covers the keys in the store and in every staging
+area, is updated as keys are put or ingested, and lets has_keys() and
+contains() answer for most absent keys without looking further.  It is
+built by rebuild_bloom(), normally run by `dvc_admin bloom`.
+
+Small objects may be moved from the directory tree into pack files in
+`pack/` by `dvc_admin repack`; see dvcz/pack.py.  exists(), get_data(),
+file_len() and has_keys() look in the packs for any object not found
+loose, and delete() marks packed objects deleted.
+
 """
 
-# import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # from buildlist import(check_dirs_in_path, generate_rsa_key,
 #                      read_rsa_key, rm_f_dir_contents)
 from dvcz import DvczError
+from dvcz.bloom import BLOOM_FILE, DEFAULT_FP_RATE, BloomFilter
+from dvcz.hashing import BUF_SIZE, hash_file, new_sha
+from dvcz.key_index import IDX_DIR, KeyIndex, digest_len
+from dvcz.pack import PackSet
 from dvcz.project import Project
 from xlattice import HashTypes
 from xlu import UDir, DirStruc
@@ -60,7 +104,72 @@ from xlu import UDir, DirStruc
 # if sys.version_info < (3, 6):
 #    import sha3
 
-__all__ = ['Store']
+__all__ = ['INGEST_REFLINK', 'INGEST_COPY_RANGE', 'INGEST_HARDLINK',
+           'INGEST_COPY', 'Store', 'STORES_DIR', 'StoreInfo', 'load_stores',
+           'invalidate_stores']
+
+# relative to the user's .dvcz/ directory
+STORES_DIR = 'stores'
+
+# How Store.ingest() copied a file into the store.
+INGEST_REFLINK = 'reflink'
+INGEST_COPY_RANGE = 'copy_file_range'
+INGEST_HARDLINK = 'hardlink'
+INGEST_COPY = 'copy'
+
+FICLONE = 0x40049409        # from linux/fs.h
+
+# has_keys() lists a directory rather than looking keys up one by one
+# if asked about at least 1/LISTDIR_RATIO of the directory's entries.
+LISTDIR_RATIO = 16
+
+
+def _reflink(src, dest):
+    """
+    Try to make dest, an open file, share src's data blocks.  Return
+    whether this succeeded; it will fail unless both are on the same
+    btrfs, xfs, or similar file system.
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_range(src, dest):
+    """
+    Try to copy src to dest, both open files, inside the kernel using
+    os.copy_file_range().  Return whether this succeeded.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    length = os.fstat(src.fileno()).st_size
+    offset = 0
+    try:
+        while offset < length:
+            count = os.copy_file_range(src.fileno(), dest.fileno(),
+                                       length - offset, offset, offset)
+            if count == 0:
+                break
+            offset += count
+    except OSError:
+        dest.truncate(0)
+        return False
+    return offset == length
+
+
+def _id_list(committer_id):
+    """
+    Return a list of committer IDs given None, an ID, or a list of IDs.
+    """
+    if not committer_id:
+        return []
+    if isinstance(committer_id, str):
+        return [committer_id]
+    return list(committer_id)
 
 
 class Store(UDir):
@@ -89,6 +198,12 @@ class Store(UDir):
             raise DvczError("not a valid dir_struc: '%s'" % dir_struc)
         super().__init__(u_path, dir_struc, hashtype, mode)
         self._name = name
+        self._in_dirs = {}          # committer_id -> UDir
+        self._key_index = None
+        self._index_checked = False
+        self._bloom = None
+        self._bloom_checked = False
+        self._packs = None
 
     @property
     def name(self):
@@ -107,6 +222,473 @@ class Store(UDir):
                           self.dir_struc.name,
                           self.hashtype.name])
 
+    @classmethod
+    def discover(cls, name, u_path, dir_struc=DirStruc.DIR_FLAT,
+                 hashtype=HashTypes.SHA2, mode=0o755):
+        """
+        Create a Store for u_path.  If there is already a store there,
+        its dir_struc and hashtype are used instead of those passed.
+        """
+        u_dir = UDir.discover(u_path, dir_struc, hashtype, mode)
+        return cls(name, u_path, u_dir.dir_struc, u_dir.hashtype, mode)
+
+    # STAGING -------------------------------------------------------
+
+    def in_dir_for(self, committer_id):
+        """
+        Return the committer's staging area, in/COMMITTER_ID, a DIR_FLAT
+        UDir with the same hashtype as the store.  It is created if
+        necessary.
+        """
+        in_dir = self._in_dirs.get(committer_id)
+        if in_dir is None:
+            in_path = os.path.join(self.u_path, 'in', committer_id)
+            in_dir = UDir.discover(in_path, DirStruc.DIR_FLAT,
+                                   # pylint: disable=no-member
+                                   self.hashtype)
+            self._in_dirs[committer_id] = in_dir
+        return in_dir
+
+    def ingest(self, path, committer_id, key=None, zero_copy=False,
+               hardlink=False, dedup=False):
+        """
+        Copy the file at path into the committer's staging area.
+
+        The data goes to a temporary file under the store's tmp/, which
+        is then renamed to its content key in in/COMMITTER_ID.  Return
+        (key, length, method), where method says how the data was copied.
+
+        By default the file is hashed as it is copied, so that it is read
+        only once; the method is INGEST_COPY.  If zero_copy, we instead
+        try in turn a FICLONE reflink, os.copy_file_range(), and, if
+        hardlink, a hard link, falling back to a plain copy.  The first
+        three only work if the file and the store are on the same file
+        system.  A hard-linked file shares its inode with the project
+        file, so later edits to the project file change the staged copy;
+        use it only for files which are never modified in place.
+
+        If the key is already known it may be passed in, in which case a
+        zero-copy ingest does not read the file at all.
+
+        If dedup, the key is looked for with has_keys() once the file has
+        been copied, and if the content is already in the store or the
+        staging area the copy is dropped, the object found is freshened,
+        and the method returned is None.  This lets a caller which does
+        not know the key stage a file without reading it twice.
+        """
+        in_dir = self.in_dir_for(committer_id)
+        tmp_dir = os.path.join(self.u_path, 'tmp')
+        (fd_, tmp_path) = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            method = None
+            if zero_copy:
+                with open(path, 'rb') as src, os.fdopen(fd_, 'wb') as dest:
+                    if _reflink(src, dest):
+                        method = INGEST_REFLINK
+                    elif _copy_range(src, dest):
+                        method = INGEST_COPY_RANGE
+                if method is None and hardlink:
+                    os.unlink(tmp_path)
+                    try:
+                        os.link(path, tmp_path)
+                        method = INGEST_HARDLINK
+                    except OSError:
+                        pass
+                if method is None:
+                    fd_ = os.open(tmp_path,
+                                  os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                  0o600)
+
+            if method is None:
+                (key, length) = self._stream_copy(path, fd_)
+                method = INGEST_COPY
+            else:
+                length = os.stat(tmp_path).st_size
+                if key is None:
+                    # pylint: disable=no-member
+                    key = hash_file(tmp_path, self.hashtype)
+            if dedup and not self.has_keys([key], committer_id,
+                                           freshen=True):
+                method = None
+            else:
+                if method != INGEST_HARDLINK:
+                    os.chmod(tmp_path, 0o644)
+                in_dir.put(tmp_path, key)
+                self._note_staged(key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return (key, length, method)
+
+    def _stream_copy(self, path, fd_):
+        """
+        Copy the file at path to the open file descriptor, hashing it as
+        we go.  The descriptor is closed.  Return (key, length).
+        """
+        # pylint: disable=no-member
+        sha = new_sha(self.hashtype)
+        length = 0
+        with open(path, 'rb') as src, os.fdopen(fd_, 'wb') as dest:
+            while True:
+                chunk = src.read(BUF_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                dest.write(chunk)
+                length += len(chunk)
+        return (sha.hexdigest(), length)
+
+    def ingest_data(self, data, committer_id):
+        """
+        Write data into the committer's staging area under its content
+        key.  Return (key, length).
+        """
+        # pylint: disable=no-member
+        sha = new_sha(self.hashtype)
+        sha.update(data)
+        key = sha.hexdigest()
+        self.in_dir_for(committer_id).put_data(data, key)
+        self._note_staged(key)
+        return (key, len(data))
+
+    def _note_staged(self, key):
+        """ Add a key staged in in/COMMITTER_ID to the Bloom filter. """
+        bloom = self.bloom_filter()
+        if bloom is not None:
+            bloom.add(key)
+
+    # INDEX ---------------------------------------------------------
+
+    def key_index(self, jobs=4):
+        """
+        Return the store's KeyIndex, building it with jobs threads if
+        there is none on disk.
+        """
+        if self._key_index is None:
+            # pylint: disable=no-member
+            self._key_index = KeyIndex(self.u_path, self.dir_struc.name,
+                                       self.hashtype).load(
+                                           jobs, self.packs.hex_keys())
+            self._index_checked = True
+        return self._key_index
+
+    def rebuild_index(self, jobs=4):
+        """
+        Rebuild the store's KeyIndex from the directory tree and the
+        packs, listing directories with jobs threads.  Return it.
+        """
+        if self._key_index is None:
+            # pylint: disable=no-member
+            self._key_index = KeyIndex(self.u_path, self.dir_struc.name,
+                                       self.hashtype)
+            self._index_checked = True
+        return self._key_index.rebuild(jobs, self.packs.hex_keys())
+
+    def _built_index(self):
+        """
+        Return the store's KeyIndex if one has been built, or None.
+        Whether there is one is checked only once.
+        """
+        if not self._index_checked:
+            self._index_checked = True
+            if os.path.exists(os.path.join(self.u_path, IDX_DIR, 'built')):
+                self.key_index()
+        return self._key_index
+
+    def _record(self, key):
+        """ Note a key put into the store in the index and filter. """
+        index = self._built_index()
+        if index is not None:
+            index.add(key)
+        bloom = self.bloom_filter()
+        if bloom is not None:
+            bloom.add(key)
+
+    def put(self, in_file, key):
+        """ Move a file into the store under its key, indexing the key. """
+        result = super().put(in_file, key)
+        self._record(key)
+        return result
+
+    def put_data(self, data, key):
+        """ Write data into the store under its key, indexing the key. """
+        result = super().put_data(data, key)
+        self._record(key)
+        return result
+
+    def copy_and_put(self, path, key):
+        """ Copy a file into the store under its key, indexing the key. """
+        result = super().copy_and_put(path, key)
+        self._record(key)
+        return result
+
+    def delete(self, key):
+        """
+        Remove the key from the store, whether loose or packed, and from
+        its index.  Return whether it was there.
+        """
+        result = super().delete(key)
+        result = self.packs.delete(key) or result
+        index = self._built_index()
+        if index is not None:
+            index.discard(key)
+        return result
+
+    def contains(self, key):
+        """
+        Return whether the key is in the store, according to its Bloom
+        filter, if it has one, and its index.
+        """
+        bloom = self.bloom_filter()
+        if bloom is not None:
+            bloom.reopen_if_replaced()
+            if not bloom.might_contain(key):
+                return False
+        return key in self.key_index()
+
+    def keys(self):
+        """ Yield the keys in the store in ascending order. """
+        return iter(self.key_index())
+
+    # PACKS ---------------------------------------------------------
+
+    @property
+    def packs(self):
+        """ Return the PackSet holding the store's packed objects. """
+        if self._packs is None:
+            # pylint: disable=no-member
+            self._packs = PackSet(self.u_path, self.hashtype)
+        return self._packs
+
+    def exists(self, key):
+        """ Return whether the object is in the store, loose or packed. """
+        return super().exists(key) or key in self.packs
+
+    def get_data(self, key, committer_id=None):
+        """
+        Return the object, loose or packed, or None.  If committer_id,
+        a committer ID or a list of them, is given, the object is also
+        looked for in those staging areas.
+        """
+        try:
+            data = super().get_data(key)
+        except FileNotFoundError:
+            data = None
+        if data is None:
+            data = self.packs.get_data(key)
+        for in_id in _id_list(committer_id):
+            if data is not None:
+                break
+            try:
+                with open(os.path.join(self.u_path, 'in', in_id, key),
+                          'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                pass
+        return data
+
+    def file_len(self, key):
+        """ Return the length of the object, loose or packed. """
+        info = self.stat_key(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        return info[1]
+
+    def stat_key(self, key):
+        """
+        Return (mtime, length) for the object, loose or packed, or None.
+        The mtime of a packed object is that of its pack.
+        """
+        try:
+            info = os.stat(self.get_path_for_key(key))
+            return (info.st_mtime, info.st_size)
+        except FileNotFoundError:
+            return self.packs.stat(key)
+
+    # BLOOM FILTER --------------------------------------------------
+
+    def bloom_filter(self):
+        """
+        Return the store's BloomFilter if one has been built, or None.
+        Whether there is one is checked only once.
+        """
+        if not self._bloom_checked:
+            self._bloom_checked = True
+            path = os.path.join(self.u_path, IDX_DIR, BLOOM_FILE)
+            if os.path.exists(path):
+                self._bloom = BloomFilter(path).open()
+        return self._bloom
+
+    def staging_ids(self):
+        """ Return the committer IDs which have staging areas, sorted. """
+        in_path = os.path.join(self.u_path, 'in')
+        try:
+            return sorted(_.name for _ in os.scandir(in_path) if _.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def staged_keys(self):
+        """ Yield the keys in every committer's staging area. """
+        # pylint: disable=no-member
+        hex_len = 2 * digest_len(self.hashtype)
+        for in_id in self.staging_ids():
+            in_path = os.path.join(self.u_path, 'in', in_id)
+            for entry in os.scandir(in_path):
+                if len(entry.name) == hex_len and entry.is_file():
+                    try:
+                        bytes.fromhex(entry.name)
+                    except ValueError:
+                        continue
+                    yield entry.name
+
+    def rebuild_bloom(self, fp_rate=DEFAULT_FP_RATE, capacity=None, jobs=4):
+        """
+        Build a new BloomFilter over the keys in the store and in its
+        staging areas, replacing any there is.  The key index is built
+        first, with jobs threads, if there is none.  Return the filter.
+        """
+        os.makedirs(os.path.join(self.u_path, IDX_DIR), 0o755, exist_ok=True)
+        index = self.key_index(jobs)
+
+        def all_keys():
+            """ Read the keys once the old filter is locked. """
+            yield from index
+            yield from self.staged_keys()
+
+        if self._bloom is not None:
+            self._bloom.close()
+        self._bloom = BloomFilter.create(
+            os.path.join(self.u_path, IDX_DIR, BLOOM_FILE), all_keys(),
+            capacity, fp_rate)
+        self._bloom_checked = True
+        return self._bloom
+
+    # PRESENCE ------------------------------------------------------
+
+    def _key_dir(self, key, dir_struc):
+        """
+        Return the path relative to the store root of the directory in
+        which the key would be found, without creating it.
+        """
+        if dir_struc == DirStruc.DIR16x16:
+            return os.path.join(key[0], key[1])
+        elif dir_struc == DirStruc.DIR256x256:
+            return os.path.join(key[0:2], key[2:4])
+        return ''
+
+    def _missing_in(self, u_path, dir_struc, keys):
+        """
+        Return those keys not present in the UDir at u_path.
+
+        Keys are grouped by the directory they would be in.  If a group
+        is large compared with its directory, the directory is listed
+        once; otherwise each key is looked up separately.
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._key_dir(key, dir_struc), []).append(key)
+        present = set()
+        for rel_dir, group in groups.items():
+            dir_path = os.path.join(u_path, rel_dir)
+            try:
+                # a directory entry takes very roughly 32 bytes
+                entry_est = os.stat(dir_path).st_size // 32
+            except FileNotFoundError:
+                continue
+            if len(group) * LISTDIR_RATIO >= entry_est:
+                names = set(os.listdir(dir_path))
+                present.update(_ for _ in group if _ in names)
+            else:
+                present.update(_ for _ in group
+                               if os.path.exists(os.path.join(dir_path, _)))
+        return [_ for _ in keys if _ not in present]
+
+    def freshen(self, keys):
+        """
+        Set the modification time of each object in the store proper to
+        now; a packed object's pack is freshened instead.  Keys not in
+        the store are ignored, as are objects the caller may not touch.
+
+        A garbage collection spares unmarked objects modified within its
+        grace period.  A commit which finds an object already stored,
+        and so does not store it again, freshens it so that a collection
+        running meanwhile does not delete it.
+        """
+        pack_paths = set()
+        for key in keys:
+            try:
+                os.utime(self.get_path_for_key(key))
+            except FileNotFoundError:
+                found = self.packs.find(key)
+                if found is not None:
+                    pack_paths.add(found[0].dat_path)
+            except PermissionError:
+                pass                    # another user's object
+        for path in pack_paths:
+            try:
+                os.utime(path)
+            except (FileNotFoundError, PermissionError):
+                pass
+
+    def has_keys(self, keys, committer_id=None, freshen=False):
+        """
+        Given an iterable of content keys, return a list of those which
+        are not in the store, nor, if a committer ID is given, in that
+        committer's staging area, in/COMMITTER_ID.  committer_id may
+        also be a list of IDs, such as staging_ids().  Duplicate keys are
+        dropped; otherwise the order of the keys is preserved.  If the
+        store has a KeyIndex, it is used instead of the directory tree,
+        and if it has a BloomFilter, keys the filter rules out are not
+        looked for at all.  If freshen, the objects found in the store
+        proper are freshened; see freshen().
+        """
+        wanted = []
+        seen = set()
+        for key in keys:
+            if key not in seen:
+                seen.add(key)
+                wanted.append(key)
+        ordered = wanted
+        bloom = self.bloom_filter()
+        if bloom is not None:
+            bloom.reopen_if_replaced()
+            wanted = [_ for _ in wanted if bloom.might_contain(_)]
+        index = self._built_index()
+        if index is not None:
+            missing = index.missing(wanted)
+        else:
+            # pylint: disable=no-member
+            missing = self._missing_in(self.u_path, self.dir_struc, wanted)
+            if missing:
+                missing = self.packs.missing(missing)
+        if freshen:
+            absent = set(missing)
+            self.freshen(_ for _ in wanted if _ not in absent)
+        in_ids = _id_list(committer_id)
+        for in_id in in_ids:
+            if not missing:
+                break
+            in_path = os.path.join(self.u_path, 'in', in_id)
+            missing = self._missing_in(in_path, DirStruc.DIR_FLAT, missing)
+        if bloom is not None:
+            # keys the filter let through which are nowhere at all; one
+            # staged by any committer was rightly let through
+            absent = missing
+            for in_id in self.staging_ids():
+                if not absent:
+                    break
+                if in_id not in in_ids:
+                    absent = self._missing_in(
+                        os.path.join(self.u_path, 'in', in_id),
+                        DirStruc.DIR_FLAT, absent)
+            bloom.false_positives += len(absent)
+            if len(wanted) < len(ordered):
+                present = set(wanted) - set(missing)
+                missing = [_ for _ in ordered if _ not in present]
+        return missing
+
+    # SERIALIZATION -------------------------------------------------
+
     @classmethod
     def create_from_file(cls, path):
         """ Given an on-disk serialization, create a Store object. """
@@ -119,23 +701,106 @@ class Store(UDir):
     @classmethod
     def create_from_string(cls, text):
         """ Given a simple string serialization, create a Store object. """
-        parts = text.split('::')
-        pcount = len(parts)
-        if pcount == 4:
-            name = parts[0]
-            u_path = parts[1]
-            ds_name = parts[2]
-            dir_struc = None
-            for _ in DirStruc:
-                if _.name == ds_name:
-                    dir_struc = _
-                    break
-            else:
-                raise DvczError(
-                    "Not the name of a valid dir_struc name: '%s'" % ds_name)
+        return StoreInfo.create_from_string(text).open()
 
-            # 'item access'
-            hashtype = HashTypes[parts[3]]
-            return Store(name, u_path, dir_struc, hashtype)
-        else:
-            raise DvczError("Invalid Store descriptor: '%s'" % text)
+
+# REGISTRY ==========================================================
+
+
+def _parse_descriptor(text):
+    """
+    Parse a serialized Store descriptor, NAME::U_PATH::DIR_STRUC::HASHTYPE,
+    returning (name, u_path, dir_struc, hashtype) without touching the
+    disk.  Raise DvczError if it is not valid.
+    """
+    parts = text.strip().split('::')
+    if len(parts) != 4:
+        raise DvczError("Invalid Store descriptor: '%s'" % text)
+    (name, u_path, ds_name, ht_name) = parts
+    if not Project.valid_proj_name(name):
+        raise DvczError("not a valid store name: '%s'" % name)
+    for dir_struc in DirStruc:
+        if dir_struc.name == ds_name:
+            break
+    else:
+        raise DvczError(
+            "Not the name of a valid dir_struc name: '%s'" % ds_name)
+    try:
+        hashtype = HashTypes[ht_name]
+    except KeyError:
+        raise DvczError("not a valid hashtype: '%s'" % ht_name)
+    return (name, u_path, dir_struc, hashtype)
+
+
+class StoreInfo(namedtuple('StoreInfo',
+                           ['name', 'u_path', 'dir_struc', 'hashtype'])):
+    """
+    What a Store descriptor records, read without opening the store.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '::'.join([self.name, self.u_path,
+                          self.dir_struc.name, self.hashtype.name])
+
+    @classmethod
+    def create_from_string(cls, text):
+        """ Given a Store descriptor, create a StoreInfo. """
+        return cls(*_parse_descriptor(text))
+
+    def open(self, mode=0o755):
+        """
+        Return the Store described, using the recorded dir_struc and
+        hashtype rather than discovering them.
+        """
+        return Store(self.name, self.u_path, self.dir_struc, self.hashtype,
+                     mode)
+
+
+# stores_path -> (st_mtime_ns of stores_path, {name: StoreInfo})
+_REGISTRY = {}
+
+
+def load_stores(stores_path):
+    """
+    Return a dictionary mapping the name of each Store described in
+    stores_path to its StoreInfo.  A missing directory holds no stores.
+
+    The descriptors are read in one pass over the directory and cached
+    until its modification time changes, which it does when a
+    descriptor is added, removed, or replaced by renaming.  Raise
+    DvczError if a descriptor is not valid or its name is not the name
+    of its file.
+    """
+    try:
+        mtime_ns = os.stat(stores_path).st_mtime_ns
+    except FileNotFoundError:
+        _REGISTRY.pop(stores_path, None)
+        return {}
+    cached = _REGISTRY.get(stores_path)
+    if cached is not None and cached[0] == mtime_ns:
+        return dict(cached[1])
+
+    infos = {}
+    for entry in os.scandir(stores_path):
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        with open(entry.path, 'r') as file:
+            info = StoreInfo.create_from_string(file.read())
+        if info.name != entry.name:
+            raise DvczError("store descriptor %s names store '%s'" % (
+                entry.path, info.name))
+        infos[info.name] = info
+    _REGISTRY[stores_path] = (mtime_ns, infos)
+    return dict(infos)
+
+
+def invalidate_stores(stores_path=None):
+    """
+    Forget the cached descriptors for stores_path, or for every
+    directory if stores_path is None.
+    """
+    if stores_path is None:
+        _REGISTRY.clear()
+    else:
+        _REGISTRY.pop(stores_path, None)
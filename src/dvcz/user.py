@@ -4,20 +4,25 @@ User, PubUser, Committer, and PubCommitter objects and related classes
 and functions.
 """
 
+import copy
+import hashlib
 import os
 # import re
+import shutil
 import sys
+import threading
 import time
-import hashlib
+from collections import OrderedDict
+from itertools import repeat
 
-from buildlist import(check_dirs_in_path, generate_rsa_key,
-                      read_rsa_key, rm_f_dir_contents)
 from dvcz import DvczError
+from dvcz.hashing import new_sha
+from dvcz.key_pool import KEY_POOL_DIR, KeyPool
 from dvcz.project import Project
 from xlattice import HashTypes
-from xlu import UDir
 
-from Crypto.PublicKey import RSA
+# Crypto.PublicKey.RSA, buildlist, and xlu are slow to import and so are
+# imported only by the functions which use them.
 
 if sys.version_info < (3, 6):
     # pylint: disable=unused-import
@@ -37,16 +42,7 @@ def make_committer_id(pubkey, hashtype=HashTypes.SHA2):
     Returns a 40- or 64-character hex value.
     """
 
-    if hashtype == HashTypes.SHA1:
-        sha = hashlib.sha1()
-    elif hashtype == HashTypes.SHA2:
-        sha = hashlib.sha256()
-    elif hashtype == HashTypes.SHA3:
-        sha = hashlib.sha3_256()
-    elif hashtype == HashTypes.BLAKE2B:
-        sha = hashlib.blake2b(digest_size=32)
-    else:
-        raise NotImplementedError
+    sha = new_sha(hashtype)
     sha.update(pubkey.exportKey())  # PEM format
     sha.update(str(time.time()).encode('utf-8'))
     return sha.hexdigest()
@@ -56,6 +52,9 @@ def do_add_user(options):
     """
     Carry out the configuration.
     """
+    from buildlist import(check_dirs_in_path, generate_rsa_key,
+                          read_rsa_key, rm_f_dir_contents)
+    from xlu import UDir
 
     if options.testing:
         if os.path.exists('tmp'):
@@ -66,18 +65,35 @@ def do_add_user(options):
     # this is $HOME/.dvcz unless testing
 
     if os.path.exists(options.user_dvcz_path) and options.force:
-        rm_f_dir_contents(options.user_dvcz_path)  # empties the directory
+        # empties the directory, except for any key pool
+        for name in os.listdir(options.user_dvcz_path):
+            if name == KEY_POOL_DIR:
+                continue
+            path = os.path.join(options.user_dvcz_path, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
 
     if not os.path.exists(options.user_dvcz_path):
         os.makedirs(options.user_dvcz_path, exist_ok=True, mode=0o755)
 
-    # write RSA private key to $DVCZ_DIR/node/sk_priv.pem
+    # write RSA private key to $DVCZ_DIR/node/sk_priv.pem, taking it
+    # from the key pool if there is one
     if not os.path.exists(options.key_path):
         check_dirs_in_path(options.key_path)
-        if options.testing:
-            generate_rsa_key(options.key_path, 1024)
+        key_bits = 1024 if options.testing else options.key_bits
+        pem = None
+        key_pool_path = getattr(options, 'key_pool_path', None)
+        if key_pool_path:
+            pem = KeyPool(key_pool_path, key_bits).take_pem()
+        if pem:
+            fd_ = os.open(options.key_path,
+                          os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o400)
+            with os.fdopen(fd_, 'w') as file:
+                file.write(pem)
         else:
-            generate_rsa_key(options.key_path, options.key_bits)
+            generate_rsa_key(options.key_path, key_bits)
 
     # Read the RSA private key from disk ------------------
     privkey = read_rsa_key(options.key_path)
@@ -122,6 +138,198 @@ def do_add_user(options):
         # my_in_dir =
         UDir.discover(my_in_path, hashtype=hashtype)
 
+# == batch adduser ==================================================
+
+# under the user's .dvcz/, where users added in bulk are kept
+USERS_DIR = 'users'
+
+
+def read_manifest(path):
+    """
+    Return the list of logins in a manifest file, one login per line.
+    Blank lines and lines beginning with '#' are ignored.  Raise
+    DvczError if any login is invalid or appears more than once.
+    """
+    logins = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if not Project.valid_proj_name(line):
+                raise DvczError("not a valid login: '%s'" % line)
+            if line in logins:
+                raise DvczError("login '%s' appears twice in %s" % (
+                    line, path))
+            logins.append(line)
+    return logins
+
+
+def _new_committer(key_bits, hashtype, pem=None):
+    """
+    Generate an RSA key unless one is supplied and make a committer ID
+    from it, returning (pem, committer_id).  Run in worker processes.
+    """
+    from Crypto.PublicKey import RSA
+    if pem is None:
+        key = RSA.generate(key_bits)
+        pem = key.exportKey('PEM').decode('utf-8')
+    else:
+        key = RSA.importKey(pem)
+    return (pem, make_committer_id(key.publickey(), hashtype))
+
+
+def add_users(logins, users_path, u_path=None, key_bits=2048,
+              hashtype=HashTypes.SHA2, jobs=1, key_pool=None):
+    """
+    Provision many users at once.
+
+    Each login gets a directory users_path/LOGIN/ holding its RSA key,
+    node/skPriv.pem, and its committer ID, id.  If u_path is set, the
+    content-keyed store there is discovered once and u_path/in/ID/
+    created for each committer.  Keys are taken from the key_pool if
+    one is supplied; any others are generated by jobs worker processes.
+    Logins which already have an ID are left as they are.
+
+    Return a list of (login, committer_id, created) in the order of the
+    logins.
+    """
+    for login in logins:
+        if not Project.valid_proj_name(login):
+            raise DvczError("not a valid login: '%s'" % login)
+    if len(set(logins)) != len(logins):
+        raise DvczError("duplicate logins")
+
+    store = None
+    if u_path:
+        from dvcz.store import Store
+        store = Store.discover('U', u_path, hashtype=hashtype)
+
+    ids = {}                            # login -> committer ID
+    todo = []
+    for login in logins:
+        path_to_id = os.path.join(users_path, login, 'id')
+        if os.path.exists(path_to_id):
+            with open(path_to_id, 'r') as file:
+                ids[login] = file.read().strip()
+        else:
+            todo.append(login)
+
+    pems = []
+    for _ in todo:
+        pem = key_pool.take_pem() if key_pool else None
+        if pem is None:
+            break
+        pems.append(pem)
+    pems.extend([None] * (len(todo) - len(pems)))
+
+    if jobs > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_new_committer, repeat(key_bits),
+                                        repeat(hashtype), pems))
+    else:
+        results = [_new_committer(key_bits, hashtype, _) for _ in pems]
+
+    for login, (pem, committer_id) in zip(todo, results):
+        user_path = os.path.join(users_path, login)
+        key_path = os.path.join(user_path, 'node', 'skPriv.pem')
+        os.makedirs(os.path.dirname(key_path), 0o700, exist_ok=True)
+        if os.path.exists(key_path):
+            os.unlink(key_path)         # left by an interrupted run
+        fd_ = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o400)
+        with os.fdopen(fd_, 'w') as file:
+            file.write(pem)
+        # the ID is written last: a user with an ID is complete
+        with open(os.path.join(user_path, 'id'), 'w') as file:
+            file.write(committer_id)
+        ids[login] = committer_id
+
+    if store:
+        for login in logins:
+            store.in_dir_for(ids[login])
+
+    created = set(todo)
+    return [(_, ids[_], _ in created) for _ in logins]
+
+
+# == parse cache ====================================================
+
+PARSE_CACHE_SIZE = 256          # parsed Users and Committers kept
+
+
+class ParseCache(object):
+    """
+    Process-wide cache of parsed Users and Committers, keyed by the
+    class parsed and the SHA256 digest of the serialized text.
+
+    A serialization fully determines the object parsed from it, so the
+    text need be parsed only once.  Users carry state, such as the keys
+    loaded so far, so each caller is given its own shallow copy of the
+    object cached.  The copies share the RSA keys imported from the
+    text, which are therefore imported at most once.  At most
+    max_entries objects are kept, the least recently used being
+    discarded first.
+    """
+
+    def __init__(self, max_entries=PARSE_CACHE_SIZE):
+        if max_entries < 1:
+            raise DvczError("cache must hold at least one entry")
+        self._max_entries = max_entries
+        self._lru = OrderedDict()       # (cls, digest) -> parsed object
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(strings):
+        """ Return the digest of a serialization split into lines. """
+        return hashlib.sha256('\n'.join(strings).encode('utf-8')).digest()
+
+    def __len__(self):
+        return len(self._lru)
+
+    def get(self, cls, strings, parse):
+        """
+        Return a copy of the object of class cls serialized as the list
+        of strings, calling parse(strings) only if it is not cached.
+        Nothing is cached if parse() raises.
+        """
+        key = (cls, self.digest(strings))
+        with self._lock:
+            obj = self._lru.get(key)
+            if obj is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return copy.copy(obj)
+            self.misses += 1
+        obj = parse(strings)
+        with self._lock:
+            self._lru[key] = obj
+            while len(self._lru) > self._max_entries:
+                self._lru.popitem(last=False)
+        return copy.copy(obj)
+
+    def invalidate(self, string=None):
+        """
+        Forget the objects parsed from a serialization, or everything
+        if string is None.
+        """
+        with self._lock:
+            if string is None:
+                self._lru.clear()
+                return
+            strings = string.split('\n')
+            while strings and strings[-1] == '':
+                strings = strings[:-1]
+            digest = self.digest(strings)
+            for key in [_ for _ in self._lru if _[1] == digest]:
+                del self._lru[key]
+
+
+PARSE_CACHE = ParseCache()
+
+
 # CLASSES ===========================================================
 
 
@@ -129,11 +337,20 @@ class _User(object):
     """
     Abstract version of the User class.
 
-    Includes secret RSA keys.
+    Includes secret RSA keys.  Each key may be supplied as an RSA key
+    object, as PEM-formatted text, or not at all.  Keys are imported or
+    generated only when first used, so creating a User costs next to
+    nothing until sk_priv or ck_priv is wanted.  A key object whose size
+    is not key_bits is replaced by a newly generated one; a PEM key of
+    the wrong size is an error when it is imported.  If key_bits is
+    None, it is taken from the size of sk_priv.
+
+    If a KeyPool is supplied, keys are taken from it rather than being
+    generated, so long as it has keys of the right size.
     """
 
     def __init__(self, login=os.environ['LOGNAME'],
-                 sk_priv=None, ck_priv=None, key_bits=2048):
+                 sk_priv=None, ck_priv=None, key_bits=2048, key_pool=None):
 
         # The login must always be a valid name, one including no
         # delimiters or other odd characters.  At least for the mement
@@ -142,26 +359,85 @@ class _User(object):
         if not Project.valid_proj_name(login):
             raise DvczError("not a valid login: '%s'" % login)
         self._login = login
+        if key_bits is None and sk_priv is None:
+            raise DvczError("key_bits required if no sk_priv supplied")
+        self._key_bits = key_bits
+        self._key_pool = key_pool
+        # PEM text -> the RSA key imported from it, shared by copies
+        self._imported = {}
+        # held while a key is imported or generated, so that threads
+        # first using the keys together all see the same ones
+        self._key_lock = threading.RLock()
 
-        # Caller can supply keys with different sizes.
-        if sk_priv:
-            if sk_priv.size() + 1 != key_bits:
-                sk_priv = None
-            elif ck_priv.size() + 1 != key_bits:
-                ck_priv = None
-        if sk_priv is None:
-            sk_priv = RSA.generate(key_bits)
-            ck_priv = None
-        if ck_priv is None:
-            ck_priv = RSA.generate(key_bits)
         # To write use
         #   with open(path, 'wb+') as file:
         #       file.write(sk_priv.exportKey('PEM'))
         # To read use
         #   with open(path, 'rb') as file: sk_priv = RSA.importKey(file.read())
-        self._sk_priv = sk_priv
-        self._ck_priv = ck_priv
-        self._key_bits = sk_priv.size() + 1
+        (self._sk_priv, self._sk_pem) = self._check_key(sk_priv)
+        (self._ck_priv, self._ck_pem) = self._check_key(ck_priv)
+
+    def _check_key(self, key):
+        """
+        Return (key, pem) for a key as supplied, where key is an RSA key
+        object and pem its PEM-formatted text, either or both being None
+        until the key is imported or generated.  Caller can supply keys
+        with different sizes; these are discarded.
+        """
+        if key is None:
+            return (None, None)
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if isinstance(key, str):
+            return (None, key)
+        if self._key_bits is not None and key.size() + 1 != self._key_bits:
+            return (None, None)
+        return (key, None)
+
+    def _load_key(self, pem, key_bits):
+        """
+        Import the PEM-formatted key if there is one, otherwise
+        generate a new key, in either case of size key_bits.  If
+        key_bits is None, whatever size the imported key has is taken
+        to be the size of the user's keys.
+
+        An imported key of any other size raises DvczError: replacing
+        it now, on first use, would change the user's identity midway
+        through whatever it is being used for.
+        """
+        from Crypto.PublicKey import RSA
+        if pem is not None:
+            key = self._imported.get(pem)
+            if key is None:
+                key = RSA.importKey(pem)
+                self._imported[pem] = key
+            if key_bits is None:
+                self._key_bits = key_bits = key.size() + 1
+            if key.size() + 1 != key_bits:
+                raise DvczError("%s's key has %d bits, not %d" % (
+                    self._login, key.size() + 1, key_bits))
+            return key
+        pool = self._key_pool
+        if pool is not None and pool.key_bits == key_bits:
+            return pool.take()
+        return RSA.generate(key_bits)
+
+    def generate_keys(self):
+        """
+        Import or generate both RSA keys now rather than on first use.
+        """
+        # pylint: disable=pointless-statement
+        self.sk_priv
+        self.ck_priv
+
+    def _raw_keys(self):
+        """
+        Return (sk_priv, ck_priv, key_bits) as they might be passed to
+        the constructor, without importing or generating keys.
+        """
+        sk_priv = self._sk_priv if self._sk_priv is not None else self._sk_pem
+        ck_priv = self._ck_priv if self._ck_priv is not None else self._ck_pem
+        return (sk_priv, ck_priv, self._key_bits)
 
     @property
     def login(self):
@@ -171,13 +447,46 @@ class _User(object):
     @property
     def sk_priv(self):
         """ Return the RSA key used for making digital signatures. """
+        if self._sk_priv is None:
+            with self._key_lock:
+                if self._sk_priv is None:
+                    self._sk_priv = self._load_key(self._sk_pem,
+                                                   self._key_bits)
+                    self._sk_pem = None
         return self._sk_priv
 
     @property
     def ck_priv(self):
         """ Return the RSA key used for encryption. """
+        if self._ck_priv is None:
+            with self._key_lock:
+                if self._ck_priv is None:
+                    # if the key size is not known, sk_priv determines it
+                    self._ck_priv = self._load_key(self._ck_pem,
+                                                   self.key_bits)
+                    self._ck_pem = None
         return self._ck_priv
 
+    @property
+    def sk_pem(self):
+        """
+        Return the RSA key used for making digital signatures as
+        PEM-formatted text, importing or generating it only if there
+        is no such text.
+        """
+        if self._sk_pem is not None:
+            return self._sk_pem
+        # pylint: disable=no-member
+        return self.sk_priv.exportKey('PEM').decode('utf-8')
+
+    @property
+    def ck_pem(self):
+        """ Return the RSA key used for encryption as PEM-formatted text. """
+        if self._ck_pem is not None:
+            return self._ck_pem
+        # pylint: disable=no-member
+        return self.ck_priv.exportKey('PEM').decode('utf-8')
+
     @property
     def key_bits(self):
         """
@@ -185,6 +494,8 @@ class _User(object):
 
         Note that PyCrypt's RSA size is 1 less than key_bits.
         """
+        if self._key_bits is None:
+            self._key_bits = self.sk_priv.size() + 1
         return self._key_bits
 
 
@@ -198,28 +509,22 @@ class User(_User):
     END_LINE = '-----END DVCZ USER-----'
 
     def __init__(self, login=os.environ['LOGNAME'],
-                 sk_priv=None, ck_priv=None, key_bits=2048):
+                 sk_priv=None, ck_priv=None, key_bits=2048, key_pool=None):
         # pylint: disable=useless-super-delegation
-        super().__init__(login, sk_priv, ck_priv, key_bits)
+        super().__init__(login, sk_priv, ck_priv, key_bits, key_pool)
 
     def __eq__(self, other):
         if not isinstance(other, User):
             return False
         return self._login == other.login and \
-            self._sk_priv == other.sk_priv and \
-            self._ck_priv == other.ck_priv
+            self.sk_pem == other.sk_pem and \
+            self.ck_pem == other.ck_pem
 
     def __str__(self):
+        # keys not yet imported are serialized as they were read;
         # possible ValueErrors here
-        sk_exp_ = self.sk_priv.exportKey('PEM')
-        # pylint is confused here
-        # pylint: disable=no-member
-        sk_exp = sk_exp_.decode('utf-8')
-
-        ck_exp_ = self.ck_priv.exportKey('PEM')
-        # pylint is confused here
-        # pylint: disable=no-member
-        ck_exp = ck_exp_.decode('utf-8')
+        sk_exp = self.sk_pem
+        ck_exp = self.ck_pem
 
         return """{0}
 {1}
@@ -247,21 +552,29 @@ class User(_User):
             raise DvczError('empty string')
 
         strings = string.split('\n')
-        if strings[-1] == '\n':
+        while strings and strings[-1] == '':
             strings = strings[:-1]
         return cls.create_from_string_array(strings)
 
     @classmethod
     def create_from_string_array(cls, strings):
-        """ Parse the serialized User object from a list of strings. """
+        """
+        Parse the serialized User object from a list of strings.  The
+        same serialization is parsed only once.
+        """
 
         if not strings:
             raise DvczError('empty string array')
+        return PARSE_CACHE.get(User, strings, User._parse_string_array)
+
+    @staticmethod
+    def _parse_string_array(strings):
+        """ Parse the serialized User object, bypassing the cache. """
 
         def collect_priv(lines, offset, line_count):
             """
-            Interpret a list of lines of text as a PEM-formatted
-            RSA private key.
+            Collect the lines of text making up a PEM-formatted RSA
+            private key.  The key is imported only when first used.
             """
 
             # find the end of the PEM-formatted RSA private key
@@ -274,33 +587,26 @@ class User(_User):
             if not found:
                 raise DvczError("can't find end of PEM-formatted RSA key")
             text = '\n'.join(lines[offset:ndx + 1])
-            priv = RSA.importKey(text)
-            return (ndx + 1, priv)
+            return (ndx + 1, text)
 
         line_count = len(strings)
         if line_count < 5:
             raise DvczError(
                 "too few parts (%d) in User string array" % line_count)
-        if strings[0] != cls.START_LINE:
+        if strings[0] != User.START_LINE:
             raise DvczError("found '%s' instead of '%s'" % (
-                strings[0], cls.START_LINE))
+                strings[0], User.START_LINE))
         login = strings[1]
         offset = 2
         offset, sk_priv = collect_priv(strings, offset, line_count)
         offset, ck_priv = collect_priv(strings, offset, line_count)
 
-        if strings[offset] != cls.END_LINE:
+        if strings[offset] != User.END_LINE:
             raise DvczError("found '%s' instead of '%s'" % (
-                strings[offset], cls.END_LINE))
+                strings[offset], User.END_LINE))
 
-        # XXX Ignoring possiblity of differences key sizes
-        key_bits = sk_priv.size() + 1   # XXX TILT: PyCrypto returns eg 1023
-        # DEBUG
-        # print("create_from_string_array: found sk_priv size is %d" %
-        #        key_bits)
-        # END
-
-        return User(login, sk_priv, ck_priv, key_bits)
+        # key_bits is taken from sk_priv when it is imported
+        return User(login, sk_priv, ck_priv, None)
 
 
 class _PubUser(object):
@@ -339,14 +645,50 @@ class _PubUser(object):
         """ Return the public part of the RSA key used for encryption. """
         return self._ck
 
+    def __eq__(self, other):
+        if not isinstance(other, _PubUser):
+            return False
+        return self._login == other.login and \
+            _pub_pem(self._sk) == _pub_pem(other.sk_) and \
+            _pub_pem(self._ck) == _pub_pem(other.ck_)
+
     def __str__(self):
+        return """{0}
+{1}
+{2}
+{3}
+{4}
+""".format(PubUser.START_LINE,
+           self.login,
+           _pub_pem(self._sk),
+           _pub_pem(self._ck),
+           PubUser.END_LINE)
+
+
+def _pub_pem(key):
+    """ Return a public RSA key as PEM-formatted text. """
+    return key.exportKey('PEM').decode('utf-8')
 
-        return "NOT IMPLEMENTED: User.__str__()"
+
+def _collect_pub(lines, offset, line_count):
+    """
+    Collect and import the lines of text making up a PEM-formatted RSA
+    public key, returning the offset of the next line and the key.
+    """
+    from Crypto.PublicKey import RSA
+    for ndx in range(offset + 1, line_count):
+        if lines[ndx].startswith('-----END ') and \
+                lines[ndx].endswith(' KEY-----'):
+            return (ndx + 1, RSA.importKey('\n'.join(lines[offset:ndx + 1])))
+    raise DvczError("can't find end of PEM-formatted RSA key")
 
 
 class PubUser(_PubUser):
     """ The public view of a User, one which conains no secret keys. """
 
+    START_LINE = '-----START DVCZ PUB USER-----'
+    END_LINE = '-----END DVCZ PUB USER-----'
+
     @classmethod
     def create_from_user(cls, user):
         """ Replaces each private RSA key with its public part. """
@@ -354,10 +696,52 @@ class PubUser(_PubUser):
                        user.sk_priv.publickey(),
                        user.ck_priv.publickey())
 
-    def create_from_file(self, path):
+    @classmethod
+    def create_from_file(cls, path):
+        """ Parse the serialized PubUser object. """
+        with open(path, 'r') as file:
+            text = file.read()
+        return cls.create_from_string(text)
+
+    @classmethod
+    def create_from_string(cls, string):
         """ Parse the serialized PubUser object. """
 
-        raise NotImplementedError()
+        if not string:
+            raise DvczError('empty string')
+        strings = string.split('\n')
+        while strings and strings[-1] == '':
+            strings = strings[:-1]
+        return cls.create_from_string_array(strings)
+
+    @classmethod
+    def create_from_string_array(cls, strings):
+        """
+        Parse the serialized PubUser object from a list of strings,
+        importing its public keys.  The same serialization is parsed
+        only once.
+        """
+        if not strings:
+            raise DvczError('empty string array')
+        return PARSE_CACHE.get(PubUser, strings, PubUser._parse_string_array)
+
+    @staticmethod
+    def _parse_string_array(strings):
+        """ Parse the serialized PubUser object, bypassing the cache. """
+
+        line_count = len(strings)
+        if line_count < 5:
+            raise DvczError(
+                "too few parts (%d) in PubUser string array" % line_count)
+        if strings[0] != PubUser.START_LINE:
+            raise DvczError("found '%s' instead of '%s'" % (
+                strings[0], PubUser.START_LINE))
+        login = strings[1]
+        offset, sk_ = _collect_pub(strings, 2, line_count)
+        offset, ck_ = _collect_pub(strings, offset, line_count)
+        if offset >= line_count or strings[offset] != PubUser.END_LINE:
+            raise DvczError("missing '%s'" % PubUser.END_LINE)
+        return PubUser(login, sk_, ck_)
 
 
 class Committer(User):
@@ -374,10 +758,10 @@ class Committer(User):
     END_LINE = '-----END DVCZ COMMITTER-----'
 
     def __init__(self, handle, login=os.environ['LOGNAME'],
-                 sk_priv=None, ck_priv=None, key_bits=2048):
+                 sk_priv=None, ck_priv=None, key_bits=2048, key_pool=None):
         if not Project.valid_proj_name(handle):
             raise DvczError("'%s' is not a valid handle" % handle)
-        super().__init__(login, sk_priv, ck_priv, key_bits)
+        super().__init__(login, sk_priv, ck_priv, key_bits, key_pool)
         self._handle = handle
 
     @property
@@ -390,8 +774,8 @@ class Committer(User):
             return False
         return self._handle == other.handle and \
             self._login == other.login and \
-            self._sk_priv == other.sk_priv and \
-            self._ck_priv == other.ck_priv
+            self.sk_pem == other.sk_pem and \
+            self.ck_pem == other.ck_pem
 
     def __str__(self):
         return """{0}
@@ -420,38 +804,46 @@ class Committer(User):
         # print("Committer.create_from_string: input is:\n%s" % string)
         # END
         strings = string.split('\n')
-        while strings[-1] == '':
+        while strings and strings[-1] == '':
             strings = strings[:-1]
         return cls.create_from_string_array(strings)
 
     @classmethod
     def create_from_string_array(cls, strings):
-        """ Parse the serialized Committer object from a list of strings. """
+        """
+        Parse the serialized Committer object from a list of strings.
+        The same serialization is parsed only once.
+        """
 
         if not strings:
             raise DvczError("empty string array")
+        return PARSE_CACHE.get(Committer, strings,
+                               Committer._parse_string_array)
 
+    @staticmethod
+    def _parse_string_array(strings):
+        """
+        Parse the serialized Committer object, bypassing the cache.
+        """
         line_count = len(strings)
         if line_count < 5:
             raise DvczError(
                 "too few lines (%d) in Committer string array" % line_count)
 
-        if strings[0] != cls.START_LINE:
+        if strings[0] != Committer.START_LINE:
             raise DvczError("found '%s' instead of '%s'" % (
-                strings[0], cls.START_LINE))
+                strings[0], Committer.START_LINE))
         handle = strings[1]
 
-        if strings[-1] != cls.END_LINE:
+        if strings[-1] != Committer.END_LINE:
             raise DvczError("found '%s' instead of '%s'" % (
-                strings[-1], cls.END_LINE))
+                strings[-1], Committer.END_LINE))
 
-        user = User.create_from_string_array(strings[2:-1])
+        # pylint: disable=protected-access
+        user = User._parse_string_array(strings[2:-1])
+        (sk_priv, ck_priv, key_bits) = user._raw_keys()
 
-        return Committer(handle,
-                         user.login,
-                         user.sk_priv,
-                         user.ck_priv,
-                         user.key_bits)
+        return Committer(handle, user.login, sk_priv, ck_priv, key_bits)
 
 
 class PubCommitter(_PubUser):
@@ -459,9 +851,89 @@ class PubCommitter(_PubUser):
     The public view of a Committer, one which contains no secret keys.
     """
 
+    START_LINE = '-----START DVCZ PUB COMMITTER-----'
+    END_LINE = '-----END DVCZ PUB COMMITTER-----'
+
     def __init__(self, handle, login=os.environ['LOGNAME'],
                  sk_=None, ck_=None):
         if not Project.valid_proj_name(handle):
             raise DvczError("'%s' is not a valid handle" % handle)
         super().__init__(login, sk_, ck_)
         self._handle = handle
+
+    @property
+    def handle(self):
+        """ Return the committer's handle, a valid name. """
+        return self._handle
+
+    def __eq__(self, other):
+        if not isinstance(other, PubCommitter):
+            return False
+        return self._handle == other.handle and super().__eq__(other)
+
+    def __str__(self):
+        return """{0}
+{1}
+{2}{3}
+""".format(PubCommitter.START_LINE,
+           self.handle,
+           super().__str__(),
+           PubCommitter.END_LINE)
+
+    @classmethod
+    def create_from_committer(cls, committer):
+        """ Replaces each private RSA key with its public part. """
+        return PubCommitter(committer.handle, committer.login,
+                            committer.sk_priv.publickey(),
+                            committer.ck_priv.publickey())
+
+    @classmethod
+    def create_from_file(cls, path):
+        """ Parse the serialized PubCommitter object. """
+        with open(path, 'r') as file:
+            text = file.read()
+        return cls.create_from_string(text)
+
+    @classmethod
+    def create_from_string(cls, string):
+        """ Parse the serialized PubCommitter object. """
+
+        if not string:
+            raise DvczError('empty string')
+        strings = string.split('\n')
+        while strings and strings[-1] == '':
+            strings = strings[:-1]
+        return cls.create_from_string_array(strings)
+
+    @classmethod
+    def create_from_string_array(cls, strings):
+        """
+        Parse the serialized PubCommitter object from a list of strings.
+        The same serialization is parsed only once.
+        """
+        if not strings:
+            raise DvczError("empty string array")
+        return PARSE_CACHE.get(PubCommitter, strings,
+                               PubCommitter._parse_string_array)
+
+    @staticmethod
+    def _parse_string_array(strings):
+        """
+        Parse the serialized PubCommitter object, bypassing the cache.
+        """
+        line_count = len(strings)
+        if line_count < 5:
+            raise DvczError(
+                "too few lines (%d) in PubCommitter string array" %
+                line_count)
+        if strings[0] != PubCommitter.START_LINE:
+            raise DvczError("found '%s' instead of '%s'" % (
+                strings[0], PubCommitter.START_LINE))
+        handle = strings[1]
+        if strings[-1] != PubCommitter.END_LINE:
+            raise DvczError("found '%s' instead of '%s'" % (
+                strings[-1], PubCommitter.END_LINE))
+
+        # pylint: disable=protected-access
+        user = PubUser._parse_string_array(strings[2:-1])
+        return PubCommitter(handle, user.login, user.sk_, user.ck_)
@@ -0,0 +1,292 @@
+# dvcz/workspace.py
+
+"""
+Commit many projects in one process.
+
+Running dvc_commit once per project pays for interpreter startup, store
+discovery, reading the signing key, and setting up hashing every time.
+A Workspace does these once and then commits each project in turn,
+sharing
+
+* the Store, discovered once,
+* the committer's RSA key, read once, and
+* a HashCache mapping (st_dev, st_ino, st_size, st_mtime_ns) to content
+  keys, so that a file reachable from more than one project, through a
+  hard link or overlapping project trees, is hashed only once.
+
+Each project keeps its own StatCache, builds log, and build index,
+exactly as if dvc_commit had been run in it.  What was done is collected
+in a WorkspaceSummary.
+"""
+
+import os
+import time
+from collections import namedtuple
+
+from dvcz import DvczError
+from dvcz.builds import files_not_found, next_build_number
+from dvcz.commit import CommitSummary, list_gen
+from dvcz.project import ProjectLocator
+from dvcz.stat_cache import RACY_NS, StatCache
+from xlattice import HashTypes
+
+__all__ = ['HashCache', 'ProjectResult', 'WorkspaceSummary', 'Workspace',
+           'read_proj_list']
+
+LIST_FILE = 'lastBuildList'
+IGNORE_FILE = '.dvczignore'
+
+
+def read_proj_list(path):
+    """
+    Return the list of project paths in a file, one per line.  Blank
+    lines and lines beginning with '#' are ignored.
+    """
+    paths = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(line)
+    return paths
+
+
+class HashCache(object):
+    """
+    Content keys shared by all projects committed in a process, keyed
+    by (st_dev, st_ino, st_size, st_mtime_ns).
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _stat_key(stat):
+        """ Return the cache key for the stat information. """
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def lookup(self, stat):
+        """ Return the content key for the file or None. """
+        hex_hash = self._keys.get(self._stat_key(stat))
+        if hex_hash is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return hex_hash
+
+    def update(self, stat, hex_hash):
+        """
+        Record the content key unless the file was modified so recently
+        that the stat information cannot be trusted.
+        """
+        if int(time.time() * 1e9) - stat.st_mtime_ns >= RACY_NS:
+            self._keys[self._stat_key(stat)] = hex_hash
+
+
+class _SharedStatCache(object):
+    """
+    A project's StatCache backed by the workspace's HashCache: a file
+    not in the project's cache is looked up in the HashCache before it
+    is hashed, and keys computed are recorded in both.
+    """
+
+    def __init__(self, stat_cache, hash_cache):
+        self._stat_cache = stat_cache
+        self._hash_cache = hash_cache
+        self.lookups = 0            # one per file in the project
+        self.shared_hits = 0
+
+    @property
+    def hits(self):
+        """ Return the number of keys found in the project's cache. """
+        return self._stat_cache.hits
+
+    def lookup(self, rel_path, stat):
+        """ Return the cached key for the file, if any, or None. """
+        self.lookups += 1
+        hex_hash = self._stat_cache.lookup(rel_path, stat)
+        if hex_hash is None:
+            hex_hash = self._hash_cache.lookup(stat)
+            if hex_hash is not None:
+                self.shared_hits += 1
+                self._stat_cache.update(rel_path, stat, hex_hash)
+        return hex_hash
+
+    def update(self, rel_path, stat, hex_hash):
+        """ Record a key computed for the file. """
+        self._stat_cache.update(rel_path, stat, hex_hash)
+        self._hash_cache.update(stat, hex_hash)
+
+    def save(self):
+        """ Write the project's cache back to disk. """
+        self._stat_cache.save()
+
+
+# what committing one project did; error is '' if it succeeded
+ProjectResult = namedtuple('ProjectResult', [
+    'name', 'path', 'version', 'files', 'cached', 'shared', 'hashed',
+    'staged', 'deduped', 'bytes_staged', 'secs', 'error'])
+
+
+class WorkspaceSummary(object):
+    """ What Workspace.commit_all() did, project by project. """
+
+    def __init__(self):
+        self.results = []
+        self.total_secs = 0.0
+
+    def add(self, result):
+        """ Record the ProjectResult for one project. """
+        self.results.append(result)
+
+    @property
+    def failed(self):
+        """ Return the results for projects which were not committed. """
+        return [_ for _ in self.results if _.error]
+
+    def total(self, field):
+        """ Return the sum of a numeric field over all projects. """
+        return sum(getattr(_, field) for _ in self.results)
+
+    def __str__(self):
+        lines = ["%-20s %-12s %7s %7s %7s %7s %7s %12s" % (
+            'project', 'version', 'files', 'cached', 'shared', 'hashed',
+            'staged', 'bytes')]
+        for result in self.results:
+            if result.error:
+                lines.append("%-20s FAILED: %s" % (result.name, result.error))
+                continue
+            lines.append("%-20s %-12s %7d %7d %7d %7d %7d %12d" % (
+                result.name, result.version, result.files, result.cached,
+                result.shared, result.hashed, result.staged,
+                result.bytes_staged))
+        lines.append("projects:       %d committed, %d failed" % (
+            len(self.results) - len(self.failed), len(self.failed)))
+        lines.append("files:          %d, %d hashed, %d deduplicated" % (
+            self.total('files'), self.total('hashed'),
+            self.total('deduped')))
+        lines.append("transferred:    %d bytes" % self.total('bytes_staged'))
+        lines.append("time (seconds): %.3f elapsed" % self.total_secs)
+        return '\n'.join(lines)
+
+
+class Workspace(object):
+    """
+    Commit projects one after another, sharing the store, the signing
+    key, and a HashCache.
+
+    key_path is the committer's RSA private key.  If u_path is set,
+    each project's files are staged in u_path/in/COMMITTER_ID, as by
+    dvc_commit.  Each project excludes the files named in its
+    .dvczignore, build/, and anything in excl; walk_proj() skips dvcz's
+    own working files.
+    """
+
+    def __init__(self, key_path, u_path=None, committer_id='',
+                 hashtype=HashTypes.SHA2, jobs=1, zero_copy=False,
+                 hardlink=False, excl=None):
+        if u_path and not committer_id:
+            raise DvczError("committer ID required to commit to a store")
+        self._key_path = key_path
+        self._committer_id = committer_id
+        self._hashtype = hashtype
+        self._jobs = jobs
+        self._zero_copy = zero_copy
+        self._hardlink = hardlink
+        self._excl = list(excl) if excl else []
+        self._sk_priv = None
+        self._locator = ProjectLocator()
+        self.hash_cache = HashCache()
+        self.store = None
+        if u_path:
+            from dvcz.store import Store
+            # the store's name is nominal; what matters is u_path
+            self.store = Store.discover('U', u_path, hashtype=hashtype)
+
+    @property
+    def sk_priv(self):
+        """ Return the committer's RSA key, reading it when first used. """
+        if self._sk_priv is None:
+            from buildlist import read_rsa_key
+            self._sk_priv = read_rsa_key(self._key_path)
+        return self._sk_priv
+
+    def _exclusions(self, proj_path):
+        """ Return the exclusions for the project. """
+        excl = []
+        if os.path.exists(os.path.join(proj_path, IGNORE_FILE)):
+            from xlutil import get_exclusions
+            excl = list(get_exclusions(proj_path))
+        for name in ['build'] + self._excl:
+            if name not in excl:
+                excl.append(name)
+        return excl
+
+    def commit(self, proj_path):
+        """
+        Commit the project containing proj_path, returning its
+        ProjectResult.  Raise DvczError if the project cannot be found
+        or has no .dvcz/version.
+        """
+        start = time.perf_counter()
+        info = self._locator.locate(proj_path)
+        dvcz_path = os.path.join(info.path, '.dvcz')
+        version_path = os.path.join(dvcz_path, 'version')
+        if not os.path.exists(version_path):
+            raise DvczError("%s does not exist" % version_path)
+        with open(version_path, 'r') as file:
+            # the first line is the version number, the second its date
+            proj_version = file.read().split('\n')[0].strip().lstrip('v')
+        # N.N.N.B, where B counts earlier builds of N.N.N
+        build_version = '%s.%d' % (
+            '.'.join(proj_version.split('.')[:3]),
+            next_build_number(os.path.join(dvcz_path, 'builds'),
+                              proj_version, self._hashtype))
+
+        cache = _SharedStatCache(
+            StatCache(dvcz_path, self._hashtype).load(), self.hash_cache)
+        summary = CommitSummary()
+        blist = list_gen(info.name, info.path, dvcz_path, LIST_FILE,
+                         self._key_path, self._exclusions(info.path), True,
+                         self.store, self._committer_id, self._hashtype,
+                         build_version, cache, self._jobs, self._zero_copy,
+                         self._hardlink, summary, self.sk_priv)
+
+        if self.store is not None:
+            # files deduplicated against the store are not staged
+            unmatched = files_not_found(blist.__str__(), self.store,
+                                        self._committer_id)
+            if unmatched:
+                raise DvczError("%d files not in %s after commit" % (
+                    len(unmatched), self.store.u_path))
+
+        hashed = cache.lookups - cache.hits - cache.shared_hits
+        return ProjectResult(
+            info.name, info.path, build_version, cache.lookups, cache.hits,
+            cache.shared_hits, hashed, len(summary.methods),
+            summary.deduped, summary.bytes_staged,
+            time.perf_counter() - start, '')
+
+    def commit_all(self, proj_paths, summary=None):
+        """
+        Commit each project in turn, returning a WorkspaceSummary.  A
+        project which cannot be committed is recorded as failed and
+        the rest are committed anyway.
+        """
+        if summary is None:
+            summary = WorkspaceSummary()
+        began = time.perf_counter()
+        for proj_path in proj_paths:
+            try:
+                summary.add(self.commit(proj_path))
+            except (DvczError, OSError) as exc:
+                name = os.path.basename(os.path.abspath(proj_path))
+                summary.add(ProjectResult(name, proj_path, '', 0, 0, 0, 0,
+                                          0, 0, 0, 0.0, str(exc)))
+        summary.total_secs = time.perf_counter() - began
+        return summary
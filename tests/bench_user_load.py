@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# dvcz/bench_user_load.py
+
+"""
+Microbenchmark: time loading serialized Committers with and without the
+parse cache.
+
+A cold load splits the text, finds the PEM-formatted keys, and imports
+them; a warm load copies the object already parsed, sharing its keys.
+Run from the top-level directory with
+
+    PYTHONPATH=src python3 tests/bench_user_load.py [-n COUNT] [-r REPS]
+"""
+
+from argparse import ArgumentParser
+import time
+
+from dvcz.user import PARSE_CACHE, Committer
+
+
+def load(sers, reps, cold):
+    """
+    Parse each serialization reps times, importing the signing key,
+    and return the mean time per load in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(reps):
+        for ser in sers:
+            if cold:
+                PARSE_CACHE.invalidate(ser)
+            Committer.create_from_string(ser).sk_priv.size()
+    return (time.perf_counter() - start) * 1e6 / (reps * len(sers))
+
+
+def main():
+    """ Generate some Committers, then time loading them. """
+
+    parser = ArgumentParser(description='time loading Committers')
+    parser.add_argument('-k', '--key_bits', type=int, default=2048,
+                        help='number of RSA key bits')
+    parser.add_argument('-n', '--count', type=int, default=8,
+                        help='number of distinct Committers')
+    parser.add_argument('-r', '--reps', type=int, default=50,
+                        help='number of times each is loaded')
+    args = parser.parse_args()
+
+    sers = []
+    for ndx in range(args.count):
+        committer = Committer('handle%d' % ndx, 'login%d' % ndx,
+                              key_bits=args.key_bits)
+        sers.append(committer.__str__())
+    PARSE_CACHE.invalidate()
+
+    cold = load(sers, args.reps, True)
+    warm = load(sers, args.reps, False)
+    print("%d-bit keys, %d Committers x %d loads" % (
+        args.key_bits, args.count, args.reps))
+    print("  uncached: %10.1f us/load" % cold)
+    print("  cached:   %10.1f us/load" % warm)
+    print("  speedup:  %10.1fx" % (cold / warm if warm else float('inf')))
+
+
+if __name__ == '__main__':
+    main()
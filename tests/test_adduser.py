@@ -4,10 +4,15 @@
 """ Test the do_add_user() function invoked by dvc_adduser. """
 
 # from argparse import Namespace
-# import os
+import os
+import stat
+import time
 import unittest
-#
-# from dvcz import DvczError
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.key_pool import KeyPool
+from dvcz.user import add_users, read_manifest
 # from dvcz.project import get_proj_info
 
 
@@ -15,7 +20,11 @@ class TestAddUser(unittest.TestCase):
     """ Test the do_add_user() function invoked by dvc_adduser. """
 
     def setUp(self):
-        pass
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
 
     def tearDown(self):
         pass
@@ -24,6 +33,49 @@ class TestAddUser(unittest.TestCase):
         """ STUB """
         pass
 
+    def test_read_manifest(self):
+        """ Verify that comments and blank lines are skipped. """
+        path = os.path.join(self.run_dir, 'manifest')
+        with open(path, 'w') as file:
+            file.write('# new committers\nfred\n\n  grinch  \n')
+        self.assertEqual(read_manifest(path), ['fred', 'grinch'])
+        for bad in ['fred\nfred\n', 'a-b\n']:
+            with open(path, 'w') as file:
+                file.write(bad)
+            self.assertRaises(DvczError, read_manifest, path)
+
+    def test_add_users(self):
+        """
+        Verify that a batch of users is provisioned, using keys from
+        the pool first, and that adding them again changes nothing.
+        """
+        users_path = os.path.join(self.run_dir, 'users')
+        u_path = os.path.join(self.run_dir, 'U')
+        pool = KeyPool(os.path.join(self.run_dir, 'keyPool'), 1024)
+        pool.fill(2)
+        logins = ['user%d' % _ for _ in range(6)]
+
+        report = add_users(logins, users_path, u_path, 1024, jobs=3,
+                           key_pool=pool)
+        self.assertEqual(pool.depth(), 0)
+        self.assertEqual([_[0] for _ in report], logins)
+        self.assertTrue(all(_[2] for _ in report))
+        ids = [_[1] for _ in report]
+        self.assertEqual(len(set(ids)), len(ids))
+        for login, committer_id, _ in report:
+            key_path = os.path.join(users_path, login, 'node', 'skPriv.pem')
+            self.assertEqual(stat.S_IMODE(os.stat(key_path).st_mode), 0o400)
+            with open(os.path.join(users_path, login, 'id'), 'r') as file:
+                self.assertEqual(file.read(), committer_id)
+            self.assertTrue(os.path.isdir(
+                os.path.join(u_path, 'in', committer_id)))
+
+        again = add_users(logins + ['user6'], users_path, u_path, 1024)
+        self.assertEqual(again[:6], [(_[0], _[1], False) for _ in report])
+        self.assertTrue(again[6][2])
+
+        self.assertRaises(DvczError, add_users, ['fred', 'fred'], users_path)
+
 
 if __name__ == '__main__':
     unittest.main()
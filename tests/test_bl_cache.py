@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# dvcz/test_bl_cache.py
+
+""" Test the cache of parsed BuildLists. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from buildlist import generate_rsa_key
+from rnglib import SimpleRNG
+from dvcz.bl_cache import BuildListCache
+from dvcz.commit import list_gen
+from xlattice import HashTypes
+from xlu import DirStruc, UDir
+
+
+class TestBuildListCache(unittest.TestCase):
+    """ Test the cache of parsed BuildLists. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.proj_path = os.path.join(self.run_dir, 'proj')
+        self.dvcz_path = os.path.join(self.proj_path, '.dvcz')
+        os.makedirs(self.dvcz_path, mode=0o755)
+        self.cache_path = os.path.join(self.run_dir, 'cache')
+        self.u_dir = UDir.discover(os.path.join(self.run_dir, 'U'),
+                                   DirStruc.DIR_FLAT, HashTypes.SHA2)
+        self.key_path = os.path.join(self.run_dir, 'skPriv.pem')
+        generate_rsa_key(self.key_path, 1024)
+
+    def tearDown(self):
+        pass
+
+    def make_build_lists(self, count):
+        """
+        Put count BuildLists, with different titles, in the store and
+        return their content keys.
+        """
+        keys = []
+        list_file = os.path.join(self.dvcz_path, 'lastBuildList')
+        for ndx in range(count):
+            list_gen('proj%d' % ndx, self.proj_path, self.dvcz_path,
+                     'lastBuildList', self.key_path, ['.dvcz'])
+            with open(list_file, 'rb') as file:
+                data = file.read()
+            key = hashlib.sha256(data).hexdigest()
+            self.u_dir.put_data(data, key)
+            keys.append(key)
+        return keys
+
+    def test_hits_and_misses(self):
+        """
+        Verify that a BuildList is parsed once and thereafter found in
+        memory or, by a new cache, on disk.
+        """
+        [key] = self.make_build_lists(1)
+        cache = BuildListCache(self.cache_path)
+        self.assertIsNone(cache.get('0' * 64, self.u_dir))
+
+        blist = cache.get(key, self.u_dir)
+        self.assertEqual(blist.title, 'proj0')
+        self.assertEqual(cache.misses, 1)
+        self.assertIs(cache.get(key, self.u_dir), blist)
+        self.assertEqual(cache.mem_hits, 1)
+
+        cache = BuildListCache(self.cache_path)
+        self.assertEqual(cache.get(key, self.u_dir).title, 'proj0')
+        self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+
+        # each hash type has its own cache
+        cache = BuildListCache(self.cache_path, HashTypes.SHA3)
+        self.assertNotEqual(cache.path,
+                            BuildListCache(self.cache_path).path)
+
+        # a damaged pickle is discarded and the BuildList parsed again
+        cache = BuildListCache(self.cache_path)
+        with open(cache._path_for_key(key), 'wb') as file:
+            file.write(b'not a pickle')
+        self.assertEqual(cache.get(key, self.u_dir).title, 'proj0')
+        self.assertEqual((cache.disk_hits, cache.misses), (0, 1))
+        cache = BuildListCache(self.cache_path)
+        cache.get(key, self.u_dir)
+        self.assertEqual(cache.disk_hits, 1)
+
+        # nothing cached is returned once the store has lost the key
+        self.u_dir.delete(key)
+        self.assertIsNone(cache.get(key, self.u_dir))
+        self.assertIsNone(BuildListCache(self.cache_path).get(key,
+                                                              self.u_dir))
+
+    def test_bounds(self):
+        """ Verify that both memory and disk caches are bounded. """
+        keys = self.make_build_lists(8)
+
+        cache = BuildListCache(self.cache_path, max_entries=3)
+        for key in keys:
+            cache.get(key, self.u_dir)
+        self.assertEqual(len(cache), 3)
+        # the most recently used are kept
+        cache.get(keys[-1], self.u_dir)
+        self.assertEqual(cache.mem_hits, 1)
+
+        pickle_size = os.path.getsize(cache._path_for_key(keys[0]))
+        max_bytes = 4 * pickle_size
+        cache = BuildListCache(os.path.join(self.run_dir, 'small'),
+                               max_bytes=max_bytes)
+        for key in keys:
+            cache.get(key, self.u_dir)
+        on_disk = sum(os.path.getsize(cache._path_for_key(_))
+                      for _ in keys
+                      if os.path.exists(cache._path_for_key(_)))
+        self.assertLessEqual(on_disk, max_bytes)
+        self.assertTrue(os.path.exists(cache._path_for_key(keys[-1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
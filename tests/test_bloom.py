@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# dvcz/test_bloom.py
+
+""" Test the BloomFilter over the content keys in a Store. """
+
+import hashlib
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.bloom import BloomFilter
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestBloom(unittest.TestCase):
+    """ Test the BloomFilter over the content keys in a Store. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
+
+    def tearDown(self):
+        pass
+
+    def random_keys(self, count):
+        """ Return count random SHA256 content keys. """
+        return [hashlib.sha256(self.rng.some_bytes(32)).hexdigest()
+                for _ in range(count)]
+
+    def test_filter(self):
+        """
+        Verify that keys added are always found and that the
+        false-positive rate is near that configured.
+        """
+        path = os.path.join(self.run_dir, 'bloom')
+        keys = self.random_keys(1000)
+        bloom = BloomFilter.create(path, keys[:500], capacity=1000,
+                                   fp_rate=0.02)
+        self.assertEqual(bloom.count, 500)
+        bloom.add_many(keys[500:])
+        self.assertEqual(bloom.count, 1000)
+        for key in keys:
+            self.assertTrue(bloom.might_contain(key))
+        self.assertEqual(bloom.misses, 1000)
+
+        # the bits were written through to the file
+        again = BloomFilter(path).open()
+        self.assertEqual(again.count, 1000)
+        for key in keys:
+            self.assertTrue(again.might_contain(key))
+
+        others = self.random_keys(2000)
+        maybe = sum(1 for _ in others if again.might_contain(_))
+        self.assertEqual(again.hits, 2000 - maybe)
+        self.assertLess(maybe, 2000 * 0.02 * 3)
+        self.assertLess(again.expected_fp_rate(), 0.03)
+
+        with self.assertRaises(DvczError):
+            BloomFilter.create(path, keys, fp_rate=1.5)
+        bloom.close()
+        again.close()
+
+    def test_threads(self):
+        """ Verify that no key is lost when threads add at once. """
+        path = os.path.join(self.run_dir, 'bloom')
+        keys = self.random_keys(4000)
+        bloom = BloomFilter.create(path, [], capacity=len(keys))
+        batches = [keys[_:_ + 10] for _ in range(0, len(keys), 10)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(bloom.add_many, batches))
+        self.assertEqual(bloom.count, len(keys))
+        again = BloomFilter(path).open()
+        self.assertTrue(all(again.might_contain(_) for _ in keys))
+        bloom.close()
+        again.close()
+
+    def test_replaced(self):
+        """ Verify that a filter notices it has been rebuilt. """
+        path = os.path.join(self.run_dir, 'bloom')
+        keys = self.random_keys(10)
+        bloom = BloomFilter.create(path, keys[:5])
+        self.assertFalse(bloom.reopen_if_replaced())
+        BloomFilter.create(path, keys[5:]).close()
+        bloom.add(keys[0])              # goes into the new filter
+        again = BloomFilter(path).open()
+        for key in keys[:1] + keys[5:]:
+            self.assertTrue(again.might_contain(key))
+        self.assertEqual(again.count, 6)
+        bloom.close()
+        again.close()
+
+    def test_store(self):
+        """
+        Verify that a Store's filter covers keys put and ingested and
+        rules out keys which are absent.
+        """
+        u_path = os.path.join(self.run_dir, 'U')
+        store = Store('U', u_path, DirStruc.DIR16x16, HashTypes.SHA2)
+        in_store = []
+        for _ in range(8):
+            data = self.rng.some_bytes(64)
+            key = hashlib.sha256(data).hexdigest()
+            store.put_data(data, key)
+            in_store.append(key)
+        (staged, _) = store.ingest_data(self.rng.some_bytes(64), 'abc')
+
+        bloom = store.rebuild_bloom(fp_rate=0.001)
+        self.assertEqual(bloom.count, 9)
+        absent = self.random_keys(20)
+        self.assertEqual(store.has_keys(in_store + absent), absent)
+        self.assertEqual(store.has_keys([staged] + absent, 'abc'), absent)
+        self.assertTrue(store.contains(in_store[0]))
+
+        # later additions go into the filter
+        data = self.rng.some_bytes(64)
+        key = hashlib.sha256(data).hexdigest()
+        store.put_data(data, key)
+        (later, _) = store.ingest_data(self.rng.some_bytes(64), 'abc')
+        reopened = Store('U', u_path, DirStruc.DIR16x16, HashTypes.SHA2)
+        self.assertEqual(reopened.has_keys([key, later] + absent, 'abc'),
+                         absent)
+        self.assertEqual(reopened.bloom_filter().count, 11)
+
+        # a filter rebuilt elsewhere is picked up by contains()
+        data = self.rng.some_bytes(64)
+        key = hashlib.sha256(data).hexdigest()
+        path = reopened.get_path_for_key(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)            # behind the store's back
+        other = Store('U', u_path, DirStruc.DIR16x16, HashTypes.SHA2)
+        other.rebuild_index()
+        other.rebuild_bloom(fp_rate=0.001)
+        self.assertTrue(reopened.contains(key))
+        bloom.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
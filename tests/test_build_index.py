@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# dvcz/test_build_index.py
+
+""" Test the index of .dvcz/builds. """
+
+import hashlib
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.build_index import (INDEX_FILE, MAX_RUNS, BuildIndex,
+                              append_build, pack_version)
+from dvcz.builds import read_builds
+
+
+class TestBuildIndex(unittest.TestCase):
+    """ Test the index of .dvcz/builds. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.dvcz_path = os.path.join(self.run_dir, '.dvcz')
+        os.makedirs(self.dvcz_path, mode=0o755)
+        self.builds_file = os.path.join(self.dvcz_path, 'builds')
+
+    def tearDown(self):
+        pass
+
+    def some_hash(self):
+        """ Return a random 64-character hex value. """
+        return hashlib.sha256(self.rng.some_bytes(32)).hexdigest()
+
+    def append_some(self, count, first_day=1):
+        """
+        Append count builds, a day apart and a few to each version,
+        returning their BuildRecords.
+        """
+        records = []
+        for ndx in range(count):
+            day = first_day + ndx
+            timestamp = '2017-%02d-%02d 12:00:00' % (
+                1 + day // 28, 1 + day % 28)
+            version = '0.%d.%d.%d' % (day // 20, day // 4 % 5, day % 4)
+            records.append(append_build(self.dvcz_path, version,
+                                        self.some_hash(),
+                                        timestamp=timestamp))
+        return records
+
+    def test_pack_version(self):
+        """ Verify that packed versions sort the way versions do. """
+        self.assertEqual(pack_version('v1.2.3'), pack_version('1.2.3.0'))
+        self.assertLess(pack_version('0.9.9.9'), pack_version('0.10.0'))
+        self.assertLess(pack_version('1.2.3'), pack_version('1.2.3.1'))
+        for bad in ['1.2', '1.2.3.4.5', '1.x.3', '1.2.65536']:
+            self.assertRaises(DvczError, pack_version, bad)
+
+    def test_lookups(self):
+        """
+        Verify lookups by version and timestamp against a scan of the
+        log, as builds are appended.
+        """
+        records = self.append_some(100)
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertEqual(len(index), 100)
+            self.assertFalse(index.rebuilt)
+            self.assertEqual(index.latest(), records[-1])
+
+            for record in records[::7]:
+                exact = index.by_version(record.version)
+                self.assertEqual(exact, [record])
+                base = '.'.join(record.version.split('.')[:3])
+                self.assertEqual(
+                    index.by_version(base),
+                    [_ for _ in records
+                     if _.version.startswith(base + '.')])
+                self.assertEqual(index.before(record.timestamp), record)
+            self.assertEqual(index.by_version('9.9.9'), [])
+            self.assertIsNone(index.before('2016-12-31 23:59:59'))
+            self.assertEqual(index.before('2099-01-01 00:00:00'),
+                             records[-1])
+
+    def test_out_of_order(self):
+        """
+        Verify that builds logged out of order are found, and that of
+        builds with the same timestamp the last logged is returned.
+        """
+        later = self.append_some(10, first_day=50)
+        earlier = self.append_some(10, first_day=1)
+        same = append_build(self.dvcz_path, '0.0.0.9', self.some_hash(),
+                            timestamp=earlier[3].timestamp)
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertEqual(len(index), 21)
+            self.assertEqual(index.latest(), same)
+            self.assertEqual(index.before(earlier[3].timestamp), same)
+            self.assertEqual(index.before(earlier[-1].timestamp),
+                             earlier[-1])
+            self.assertEqual(index.before('2099-01-01 00:00:00'), later[-1])
+            self.assertEqual(index.by_version(later[0].version),
+                             [later[0]])
+
+    def test_stale_index(self):
+        """
+        Verify that the index is rebuilt if it is missing or the log no
+        longer matches it, and extended if the log has grown.
+        """
+        records = self.append_some(20)
+        index_file = os.path.join(self.dvcz_path, INDEX_FILE)
+
+        # lines appended without append_build() are picked up
+        with open(self.builds_file, 'a') as file:
+            file.write('not a builds line\n')
+            file.write('2017-06-01 00:00:00 v1.0.0 %s\n' % self.some_hash())
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertFalse(index.rebuilt)
+            self.assertEqual(len(index), 21)
+            self.assertEqual(index.latest().version, '1.0.0')
+
+        # a missing index is rebuilt
+        os.remove(index_file)
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertTrue(index.rebuilt)
+            self.assertEqual(len(index), 21)
+
+        # as is one for a log which has been rewritten
+        with open(self.builds_file, 'r') as file:
+            lines = file.readlines()
+        with open(self.builds_file, 'w') as file:
+            file.writelines(lines[:10])
+            file.write('2017-06-02 00:00:00 v2.0.0 %s\n' % self.some_hash())
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertTrue(index.rebuilt)
+            self.assertEqual(len(index), 11)
+            self.assertEqual(index.by_version('0.0.1'), records[3:7])
+            self.assertEqual(index.latest(),
+                             list(read_builds(self.builds_file))[-1])
+
+        # and one which is corrupt
+        with open(index_file, 'r+b') as file:
+            file.write(b'JUNK')
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertTrue(index.rebuilt)
+            self.assertEqual(len(index), 11)
+
+    def test_runs(self):
+        """
+        Verify that appended builds are added to the index file in place
+        as new runs, and that the runs are merged into a new file once
+        there would be more than MAX_RUNS.
+        """
+        index_file = os.path.join(self.dvcz_path, INDEX_FILE)
+        records = self.append_some(1)
+        inode = os.stat(index_file).st_ino
+        records += self.append_some(MAX_RUNS - 1, first_day=2)
+        self.assertEqual(os.stat(index_file).st_ino, inode)
+
+        # whatever a failed append left at the end is ignored
+        with open(index_file, 'ab') as file:
+            file.write(b'partial run')
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertFalse(index.rebuilt)
+            self.assertEqual(len(index), MAX_RUNS)
+            self.assertEqual(index.latest(), records[-1])
+        size = os.stat(index_file).st_size
+        records += self.append_some(1, first_day=MAX_RUNS + 1)
+        self.assertNotEqual(os.stat(index_file).st_ino, inode)
+        self.assertLess(os.stat(index_file).st_size, size + 32)
+
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertFalse(index.rebuilt)
+            self.assertEqual(len(index), MAX_RUNS + 1)
+            for record in records:
+                self.assertEqual(index.by_version(record.version), [record])
+                self.assertEqual(index.before(record.timestamp), record)
+
+    def test_concurrent_appends(self):
+        """
+        Verify that builds appended at the same time by several threads
+        are all indexed, each once.
+        """
+        count = 4 * MAX_RUNS
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            records = list(executor.map(
+                lambda day: self.append_some(1, first_day=day)[0],
+                range(1, count + 1)))
+        with BuildIndex(self.dvcz_path) as index:
+            self.assertFalse(index.rebuilt)
+            self.assertEqual(len(index), count)
+            for record in records:
+                self.assertEqual(index.by_version(record.version), [record])
+
+
+if __name__ == '__main__':
+    unittest.main()
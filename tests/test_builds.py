@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# dvcz/test_builds.py
+
+""" Test check_builds() and related functions. """
+
+import contextlib
+import hashlib
+import io
+import os
+import time
+import unittest
+from unittest import mock
+
+from buildlist import generate_rsa_key
+from Crypto.PublicKey import RSA
+from rnglib import SimpleRNG
+from dvcz import builds
+from dvcz.builds import (CHECKPOINT_FILE, BuildRecord, CheckSummary,
+                         check_builds, listed_files, next_build_number,
+                         read_builds)
+from dvcz.commit import list_gen
+from dvcz.pack import repack
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc, UDir
+
+
+class TestBuilds(unittest.TestCase):
+    """ Test check_builds() and related functions. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.proj_path = os.path.join(self.run_dir, 'proj')
+        self.dvcz_path = os.path.join(self.proj_path, '.dvcz')
+        os.makedirs(self.dvcz_path, mode=0o755)
+        self.u_path = os.path.join(self.run_dir, 'U')
+        UDir.discover(self.u_path, DirStruc.DIR_FLAT, HashTypes.SHA2)
+
+    def tearDown(self):
+        pass
+
+    def write_builds(self, count):
+        """
+        Write a builds file with count lines, none of which refers to a
+        BuildList in the store, and a few of which are malformed.
+        """
+        lines = []
+        for ndx in range(count):
+            if ndx % 10 == 3:
+                lines.append('not a builds line %d' % ndx)
+                continue
+            key = hashlib.sha256(self.rng.some_bytes(32)).hexdigest()
+            lines.append('2017-03-%02d 12:%02d:%02d v0.1.%d %s' % (
+                1 + ndx % 28, ndx % 60, ndx % 60, ndx, key))
+        with open(os.path.join(self.dvcz_path, 'builds'), 'w') as file:
+            for line in lines:
+                file.write(line + '\n')
+        return lines
+
+    def commit_builds(self, count):
+        """
+        Commit an empty project count times, logging each build and
+        putting its BuildList in the store.
+        """
+        src_path = os.path.join(self.proj_path, 'src')
+        os.makedirs(src_path, mode=0o755, exist_ok=True)
+        key_path = os.path.join(self.run_dir, 'skPriv.pem')
+        if not os.path.exists(key_path):
+            generate_rsa_key(key_path, 1024)
+        u_dir = UDir.discover(self.u_path)
+        list_file = os.path.join(self.dvcz_path, 'lastBuildList')
+        for ndx in range(count):
+            list_gen('src', src_path, self.dvcz_path, 'lastBuildList',
+                     key_path, [], True, version='0.1.%d' % ndx)
+            with open(list_file, 'rb') as file:
+                data = file.read()
+            u_dir.put_data(data, hashlib.sha256(data).hexdigest())
+
+    def run_check(self, workers=1, full=False, verify_sigs=True):
+        """ Run check_builds(), returning what it prints. """
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.problems = check_builds(self.proj_path, self.u_path,
+                                         workers=workers, full=full,
+                                         verify_sigs=verify_sigs)
+        return out.getvalue()
+
+    def checkpoint_offset(self):
+        """ Return the offset recorded in the checkpoint file. """
+        with open(os.path.join(self.dvcz_path, CHECKPOINT_FILE), 'r') as file:
+            return int(file.read().split(' ')[0])
+
+    def test_workers_deterministic(self):
+        """
+        Verify that checking lines in parallel reports the same
+        problems in the same order as checking them serially.
+        """
+        lines = self.write_builds(100)
+        serial = self.run_check(1)
+        self.assertEqual(serial.count('CANNOT PARSE LINE'), 10)
+        self.assertEqual(serial.count('CANNOT FIND BUILD LIST'), 90)
+
+        # problems are reported in builds file order
+        reported = [_ for _ in serial.split('\n') if _.startswith('  ')]
+        self.assertEqual([_.strip() for _ in reported],
+                         [_ for _ in lines if _.startswith('not')])
+        for workers in [2, 4]:
+            self.assertEqual(self.run_check(workers), serial)
+
+    def test_summary(self):
+        """
+        Verify that signatures are counted the same way whatever the
+        number of workers, and not at all if not being verified.
+        """
+        self.commit_builds(3)
+        with open(os.path.join(self.dvcz_path, 'builds'), 'a') as file:
+            file.write('not a builds line\n')
+        for workers in [1, 2]:
+            summary = CheckSummary()
+            with contextlib.redirect_stdout(io.StringIO()):
+                bad_lines = check_builds(self.proj_path, self.u_path,
+                                         workers=workers, full=True,
+                                         summary=summary)
+            self.assertEqual(bad_lines, 1)
+            self.assertEqual(summary.lines, 4)
+            self.assertEqual((summary.verified, summary.failed), (3, 0))
+            self.assertGreater(summary.total_secs, 0.0)
+
+        summary = CheckSummary()
+        with contextlib.redirect_stdout(io.StringIO()):
+            check_builds(self.proj_path, self.u_path, full=True,
+                         verify_sigs=False, summary=summary)
+        self.assertEqual((summary.verified, summary.failed), (0, 0))
+        self.assertIn('0 verified, 0 failed', str(summary))
+
+    def test_committer_key(self):
+        """
+        Verify that a committer's public key is imported only once,
+        however many BuildLists it heads.
+        """
+        # pylint: disable=protected-access
+        pem = RSA.generate(1024).publickey().exportKey('PEM')
+        builds._WORKER_PUB_KEYS.clear()
+        with mock.patch.object(RSA, 'importKey',
+                               wraps=RSA.importKey) as import_key:
+            key = builds._committer_key(pem + b'\ntitle 1\n', HashTypes.SHA2)
+            self.assertIsNotNone(key)
+            self.assertIs(builds._committer_key(pem + b'\ntitle 2\n',
+                                                HashTypes.SHA2), key)
+            self.assertEqual(import_key.call_count, 1)
+        self.assertIsNone(builds._committer_key(b'no key here',
+                                                HashTypes.SHA2))
+
+    def test_cache_integrity(self):
+        """
+        Verify that a BuildList cached when checked is reported if it is
+        later deleted from or damaged in the store.
+        """
+        self.commit_builds(1)
+        data = b'a new file makes a new BuildList'
+        with open(os.path.join(self.proj_path, 'src', 'new'), 'wb') as file:
+            file.write(data)
+        UDir.discover(self.u_path).put_data(data,
+                                            hashlib.sha256(data).hexdigest())
+        self.commit_builds(1)
+        cache_path = os.path.join(self.run_dir, 'cache')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(check_builds(self.proj_path, self.u_path,
+                                          bl_cache_path=cache_path), 0)
+        with open(os.path.join(self.dvcz_path, 'builds'), 'r') as file:
+            keys = [_.split()[-1] for _ in file]
+
+        with open(os.path.join(self.u_path, keys[0]), 'ab') as file:
+            file.write(b'damage')
+        os.remove(os.path.join(self.u_path, keys[1]))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            problems = check_builds(self.proj_path, self.u_path, full=True,
+                                    bl_cache_path=cache_path)
+        self.assertEqual(problems, 2)
+        self.assertIn('DOES NOT MATCH ITS KEY', out.getvalue())
+        self.assertIn('CANNOT FIND BUILD LIST', out.getvalue())
+
+    def test_staged(self):
+        """
+        Verify that a commit whose BuildList and files are still in the
+        committer's staging area passes the check, and that a file lost
+        from the staging area is reported.
+        """
+        src_path = os.path.join(self.proj_path, 'src')
+        os.makedirs(os.path.join(src_path, 'sub'), mode=0o755)
+        for name in ['a', os.path.join('sub', 'b')]:
+            with open(os.path.join(src_path, name), 'wb') as file:
+                file.write(self.rng.some_bytes(100))
+        key_path = os.path.join(self.run_dir, 'skPriv.pem')
+        generate_rsa_key(key_path, 1024)
+        store = Store.discover('U', self.u_path)
+        committer_id = self.rng.some_bytes(32).hex()
+        blist = list_gen('src', src_path, self.dvcz_path, 'lastBuildList',
+                         key_path, [], True, store, committer_id)
+        listed = list(listed_files(blist.__str__()))
+        self.assertEqual([_[0] for _ in listed], ['a', 'sub/b'])
+        self.assertEqual(self.run_check(), '')
+        self.assertEqual(self.problems, 0)
+
+        os.remove(os.path.join(self.u_path, 'in', committer_id,
+                               listed[1][1]))
+        out = self.run_check(full=True)
+        self.assertEqual(self.problems, 1)
+        self.assertIn('SOME BUILD LIST FILES NOT FOUND', out)
+        self.assertIn('  sub/b %s' % listed[1][1], out)
+
+    def test_packed(self):
+        """
+        Verify that BuildLists and files moved into packs by a repack
+        are still found, and that a packed file deleted is reported.
+        """
+        store = Store.discover('U', self.u_path)
+        src_path = os.path.join(self.proj_path, 'src')
+        os.makedirs(src_path, mode=0o755)
+        for name in ['a', 'b']:
+            data = self.rng.some_bytes(100)
+            with open(os.path.join(src_path, name), 'wb') as file:
+                file.write(data)
+            store.put_data(data, hashlib.sha256(data).hexdigest())
+        self.commit_builds(2)
+        self.assertEqual(self.run_check(), '')
+
+        summary = repack(store)
+        self.assertEqual(summary.loose, 3)      # the builds share a BuildList
+        self.assertEqual([_ for _ in os.listdir(self.u_path)
+                          if len(_) == 64], [])
+        self.assertEqual(self.run_check(full=True), '')
+        self.assertEqual(self.problems, 0)
+
+        record = next(read_builds(os.path.join(self.dvcz_path, 'builds')))
+        listed = list(listed_files(store.get_data(record.hash)))
+        self.assertTrue(store.delete(listed[0][1]))
+        out = self.run_check(full=True)
+        self.assertEqual(self.problems, 2)
+        self.assertIn('  a %s' % listed[0][1], out)
+
+    def test_read_builds(self):
+        """
+        Verify that the reader yields a record for each well-formed,
+        complete line, and that build numbers are counted per version.
+        """
+        builds_file = os.path.join(self.dvcz_path, 'builds')
+        self.assertEqual(next_build_number(builds_file, '0.1.2'), 0)
+        keys = [hashlib.sha256(self.rng.some_bytes(32)).hexdigest()
+                for _ in range(4)]
+        with open(builds_file, 'w') as file:
+            file.write('2017-03-01 12:00:00 v0.1.2 %s\n' % keys[0])
+            file.write('not a builds line\n')
+            file.write('2017-03-02 12:00:00 v0.1.2.3 %s\n' % keys[1])
+            file.write('2017-03-03 12:00:00 v0.1.3.0 %s\n' % keys[2])
+            # a line still being written is ignored
+            file.write('2017-03-04 12:00:00 v0.1.3.1 %s' % keys[3])
+        records = list(read_builds(builds_file))
+        self.assertEqual(records, [
+            BuildRecord('2017-03-01 12:00:00', '0.1.2', keys[0]),
+            BuildRecord('2017-03-02 12:00:00', '0.1.2.3', keys[1]),
+            BuildRecord('2017-03-03 12:00:00', '0.1.3.0', keys[2]), ])
+        self.assertEqual(list(read_builds(builds_file, HashTypes.SHA1)), [])
+
+        self.assertEqual(next_build_number(builds_file, '0.1.2'), 4)
+        self.assertEqual(next_build_number(builds_file, 'v0.1.3'), 1)
+        self.assertEqual(next_build_number(builds_file, '0.1.3.7'), 1)
+        self.assertEqual(next_build_number(builds_file, '0.2.0'), 0)
+
+    def test_checkpoint(self):
+        """
+        Verify that only lines appended since the last check are
+        checked, unless the log has been tampered with or a full check
+        is requested.
+        """
+        builds_file = os.path.join(self.dvcz_path, 'builds')
+        self.commit_builds(3)
+        self.assertEqual(self.run_check(), '')
+        self.assertEqual(self.problems, 0)
+        good_len = os.path.getsize(builds_file)
+        self.assertEqual(self.checkpoint_offset(), good_len)
+
+        # a bad line stops the checkpoint and is reported on every run
+        with open(builds_file, 'a') as file:
+            file.write('not a builds line\n')
+        for _ in range(2):
+            self.assertIn('CANNOT PARSE LINE', self.run_check())
+            self.assertEqual(self.problems, 1)
+            self.assertEqual(self.checkpoint_offset(), good_len)
+
+        # informational output is not a problem
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.problems = check_builds(self.proj_path, self.u_path,
+                                         verbose=True, full=True)
+        self.assertIn('my_hash:', out.getvalue())
+        self.assertEqual(self.problems, 1)
+        self.assertEqual(self.checkpoint_offset(), good_len)
+
+        # once only good lines follow the checkpoint, it advances, but
+        # not over lines whose signatures were not checked
+        with open(builds_file, 'rb') as file:
+            data = file.read()
+        with open(builds_file, 'wb') as file:
+            file.write(data[:good_len])
+        self.commit_builds(2)
+        for full in [False, True]:
+            self.run_check(full=full, verify_sigs=False)
+            self.assertEqual(self.problems, 0)
+            self.assertEqual(self.checkpoint_offset(), good_len)
+        self.run_check()
+        self.assertEqual(self.problems, 0)
+        self.assertEqual(self.checkpoint_offset(),
+                         os.path.getsize(builds_file))
+
+        # tampering with the verified prefix forces a full check
+        with open(builds_file, 'rb') as file:
+            data = file.read()
+        with open(builds_file, 'wb') as file:
+            file.write(b'not a builds line\n' + data)
+        out = self.run_check()
+        self.assertIn('WARNING', out)
+        self.assertEqual(self.problems, 1)
+        self.assertEqual(self.checkpoint_offset(), 0)
+
+        # as does truncating it
+        with open(builds_file, 'wb') as file:
+            file.write(data[:good_len])
+        self.run_check()
+        self.assertEqual(self.problems, 0)
+        self.assertEqual(self.checkpoint_offset(), good_len)
+        with open(builds_file, 'wb') as file:
+            file.write(data[:good_len // 2])
+        self.assertIn('WARNING', self.run_check())
+
+        # --full checks everything even when nothing is new
+        with open(builds_file, 'wb') as file:
+            file.write(data)
+        self.run_check()
+        self.assertEqual(self.problems, 0)
+        key = data.split(b' ')[-1].strip()
+        os.remove(os.path.join(self.u_path, key.decode('utf-8')))
+        self.assertEqual(self.run_check(), '')
+        self.assertIn('CANNOT FIND BUILD LIST', self.run_check(full=True))
+        # identical builds in the same second share a BuildList
+        self.assertEqual(self.problems, data.count(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# dvcz/test_commit.py
+
+""" Test the functions used by dvc_commit to build a BuildList. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz.commit import (CommitSummary, hash_entries, make_tree_lines,
+                         stage_entries, walk_proj)
+from dvcz.hashing import hash_file
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestCommit(unittest.TestCase):
+    """ Test the functions used by dvc_commit to build a BuildList. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.proj_path = os.path.join(self.run_dir, 'proj')
+
+        # a project with a few hundred small files and one large one
+        for ndx in range(4):
+            sub_dir = os.path.join(self.proj_path, 'sub%d' % ndx)
+            os.makedirs(sub_dir, mode=0o755)
+            for count in range(64):
+                path = os.path.join(sub_dir, 'file%d' % count)
+                with open(path, 'wb') as file:
+                    file.write(self.rng.some_bytes(
+                        1 + self.rng.next_int16(2048)))
+        with open(os.path.join(self.proj_path, 'big'), 'wb') as file:
+            file.write(self.rng.some_bytes(5 * 1024 * 1024))
+        os.makedirs(os.path.join(self.proj_path, 'build'), mode=0o755)
+        with open(os.path.join(self.proj_path, 'build', 'junk'), 'w') as file:
+            file.write('excluded')
+
+    def tearDown(self):
+        pass
+
+    def test_walk(self):
+        """ Verify that the walk is sorted and honors exclusions. """
+        entries = list(walk_proj(self.proj_path, ['build']))
+        names = [_[2] for _ in entries if _[0] == 1]
+        self.assertEqual(names, sorted(names))
+        self.assertNotIn('build', names)
+        self.assertIn('big', names)
+        self.assertEqual(len([_ for _ in entries if _[3] is not None]),
+                         4 * 64 + 1)
+
+    def test_sidecars(self):
+        """
+        Verify that dvcz's working files in .dvcz/ are skipped, but not
+        project files which happen to have the same names.
+        """
+        dvcz_path = os.path.join(self.proj_path, '.dvcz')
+        os.makedirs(os.path.join(dvcz_path, 'statCache'), mode=0o755)
+        for rel_path in [os.path.join('.dvcz', 'builds'),
+                         os.path.join('.dvcz', 'buildsIndex'),
+                         os.path.join('sub0', 'buildsIndex')]:
+            with open(os.path.join(self.proj_path, rel_path), 'w') as file:
+                file.write('data')
+        os.makedirs(os.path.join(self.proj_path, 'sub1', 'statCache'),
+                    mode=0o755)
+        rel_paths = [_[2] for _ in walk_proj(self.proj_path, ['build'])]
+        self.assertIn(os.path.join('.dvcz', 'builds'), rel_paths)
+        self.assertIn(os.path.join('sub0', 'buildsIndex'), rel_paths)
+        self.assertIn(os.path.join('sub1', 'statCache'), rel_paths)
+        self.assertNotIn(os.path.join('.dvcz', 'buildsIndex'), rel_paths)
+        self.assertNotIn(os.path.join('.dvcz', 'statCache'), rel_paths)
+
+    def test_parallel_matches_serial(self):
+        """ Verify that hashing in parallel changes nothing. """
+        entries = list(walk_proj(self.proj_path, ['build']))
+        for hashtype in HashTypes:
+            serial = hash_entries(self.proj_path, entries, hashtype)
+            parallel = hash_entries(self.proj_path, entries, hashtype,
+                                    jobs=8)
+            self.assertEqual(serial, parallel)
+            self.assertEqual(
+                serial['big'],
+                hash_file(os.path.join(self.proj_path, 'big'), hashtype))
+            self.assertEqual(
+                make_tree_lines('proj', entries, serial),
+                make_tree_lines('proj', entries, parallel))
+
+    def test_stage_dedup(self):
+        """
+        Verify that content already in the store is not staged, even
+        when its key is not cached, and that other content is staged
+        once per key.
+        """
+        store = Store('U', os.path.join(self.run_dir, 'U'),
+                      DirStruc.DIR256x256, HashTypes.SHA2)
+        committer_id = '0123456789abcdef' * 4
+        stored = os.path.join('sub0', 'file0')
+        with open(os.path.join(self.proj_path, stored), 'rb') as file:
+            data = file.read()
+        store.put_data(data, hash_file(os.path.join(self.proj_path, stored),
+                                       HashTypes.SHA2))
+        with open(os.path.join(self.proj_path, 'sub1', 'copy'), 'wb') as file:
+            file.write(data)
+        with open(os.path.join(self.proj_path, 'sub2', 'file0'), 'rb') as file:
+            twice = file.read()
+        with open(os.path.join(self.proj_path, 'sub3', 'again'), 'wb') as file:
+            file.write(twice)
+        entries = list(walk_proj(self.proj_path, ['build']))
+        files = len([_ for _ in entries if _[3] is not None])
+
+        summary = CommitSummary()
+        hashes = stage_entries(store, committer_id, self.proj_path, entries,
+                               jobs=4, summary=summary)
+        self.assertEqual(summary.deduped, 3)
+        self.assertEqual(len(summary.methods), files - 3)
+        self.assertNotIn(stored, summary.methods)
+        in_path = os.path.join(self.run_dir, 'U', 'in', committer_id)
+        self.assertNotIn(hashes[stored], os.listdir(in_path))
+        self.assertEqual(store.has_keys(hashes.values(), committer_id), [])
+
+        # committing again stages nothing
+        summary = CommitSummary()
+        self.assertEqual(stage_entries(store, committer_id, self.proj_path,
+                                       entries, summary=summary), hashes)
+        self.assertEqual((summary.deduped, summary.methods), (files, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
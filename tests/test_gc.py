@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# dvcz/test_gc.py
+
+""" Test garbage collection in a content-keyed Store. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.commit import stage_entries, walk_proj
+from dvcz.gc import GarbageCollector, GCSummary
+from dvcz.pack import repack
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestGC(unittest.TestCase):
+    """ Test garbage collection in a content-keyed Store. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
+        self.store = Store('U', os.path.join(self.run_dir, 'U'),
+                           DirStruc.DIR256x256, HashTypes.SHA2)
+
+    def tearDown(self):
+        pass
+
+    def put(self, data=None, old=True):
+        """
+        Put data, by default random, into the store, backdating it
+        unless old is False.  Return its key.
+        """
+        if data is None:
+            data = self.rng.some_bytes(1 + self.rng.next_int16(512))
+        key = hashlib.sha256(data).hexdigest()
+        self.store.put_data(data, key)
+        if old:
+            then = time.time() - 30 * 24 * 3600
+            os.utime(self.store.get_path_for_key(key), (then, then))
+        return key
+
+    def make_project(self, name, keys, in_store=True):
+        """
+        Create a project whose builds log one BuildList listing the
+        keys.  Return the project path and the BuildList's key.
+        """
+        text = "%s\n2017-01-01 00:00:00\n" % name + ''.join(
+            " file%d %s\n" % (ndx, key) for ndx, key in enumerate(keys))
+        data = text.encode('utf-8')
+        if in_store:
+            bl_key = self.put(data)
+        else:
+            bl_key = hashlib.sha256(data).hexdigest()
+        proj_path = os.path.join(self.run_dir, name)
+        os.makedirs(os.path.join(proj_path, '.dvcz'))
+        with open(os.path.join(proj_path, '.dvcz', 'builds'), 'w') as file:
+            file.write("2017-01-01 00:00:00 v0.1.0 %s\n" % bl_key)
+        return (proj_path, bl_key)
+
+    def test_collect(self):
+        """
+        Verify that only unreferenced objects older than the grace
+        period are deleted, and that a dry run deletes nothing.
+        """
+        live = [self.put() for _ in range(4)]
+        garbage = [self.put() for _ in range(3)]
+        young = self.put(old=False)
+        (staged, _) = self.store.ingest_data(self.rng.some_bytes(99), 'abc')
+        also_staged = self.put(self.store.in_dir_for('abc').get_data(staged))
+        (proj_a, bl_a) = self.make_project('proj_a', live[:2])
+        (proj_b, bl_b) = self.make_project('proj_b', live[1:])
+        reclaimable = sum(
+            os.stat(self.store.get_path_for_key(_)).st_size for _ in garbage)
+
+        collector = GarbageCollector(self.store, jobs=2)
+        summary = collector.collect([proj_a, proj_b], dry_run=True)
+        self.assertEqual(summary.projects, 2)
+        self.assertEqual(summary.build_lists, 2)
+        self.assertEqual(summary.marked, len(live) + 3)
+        self.assertEqual(summary.swept, len(garbage))
+        self.assertEqual(summary.bytes_swept, reclaimable)
+        self.assertEqual(summary.young, 1)
+        for key in garbage:
+            self.assertTrue(self.store.exists(key))
+
+        # continue from the dry run's mark
+        summary = collector.collect([], resume=True)
+        self.assertTrue(summary.resumed)
+        self.assertEqual(summary.swept, len(garbage))
+        self.assertEqual(self.store.has_keys(
+            live + garbage + [young, also_staged, bl_a, bl_b]), garbage)
+        self.assertEqual(os.listdir(collector.path), [])
+        self.assertFalse(self.store.contains(garbage[0]))
+
+    def test_missing(self):
+        """ Verify that a missing BuildList stops the collection. """
+        garbage = self.put()
+        (proj, _) = self.make_project('proj', [self.put()], in_store=False)
+        collector = GarbageCollector(self.store, jobs=1)
+        with self.assertRaises(DvczError):
+            collector.collect([proj])
+        self.assertTrue(self.store.exists(garbage))
+        with self.assertRaises(DvczError):
+            collector.collect([])
+
+        summary = collector.collect([proj], force=True)
+        self.assertEqual(len(summary.missing), 1)
+        self.assertFalse(os.path.exists(
+            self.store.get_path_for_key(garbage)))
+
+    def test_concurrent_commit(self):
+        """
+        Verify that old objects which a commit finds already stored
+        while a collection runs, loose or packed, are not swept.
+        """
+        packed = self.put(self.rng.some_bytes(100))
+        repack(self.store)
+        then = time.time() - 30 * 24 * 3600
+        for pack in self.store.packs.packs:
+            os.utime(pack.dat_path, (then, then))
+        datas = [self.rng.some_bytes(100) for _ in range(2)]
+        keys = [self.put(_) for _ in datas]
+        (proj, _) = self.make_project('proj', [])
+        collector = GarbageCollector(self.store, jobs=1)
+        collector.mark([proj], GCSummary())
+
+        # a commit of the same content, logged after the mark
+        src_path = os.path.join(self.run_dir, 'src')
+        os.makedirs(src_path)
+        for ndx, data in enumerate(
+                datas[:1] + [self.store.get_data(packed)]):
+            with open(os.path.join(src_path, 'f%d' % ndx), 'wb') as file:
+                file.write(data)
+        stage_entries(self.store, 'abc', src_path,
+                      list(walk_proj(src_path)))
+
+        summary = GCSummary()
+        collector.sweep(summary)
+        self.assertEqual(summary.swept, 1)
+        self.assertEqual(self.store.has_keys(keys + [packed]), [keys[1]])
+
+    def test_resume(self):
+        """ Verify that a sweep continues after the last key recorded. """
+        keys = sorted(self.put() for _ in range(6))
+        (proj, _) = self.make_project('proj', [])
+        collector = GarbageCollector(self.store, jobs=1)
+        collector.mark([proj], GCSummary())
+        (mark_time, last_key, _, _) = collector.read_state()
+        self.assertEqual(last_key, '')
+
+        # pretend that the first three were swept before an interruption
+        # pylint: disable=protected-access
+        collector._write_state(mark_time, keys[2], 3, 300)
+        remaining = sum(os.stat(self.store.get_path_for_key(_)).st_size
+                        for _ in keys[3:])
+        summary = GCSummary()
+        collector.sweep(summary)
+        self.assertEqual(summary.swept, 6)
+        self.assertEqual(summary.bytes_swept, 300 + remaining)
+        for key in keys[:3]:
+            self.assertTrue(self.store.exists(key))
+        for key in keys[3:]:
+            self.assertFalse(os.path.exists(
+                self.store.get_path_for_key(key)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# dvcz/test_import_time.py
+
+"""
+Check that dvcz modules and scripts start quickly, using the output of
+python -X importtime.
+
+The time budget for -V and -j is DVCZ_IMPORT_BUDGET_MS milliseconds,
+by default 100.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# modules which must not be imported just to start up
+SLOW = ['Crypto', 'buildlist', 'nlhtree', 'optionz']
+
+BUDGET_MS = int(os.environ.get('DVCZ_IMPORT_BUDGET_MS', '100'))
+
+
+def import_times(argv):
+    """
+    Run python -X importtime with the arguments, returning a dict
+    mapping each top-level import to its cumulative time in
+    microseconds.  Nested imports are included under their own names
+    with a time of zero.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SRC_DIR] + sys.path)
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + argv,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          env=env, cwd=os.getcwd(), check=False)
+    times = {}
+    for line in proc.stderr.decode('utf-8').split('\n'):
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue                    # the header
+        name = parts[2].rstrip()
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        if depth <= 1:
+            times[name] = int(parts[1])
+        else:
+            times.setdefault(name, 0)
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs 3.7")
+class TestImportTime(unittest.TestCase):
+    """ Check that dvcz modules and scripts start quickly. """
+
+    def setUp(self):
+        self.baseline = import_times(['-c', 'pass'])
+
+    def tearDown(self):
+        pass
+
+    def check_not_slow(self, times, what):
+        """ Verify that none of the slow modules was imported. """
+        for name in times:
+            top = name.split('.')[0]
+            self.assertNotIn(top, SLOW, "%s imports %s" % (what, name))
+
+    def added_ms(self, times):
+        """ Return the milliseconds spent beyond interpreter startup. """
+        return sum(_ for name, _ in times.items()
+                   if name not in self.baseline) / 1000.0
+
+    def test_modules(self):
+        """ Verify that importing dvcz modules imports nothing slow. """
+        for module in ['dvcz.bl_cache', 'dvcz.bloom', 'dvcz.builds',
+                       'dvcz.build_index', 'dvcz.commit', 'dvcz.gc',
+                       'dvcz.key_index', 'dvcz.key_pool', 'dvcz.keyring',
+                       'dvcz.pack', 'dvcz.scrub', 'dvcz.stat_cache',
+                       'dvcz.store', 'dvcz.user', 'dvcz.workspace']:
+            times = import_times(['-c', 'import %s' % module])
+            self.assertIn(module, times)
+            self.check_not_slow(times, module)
+
+    def test_scripts(self):
+        """
+        Verify that -V and -j import nothing slow and stay within the
+        time budget.
+        """
+        for argv in [['dvc_adduser', '-V'], ['dvc_admin', '-V'],
+                     ['dvc_check_builds', '-V'],
+                     ['dvc_check_builds', '-j', '-T'], ['dvc_commit', '-V'],
+                     ['dvc_keypool', '-V'], ['dvc_log', '-V'],
+                     ['dvc_workspace', '-V']]:
+            what = ' '.join(argv)
+            times = import_times([os.path.join(SRC_DIR, argv[0])] + argv[1:])
+            self.assertTrue(times, "%s imported nothing" % what)
+            if argv[1] == '-V':
+                self.check_not_slow(times, what)
+            self.assertLess(self.added_ms(times), BUDGET_MS,
+                            "%s is over budget" % what)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# dvcz/test_key_index.py
+
+""" Test the KeyIndex, a persistent index of the keys in a Store. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz.key_index import IDX_DIR, MAX_RUNS, KeyIndex
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestKeyIndex(unittest.TestCase):
+    """ Test the KeyIndex, a persistent index of the keys in a Store. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
+
+    def tearDown(self):
+        pass
+
+    def make_store(self, dir_struc, hashtype):
+        """ Create an empty Store in the run directory. """
+        u_path = os.path.join(self.run_dir, self.rng.next_file_name(8))
+        return Store('U', u_path, dir_struc, hashtype)
+
+    def put_some(self, store, count):
+        """ Put count blocks of random data in the store; return the keys. """
+        keys = []
+        for _ in range(count):
+            data = self.rng.some_bytes(1 + self.rng.next_int16(256))
+            sha = hashlib.sha1() if store.hashtype == HashTypes.SHA1 \
+                else hashlib.sha256()
+            sha.update(data)
+            key = sha.hexdigest()
+            store.put_data(data, key)
+            keys.append(key)
+        return keys
+
+    def test_rebuild(self):
+        """ Verify that a missing index is built by scanning the store. """
+        for dir_struc in DirStruc:
+            for hashtype in [HashTypes.SHA1, HashTypes.SHA2]:
+                store = self.make_store(dir_struc, hashtype)
+                keys = self.put_some(store, 17)
+                idx_path = os.path.join(store.u_path, IDX_DIR)
+                self.assertFalse(os.path.exists(idx_path))
+
+                for key in keys:
+                    self.assertTrue(store.contains(key))
+                self.assertTrue(os.path.exists(idx_path))
+                self.assertFalse(store.contains(
+                    '0' * len(keys[0])))
+                self.assertEqual(list(store.keys()), sorted(set(keys)))
+
+                # a single thread finds the same keys
+                index = KeyIndex(store.u_path, dir_struc.name,
+                                 hashtype).rebuild(jobs=1)
+                self.assertEqual(list(index), sorted(set(keys)))
+                index.close()
+
+    def test_updates(self):
+        """
+        Verify that keys put and deleted are recorded, and survive a
+        flush and reloading.
+        """
+        store = self.make_store(DirStruc.DIR256x256, HashTypes.SHA2)
+        keys = self.put_some(store, 5)
+        store.key_index()
+        more = self.put_some(store, 5)
+        store.delete(keys[0])
+        self.assertTrue(store.contains(more[0]))
+        self.assertFalse(store.contains(keys[0]))
+
+        expected = sorted(set(keys[1:] + more))
+        reopened = Store('U', store.u_path, DirStruc.DIR256x256)
+        self.assertEqual(list(reopened.keys()), expected)
+        self.assertEqual(reopened.has_keys(keys + more), [keys[0]])
+
+        # a flush writes the additions as a run and the removal as a
+        # tombstone run, and leaves an empty log
+        idx_path = os.path.join(store.u_path, IDX_DIR)
+        reopened.key_index().flush()
+        self.assertEqual(self.run_count(idx_path), 3)
+        self.assertEqual(os.path.getsize(os.path.join(idx_path, 'log')), 16)
+        self.assertEqual(list(reopened.keys()), expected)
+        third = Store('U', store.u_path, DirStruc.DIR256x256)
+        self.assertFalse(third.contains(keys[0]))
+
+        # a key put back after its removal is found again
+        back = hashlib.sha256(b'back again').hexdigest()
+        reopened.put_data(b'back again', back)
+        reopened.delete(back)
+        reopened.key_index().flush()
+        self.assertFalse(third.contains(back))
+        reopened.put_data(b'back again', back)
+        reopened.key_index().flush()
+        self.assertTrue(third.contains(back))
+
+        # runs are merged, dropping tombstones, when there are too many
+        latest = []
+        while self.run_count(idx_path) > 1:
+            latest += self.put_some(reopened, 1)
+            reopened.key_index().flush()
+        self.assertLessEqual(len(latest), MAX_RUNS)
+        expected = sorted(set(expected + latest + [back]))
+        self.assertEqual(list(third.keys()), expected)
+        self.assertEqual(len(third.key_index()), len(expected))
+
+    @staticmethod
+    def run_count(idx_path):
+        """ Return the number of runs in the index. """
+        return len([_ for _ in os.listdir(idx_path) if _.startswith('run-')])
+
+    def test_shared(self):
+        """ Verify that an index sees keys added by another instance. """
+        store = self.make_store(DirStruc.DIR16x16, HashTypes.SHA2)
+        index_a = KeyIndex(store.u_path, 'DIR16x16').load()
+        index_b = KeyIndex(store.u_path, 'DIR16x16').load()
+        key = self.put_some(store, 1)[0]
+        index_a.add(key)
+        self.assertIn(key, index_b)
+        self.assertEqual(index_b.refreshes, 1)
+
+        # after a flush index_b reloads the runs
+        index_a.flush()
+        other = self.put_some(store, 1)[0]
+        index_a.add(other)
+        self.assertIn(other, index_b)
+        self.assertEqual(index_b.missing([key, other]), [])
+
+        # the count includes keys added elsewhere
+        third = self.put_some(store, 1)[0]
+        index_a.add(third)
+        self.assertEqual(len(index_b), 3)
+
+        # a flushed log is noticed even if its replacement reuses the
+        # inode of the one read before
+        log_path = os.path.join(index_a.path, 'log')
+        kept_path = log_path + '.kept'
+        os.link(log_path, kept_path)
+        index_a.flush()
+        news = self.put_some(store, 4)
+        index_a.add_many(news)
+        with open(log_path, 'rb') as file:
+            data = file.read()
+        with open(kept_path, 'r+b') as file:
+            file.write(data)
+        os.replace(kept_path, log_path)
+        self.assertEqual(index_b.missing([key, other, third] + news), [])
+        self.assertEqual(len(index_b), 7)
+        index_a.close()
+        index_b.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
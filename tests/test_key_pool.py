@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# dvcz/test_key_pool.py
+
+""" Test the pool of pre-generated RSA keys. """
+
+import os
+import stat
+import subprocess
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from Crypto.PublicKey import RSA
+from rnglib import SimpleRNG
+from dvcz.key_pool import KeyPool
+from dvcz.user import User
+
+
+class TestKeyPool(unittest.TestCase):
+    """ Test the pool of pre-generated RSA keys. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.pool_path = os.path.join(self.run_dir, 'keyPool')
+
+    def tearDown(self):
+        pass
+
+    def test_fill_and_take(self):
+        """
+        Verify that the pool is filled to the depth asked for, that it
+        is private, and that each key is taken only once.
+        """
+        pool = KeyPool(self.pool_path, 1024)
+        self.assertEqual(stat.S_IMODE(os.stat(pool.path).st_mode), 0o700)
+        self.assertEqual(pool.depth(), 0)
+        self.assertIsNone(pool.take_pem())
+
+        self.assertEqual(pool.fill(4, jobs=2), 4)
+        self.assertEqual(pool.fill(3), 0)
+        self.assertEqual(pool.depth(), 4)
+        for name in os.listdir(pool.path):
+            info = os.stat(os.path.join(pool.path, name))
+            self.assertEqual(stat.S_IMODE(info.st_mode), 0o600)
+
+        pems = set()
+        for _ in range(4):
+            pem = pool.take_pem()
+            self.assertEqual(RSA.importKey(pem).size() + 1, 1024)
+            pems.add(pem)
+        self.assertEqual(len(pems), 4)
+        self.assertEqual(pool.depth(), 0)
+        self.assertEqual(os.listdir(pool.path), [])
+
+        # an empty pool falls back to generating keys
+        self.assertEqual(pool.take().size() + 1, 1024)
+
+    def test_racing_fills(self):
+        """
+        Verify that fills racing each other do not overshoot the depth,
+        and that keys claimed by dead processes are reaped.
+        """
+        pool = KeyPool(self.pool_path, 1024)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            added = list(executor.map(lambda _: pool.fill(6), range(4)))
+        self.assertEqual(sum(added), 6)
+        self.assertEqual(pool.depth(), 6)
+
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()                     # its PID now names no process
+        for pid in [proc.pid, os.getpid()]:
+            with open(os.path.join(pool.path, '.taken-%d-%s.pem' % (
+                    pid, os.urandom(8).hex())), 'w') as file:
+                file.write('claimed')
+        pool.take_pem()
+        self.assertEqual(pool.fill(6), 1)
+        taken = [_ for _ in os.listdir(pool.path) if _.startswith('.taken-')]
+        self.assertEqual(len(taken), 1)
+        self.assertIn('-%d-' % os.getpid(), taken[0])
+
+    def test_user_draws_from_pool(self):
+        """ Verify that a User takes its keys from the pool. """
+        pool = KeyPool(self.pool_path, 1024)
+        pool.fill(3)
+        user = User('fred', None, None, 1024, key_pool=pool)
+        self.assertEqual(pool.depth(), 3)       # keys are made lazily
+        user.generate_keys()
+        self.assertEqual(pool.depth(), 1)
+
+        # keys of the wrong size are not taken
+        User('fred', None, None, 2048, key_pool=pool).generate_keys()
+        self.assertEqual(pool.depth(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
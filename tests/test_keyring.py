@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# dvcz/test_keyring.py
+
+""" Test the keyring of public committer keys. """
+
+import os
+import time
+import unittest
+from unittest import mock
+
+from Crypto.PublicKey import RSA
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.keyring import Keyring
+from dvcz.user import PARSE_CACHE, Committer, PubCommitter, make_committer_id
+
+
+class TestKeyring(unittest.TestCase):
+    """ Test the keyring of public committer keys. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.keyring_path = os.path.join(self.run_dir, 'committers')
+
+    def tearDown(self):
+        pass
+
+    def make_committers(self, count):
+        """ Return a list of (committer_id, Committer). """
+        pairs = []
+        for ndx in range(count):
+            committer = Committer('handle%d' % ndx, 'login%d' % ndx,
+                                  key_bits=1024)
+            pairs.append((make_committer_id(committer.sk_priv.publickey()),
+                          committer))
+        return pairs
+
+    def test_add_and_get(self):
+        """
+        Verify that committers added can be looked up by ID, from
+        memory, from disk, and with or without an index.
+        """
+        pairs = self.make_committers(4)
+        keyring = Keyring(self.keyring_path, max_entries=2)
+        self.assertEqual(len(keyring), 0)
+        for committer_id, committer in pairs:
+            keyring.add(committer_id, committer)
+            keyring.add(committer_id, committer)        # no effect
+        self.assertEqual(len(keyring), 4)
+        self.assertEqual(keyring.ids(), sorted(_[0] for _ in pairs))
+
+        (committer_id, committer) = pairs[0]
+        self.assertEqual(keyring.describe(committer_id),
+                         ('handle0', 'login0'))
+        pub = keyring.get(committer_id)
+        self.assertIsInstance(pub, PubCommitter)
+        self.assertEqual(pub, PubCommitter.create_from_committer(committer))
+        self.assertIs(keyring.get(committer_id), pub)
+        self.assertIsNone(keyring.get('0' * 64))
+        self.assertRaises(DvczError, keyring.get, 'not-an-id')
+        self.assertRaises(DvczError, keyring.add, committer_id, pairs[1][1])
+
+        # a fresh keyring reads the index but parses nothing until asked
+        PARSE_CACHE.invalidate()
+        with mock.patch.object(RSA, 'importKey', side_effect=AssertionError):
+            keyring = Keyring(self.keyring_path)
+            self.assertEqual(len(keyring), 4)
+            self.assertIn(committer_id, keyring)
+        self.assertEqual(keyring.get(committer_id), pub)
+        self.assertEqual(keyring.misses, 1)
+
+        # a lost index is rebuilt by scanning the keyring
+        os.unlink(os.path.join(self.keyring_path, 'index'))
+        keyring = Keyring(self.keyring_path)
+        self.assertEqual(keyring.ids(), sorted(_[0] for _ in pairs))
+        self.assertEqual(keyring.describe(pairs[3][0]),
+                         ('handle3', 'login3'))
+
+    def test_serialization(self):
+        """ Verify that a PubCommitter round-trips through its text. """
+        committer = Committer('gorp', 'fred', key_bits=1024)
+        pub = PubCommitter.create_from_committer(committer)
+        ser = pub.__str__()
+        pub_b = PubCommitter.create_from_string(ser)
+        self.assertEqual(pub_b, pub)
+        self.assertEqual(pub_b.handle, 'gorp')
+        self.assertEqual(pub_b.login, 'fred')
+        self.assertRaises(DvczError, PubCommitter.create_from_string,
+                          ser.replace(PubCommitter.END_LINE, 'junk'))
+
+
+if __name__ == '__main__':
+    unittest.main()
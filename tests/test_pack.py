@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# dvcz/test_pack.py
+
+""" Test pack files holding the small objects in a Store. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz.pack import PACK_DIR, repack
+from dvcz.scrub import Scrubber
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestPack(unittest.TestCase):
+    """ Test pack files holding the small objects in a Store. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
+        self.u_path = os.path.join(self.run_dir, 'U')
+        self.store = self.open_store()
+
+    def tearDown(self):
+        pass
+
+    def open_store(self):
+        """ Return a new Store for the run's u_path. """
+        return Store('U', self.u_path, DirStruc.DIR256x256, HashTypes.SHA2)
+
+    def fill(self, count, max_len, min_len=1):
+        """
+        Put count objects of min_len to max_len random bytes in the
+        store.  Return a dict mapping their keys to their data.
+        """
+        objects = {}
+        for _ in range(count):
+            data = self.rng.some_bytes(
+                min_len + self.rng.next_int16(max_len - min_len + 1))
+            key = hashlib.sha256(data).hexdigest()
+            self.store.put_data(data, key)
+            objects[key] = data
+        return objects
+
+    def is_loose(self, key):
+        """ Return whether the object is a loose file. """
+        return os.path.exists(self.store.get_path_for_key(key))
+
+    def test_repack(self):
+        """
+        Verify that small objects are packed and still found, and that
+        large ones are left loose.
+        """
+        small = self.fill(50, 1000)
+        large = self.fill(3, 3000, min_len=2000)
+        keys = sorted(list(small) + list(large))
+
+        summary = repack(self.store, small=1024, max_bytes=16 * 1024)
+        self.assertEqual(summary.loose, len(small))
+        self.assertGreater(summary.packs_written, 1)
+        self.assertEqual(summary.bad, [])
+        for key, data in small.items():
+            self.assertFalse(self.is_loose(key))
+            self.assertTrue(self.store.exists(key))
+            self.assertEqual(self.store.get_data(key), data)
+            self.assertEqual(self.store.file_len(key), len(data))
+        for key in large:
+            self.assertTrue(self.is_loose(key))
+
+        # a second Store, with no index, finds packed objects too
+        other = self.open_store()
+        absent = hashlib.sha256(b'absent').hexdigest()
+        self.assertEqual(other.has_keys(keys + [absent]), [absent])
+        self.assertEqual(other.get_data(keys[0]),
+                         small.get(keys[0], large.get(keys[0])))
+        self.assertEqual(list(other.rebuild_index().__iter__()), keys)
+        self.assertEqual(list(other.keys()), keys)
+
+        # packed objects are scrubbed too
+        self.assertEqual(Scrubber(other, jobs=2).scrub().checked, len(keys))
+
+    def test_delete(self):
+        """
+        Verify that packed objects can be deleted and that a full
+        repack drops them.
+        """
+        objects = self.fill(20, 500)
+        keys = sorted(objects)
+        repack(self.store)
+        self.assertTrue(self.store.delete(keys[0]))
+        self.assertFalse(self.store.exists(keys[0]))
+        self.assertIsNone(self.store.get_data(keys[0]))
+        self.assertFalse(self.open_store().exists(keys[0]))
+
+        # new loose objects and the packed ones go into a single pack
+        more = self.fill(5, 500)
+        summary = repack(self.store, full=True)
+        self.assertEqual(summary.loose, len(more))
+        self.assertEqual(summary.repacked, len(keys) - 1)
+        self.assertEqual(summary.dropped, 1)
+        self.assertEqual(summary.packs_removed, 1)
+        names = os.listdir(os.path.join(self.u_path, PACK_DIR))
+        self.assertEqual(sorted(names),
+                         ['pack-00000002.dat', 'pack-00000002.idx'])
+        store = self.open_store()
+        self.assertFalse(store.exists(keys[0]))
+        for key in keys[1:] + list(more):
+            self.assertTrue(store.exists(key))
+
+    def test_put_back(self):
+        """
+        Verify that an object deleted from a pack, put back and packed
+        again is found, and can be deleted again.
+        """
+        objects = self.fill(5, 500)
+        key = sorted(objects)[1]
+        repack(self.store)
+        self.assertTrue(self.store.delete(key))
+        self.store.put_data(objects[key], key)
+        summary = repack(self.store)
+        self.assertEqual(summary.loose, 1)
+        self.assertFalse(self.is_loose(key))
+        for store in [self.store, self.open_store()]:
+            self.assertTrue(store.exists(key))
+            self.assertEqual(store.get_data(key), objects[key])
+            self.assertEqual(store.has_keys(list(objects)), [])
+
+        self.assertTrue(self.store.delete(key))
+        for store in [self.store, self.open_store()]:
+            self.assertFalse(store.exists(key))
+            self.assertIsNone(store.get_data(key))
+
+    def test_bad(self):
+        """ Verify that an object which hashes wrong is left loose. """
+        objects = self.fill(5, 500)
+        key = sorted(objects)[2]
+        with open(self.store.get_path_for_key(key), 'ab') as file:
+            file.write(b'rot')
+        summary = repack(self.store)
+        self.assertEqual(summary.bad, [key])
+        self.assertEqual(summary.loose, 4)
+        self.assertTrue(self.is_loose(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# dvcz/test_project_locator.py
+
+""" Verify that ProjectLocator finds project directories. """
+
+from argparse import Namespace
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.project import ProjectLocator, get_proj_info
+
+
+class TestProjectLocator(unittest.TestCase):
+    """ Verify that ProjectLocator finds project directories. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.run_dir = os.path.abspath(run_dir)
+        self.proj_path = os.path.join(self.run_dir, 'proj')
+        os.makedirs(os.path.join(self.proj_path, '.dvcz'), 0o755)
+        for sub in ['b/c', 'b/d', 'e']:
+            os.makedirs(os.path.join(self.proj_path, sub), 0o755)
+
+    def tearDown(self):
+        pass
+
+    def test_locate(self):
+        """
+        Verify that the project is found from any directory below it,
+        without changing directory, and that directories are visited
+        at most once.
+        """
+        basedir = os.getcwd()
+        locator = ProjectLocator(home='/nonesuch')
+        info = locator.locate(os.path.join(self.proj_path, 'b', 'c'))
+        self.assertEqual(os.getcwd(), basedir)
+        self.assertEqual(info.name, 'proj')
+        self.assertEqual(info.path, self.proj_path)
+        self.assertEqual(info.parent, self.run_dir)
+        self.assertEqual(locator.locate(self.proj_path), info)
+
+        # a sibling walks only as far as an ancestor already visited
+        with mock.patch('dvcz.project.os.stat', wraps=os.stat) as stat_:
+            self.assertEqual(
+                locator.locate(os.path.join(self.proj_path, 'b', 'd')), info)
+            self.assertEqual(stat_.call_count, 2)   # d, d/.dvcz
+            stat_.reset_mock()
+            locator.locate(os.path.join(self.proj_path, 'b', 'c'))
+            self.assertEqual(stat_.call_count, 0)
+
+        # a relative path is taken relative to the current directory
+        rel_path = os.path.relpath(os.path.join(self.proj_path, 'e'))
+        self.assertEqual(locator.locate(rel_path), info)
+
+        locator.clear()
+        self.assertEqual(len(locator), 0)
+
+    def test_bad_paths(self):
+        """ Verify that bad paths and missing projects raise. """
+        locator = ProjectLocator(home='/nonesuch')
+        self.assertRaises(FileNotFoundError, locator.locate,
+                          os.path.join(self.proj_path, 'nonesuch'))
+        file_path = os.path.join(self.proj_path, 'e', 'file')
+        with open(file_path, 'w') as file:
+            file.write('data')
+        self.assertRaises(NotADirectoryError, locator.locate, file_path)
+
+        # the home directory is not a project directory
+        locator = ProjectLocator(home=self.proj_path)
+        self.assertRaises(DvczError, locator.locate, self.proj_path)
+
+        outside = tempfile.mkdtemp()
+        try:
+            if ProjectLocator()._root_of(outside):
+                self.skipTest("%s is in a project" % outside)
+            self.assertRaises(DvczError, ProjectLocator().locate, outside)
+        finally:
+            os.rmdir(outside)
+
+    def test_get_proj_info(self):
+        """
+        Verify that get_proj_info() adds the project to the Namespace
+        and changes to the project directory.
+        """
+        basedir = os.getcwd()
+        args = Namespace(proj_path=os.path.join(self.proj_path, 'b'))
+        try:
+            get_proj_info(args)
+            self.assertEqual(os.getcwd(), self.proj_path)
+        finally:
+            os.chdir(basedir)
+        # pylint: disable=no-member
+        self.assertEqual(args.proj_name, 'proj')
+        self.assertEqual(args.proj_path, self.proj_path)
+        self.assertEqual(args.proj_parent, self.run_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# dvcz/test_scrub.py
+
+""" Test scrubbing a content-keyed Store. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz import DvczError
+from dvcz.scrub import Scrubber, ScrubSummary, Throttle
+from dvcz.store import Store
+from xlattice import HashTypes
+from xlu import DirStruc
+
+
+class TestScrub(unittest.TestCase):
+    """ Test scrubbing a content-keyed Store. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.run_dir, mode=0o755)
+        self.store = Store('U', os.path.join(self.run_dir, 'U'),
+                           DirStruc.DIR16x16, HashTypes.SHA2)
+
+    def tearDown(self):
+        pass
+
+    def fill(self, count):
+        """ Put count random objects in the store; return their keys. """
+        keys = []
+        for _ in range(count):
+            data = self.rng.some_bytes(1 + self.rng.next_int16(2048))
+            key = hashlib.sha256(data).hexdigest()
+            self.store.put_data(data, key)
+            keys.append(key)
+        return sorted(keys)
+
+    def corrupt(self, key):
+        """ Flip a bit in the object with the key. """
+        path = self.store.get_path_for_key(key)
+        with open(path, 'r+b') as file:
+            byte = file.read(1)
+            file.seek(0)
+            file.write(bytes([byte[0] ^ 1]))
+
+    def test_scrub(self):
+        """ Verify that bad objects, and only those, are quarantined. """
+        keys = self.fill(40)
+        bad = [keys[3], keys[25]]
+        for key in bad:
+            self.corrupt(key)
+
+        scrubber = Scrubber(self.store, jobs=4)
+        summary = scrubber.scrub()
+        self.assertTrue(summary.finished)
+        self.assertEqual(summary.checked, len(keys))
+        self.assertEqual(sorted(summary.bad), bad)
+        self.assertEqual(summary.errors, [])
+        self.assertEqual(sorted(os.listdir(scrubber.quarantine_path)), bad)
+        self.assertEqual(self.store.has_keys(keys), bad)
+        self.assertFalse(self.store.contains(bad[0]))
+        self.assertIsNone(scrubber.read_state())
+
+        # the store is now clean
+        summary = Scrubber(self.store, jobs=1).scrub()
+        self.assertEqual(summary.checked, len(keys) - len(bad))
+        self.assertEqual(summary.bad, [])
+
+    def test_resume(self):
+        """ Verify that a scrub continues after the last key recorded. """
+        keys = self.fill(10)
+        self.corrupt(keys[1])
+        self.corrupt(keys[8])
+        scrubber = Scrubber(self.store, jobs=2)
+        before = ScrubSummary()
+        before.bad.append(keys[0])      # found before the interruption
+        before.errors.append((keys[2], 'unreadable'))
+        # pylint: disable=protected-access
+        scrubber._write_state(int(time.time()), keys[4], before)
+        summary = scrubber.scrub(resume=True)
+        self.assertTrue(summary.resumed)
+        self.assertEqual(summary.checked, 5)
+        self.assertEqual(summary.bad, [keys[8]])
+        self.assertEqual(summary.bad_count, 2)
+        self.assertIn('2 bad', str(summary))
+        self.assertEqual((summary.errors, summary.error_count), ([], 1))
+        self.assertIn('1 unreadable', str(summary))
+        self.assertTrue(self.store.exists(keys[1]))
+
+    def test_quarantine(self):
+        """
+        Verify that an object quarantined twice keeps both copies, and
+        that quarantining an object which has gone does no harm.
+        """
+        key = self.fill(1)[0]
+        scrubber = Scrubber(self.store, jobs=1)
+        paths = []
+        for _ in range(2):
+            with open(self.store.get_path_for_key(key), 'rb') as file:
+                data = file.read()
+            self.corrupt(key)
+            paths.append(scrubber.quarantine(key))
+            self.assertFalse(self.store.exists(key))
+            self.store.put_data(data, key)
+        self.assertEqual([os.path.basename(_) for _ in paths],
+                         [key, key + '.1'])
+        self.assertTrue(all(os.path.exists(_) for _ in paths))
+
+        self.store.delete(key)
+        self.assertIsNone(scrubber.quarantine(key))
+
+    def test_throttle(self):
+        """ Verify that reads are limited to the bandwidth given. """
+        with self.assertRaises(DvczError):
+            Throttle(-1)
+        throttle = Throttle(100 * 1024)
+        began = time.monotonic()
+        for _ in range(5):
+            throttle.consume(40 * 1024)
+        # the first 100 KB are a burst; the other 100 KB take a second
+        self.assertGreater(time.monotonic() - began, 0.9)
+        self.assertGreater(throttle.waits, 0)
+
+        keys = self.fill(4)
+        size = sum(os.stat(self.store.get_path_for_key(_)).st_size
+                   for _ in keys)
+        summary = Scrubber(self.store, jobs=2, bandwidth=size).scrub()
+        self.assertEqual(summary.bytes_read, size)
+
+
+if __name__ == '__main__':
+    unittest.main()
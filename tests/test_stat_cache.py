@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# dvcz/test_stat_cache.py
+
+""" Test the StatCache, which saves rehashing unchanged files. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from dvcz.hashing import hash_file
+from dvcz.stat_cache import StatCache
+from xlattice import HashTypes
+
+
+class TestStatCache(unittest.TestCase):
+    """ Test the StatCache, which saves rehashing unchanged files. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.run_dir):
+            self.run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.dvcz_path = os.path.join(self.run_dir, '.dvcz')
+        os.makedirs(self.dvcz_path, mode=0o755)
+
+    def tearDown(self):
+        pass
+
+    def make_file(self, name, old=True):
+        """ Create a file of random data, backdated unless old is False. """
+        path = os.path.join(self.run_dir, name)
+        with open(path, 'wb') as file:
+            file.write(self.rng.some_bytes(1 + self.rng.next_int16(4096)))
+        if old:
+            then = time.time() - 60
+            os.utime(path, (then, then))
+        return path
+
+    def test_round_trip(self):
+        """ Verify that hashes survive a save and reload. """
+        for hashtype in HashTypes:
+            path = self.make_file('abc')
+            cache = StatCache(self.dvcz_path, hashtype).load()
+            self.assertEqual(len(cache), 0)
+            hex_hash = cache.get_hash('abc', path)
+            self.assertEqual(hex_hash, hash_file(path, hashtype))
+            self.assertEqual(cache.misses, 1)
+            cache.save()
+            self.assertTrue(os.path.exists(cache.path))
+
+            cache_b = StatCache(self.dvcz_path, hashtype).load()
+            self.assertEqual(len(cache_b), 1)
+            self.assertEqual(cache_b.get_hash('abc', path), hex_hash)
+            self.assertEqual(cache_b.hits, 1)
+            self.assertEqual(cache_b.misses, 0)
+
+    def test_hashtypes_separate(self):
+        """ Verify that entries are not shared between hash types. """
+        path = self.make_file('def')
+        cache1 = StatCache(self.dvcz_path, HashTypes.SHA1).load()
+        cache1.get_hash('def', path)
+        cache1.save()
+
+        cache2 = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        self.assertEqual(len(cache2), 0)
+        self.assertNotEqual(cache1.path, cache2.path)
+
+    def test_changed_file(self):
+        """ Verify that a changed file is rehashed. """
+        path = self.make_file('ghi')
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        cache.get_hash('ghi', path)
+        cache.save()
+
+        path = self.make_file('ghi')
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        self.assertEqual(cache.get_hash('ghi', path),
+                         hash_file(path, HashTypes.SHA2))
+        self.assertEqual(cache.misses, 1)
+
+    def test_racy_file(self):
+        """ Verify that a just-modified file is not cached. """
+        path = self.make_file('jkl', old=False)
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        cache.get_hash('jkl', path)
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_entries_dropped(self):
+        """ Verify that entries for vanished files are dropped on save. """
+        path_a = self.make_file('mno')
+        path_b = self.make_file('pqr')
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        cache.get_hash('mno', path_a)
+        cache.get_hash('pqr', path_b)
+        cache.save()
+
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        cache.get_hash('mno', path_a)
+        cache.save()
+        cache = StatCache(self.dvcz_path, HashTypes.SHA2).load()
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
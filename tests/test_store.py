@@ -3,10 +3,16 @@
 
 """ Test the Store object and related functions. """
 
+import hashlib
+import os
+import time
 import unittest
 
+from rnglib import SimpleRNG
 from dvcz import DvczError
-from dvcz.store import Store
+from dvcz.hashing import BUF_SIZE, hash_file
+from dvcz.store import (INGEST_COPY, INGEST_COPY_RANGE, INGEST_HARDLINK,
+                        INGEST_REFLINK, Store, StoreInfo, load_stores)
 from xlattice import HashTypes
 from xlu import DirStruc
 
@@ -107,6 +113,177 @@ class TestStore(unittest.TestCase):
         """ Verify that various inacceptable store paths are rejected. """
         self.do_test_bad_path('frog', '/frog')      # no permission to write
 
+    # ---------------------------------------------------------------
+
+    def test_ingest(self):
+        """
+        Verify that ingest() stages files under in/COMMITTER_ID using
+        their content keys and leaves nothing behind in tmp/.
+        """
+        rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', rng.next_file_name(8))
+        os.makedirs(run_dir, mode=0o755)
+        data_path = os.path.join(run_dir, 'data')
+        data = rng.some_bytes(3 * BUF_SIZE + 17)
+        with open(data_path, 'wb') as file:
+            file.write(data)
+        committer_id = '0123456789abcdef' * 4
+
+        for dir_struc in DirStruc:
+            for hashtype in HashTypes:
+                u_path = os.path.join(
+                    run_dir, '%s_%s' % (dir_struc.name, hashtype.name))
+                store = Store.discover('grinch', u_path, dir_struc, hashtype)
+                key, length, method = store.ingest(data_path, committer_id)
+                self.assertEqual(key, hash_file(data_path, hashtype))
+                self.assertEqual(length, len(data))
+                self.assertEqual(method, INGEST_COPY)
+
+                in_dir = store.in_dir_for(committer_id)
+                self.assertEqual(in_dir.dir_struc, DirStruc.DIR_FLAT)
+                self.assertTrue(in_dir.exists(key))
+                self.assertEqual(in_dir.get_data(key), data)
+                self.assertEqual(os.listdir(os.path.join(u_path, 'tmp')), [])
+
+                # ingesting the same file again changes nothing
+                self.assertEqual(store.ingest(data_path, committer_id),
+                                 (key, length, INGEST_COPY))
+
+                # unless asked to dedup, when the copy is dropped
+                self.assertEqual(store.ingest(data_path, committer_id,
+                                              dedup=True),
+                                 (key, length, None))
+                self.assertEqual(os.listdir(os.path.join(u_path, 'tmp')), [])
+
+                # whichever way the data gets there, it must be the same
+                for hardlink in [False, True]:
+                    other_id = 'fedcba9876543210' * 4
+                    key_z, length_z, method = store.ingest(
+                        data_path, other_id, zero_copy=True,
+                        hardlink=hardlink)
+                    self.assertEqual((key_z, length_z), (key, length))
+                    self.assertIn(method, [INGEST_REFLINK,
+                                           INGEST_COPY_RANGE,
+                                           INGEST_HARDLINK,
+                                           INGEST_COPY])
+                    self.assertEqual(
+                        store.in_dir_for(other_id).get_data(key), data)
+                    store.in_dir_for(other_id).delete(key)
+                self.assertEqual(os.listdir(os.path.join(u_path, 'tmp')), [])
+
+                key_b, _ = store.ingest_data(b'abc', committer_id)
+                self.assertEqual(in_dir.get_data(key_b), b'abc')
+
+
+    def test_has_keys(self):
+        """ Verify that has_keys() returns exactly the missing keys. """
+        rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', rng.next_file_name(8))
+        committer_id = '0123456789abcdef' * 4
+
+        for dir_struc in DirStruc:
+            u_path = os.path.join(run_dir, dir_struc.name)
+            store = Store.discover('grinch', u_path, dir_struc,
+                                   HashTypes.SHA2)
+            present = []
+            absent = []
+            staged = []
+            for ndx in range(200):
+                data = rng.some_bytes(16 + ndx)
+                if ndx % 3 == 0:
+                    absent.append(hashlib.sha256(data).hexdigest())
+                elif ndx % 3 == 1:
+                    key = hashlib.sha256(data).hexdigest()
+                    store.put_data(data, key)
+                    present.append(key)
+                else:
+                    staged.append(store.ingest_data(data, committer_id)[0])
+
+            keys = present + absent + staged + present
+            self.assertEqual(store.has_keys(keys), absent + staged)
+            self.assertEqual(store.has_keys(keys, committer_id), absent)
+            self.assertEqual(store.has_keys(absent[:1], committer_id),
+                             absent[:1])
+            self.assertEqual(store.has_keys(present[:1]), [])
+            self.assertEqual(store.has_keys([]), [])
+
+    def test_false_positives(self):
+        """
+        Verify that only keys the Bloom filter lets through and which
+        are then found nowhere count as false positives.
+        """
+        rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', rng.next_file_name(8))
+        store = Store.discover('grinch', run_dir, DirStruc.DIR256x256,
+                               HashTypes.SHA2)
+        data = rng.some_bytes(64)
+        present = hashlib.sha256(data).hexdigest()
+        store.put_data(data, present)
+        committer_id = '0123456789abcdef' * 4
+        staged = store.ingest_data(rng.some_bytes(64), committer_id)[0]
+        absent = [hashlib.sha256(rng.some_bytes(64)).hexdigest()
+                  for _ in range(2)]
+        bloom = store.rebuild_bloom(fp_rate=1e-9)
+        bloom.add(absent[0])            # as if by chance
+
+        # a key staged by someone else is there, if not for this caller
+        self.assertEqual(store.has_keys([present, staged] + absent),
+                         [staged] + absent)
+        self.assertEqual(bloom.false_positives, 1)
+
+    def test_load_stores(self):
+        """
+        Verify that descriptors are read without touching the stores,
+        cached until stores/ changes, and opened on demand.
+        """
+        rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', rng.next_file_name(8))
+        stores_path = os.path.join(run_dir, 'stores')
+        self.assertEqual(load_stores(stores_path), {})
+        os.makedirs(stores_path, mode=0o755)
+
+        expected = {}
+        for ndx, dir_struc in enumerate(DirStruc):
+            info = StoreInfo('store%d' % ndx,
+                             os.path.join(run_dir, 'U%d' % ndx),
+                             dir_struc, HashTypes.SHA1)
+            with open(os.path.join(stores_path, info.name), 'w') as file:
+                file.write(info.__str__() + '\n')
+            expected[info.name] = info
+        infos = load_stores(stores_path)
+        self.assertEqual(infos, expected)
+        for info in infos.values():
+            self.assertFalse(os.path.exists(info.u_path))
+
+        # cached until the directory's mtime changes
+        mtime_ns = os.stat(stores_path).st_mtime_ns
+        os.unlink(os.path.join(stores_path, 'store0'))
+        os.utime(stores_path, ns=(mtime_ns, mtime_ns))
+        self.assertIn('store0', load_stores(stores_path))
+        os.utime(stores_path, ns=(mtime_ns, mtime_ns + 1000))
+        self.assertNotIn('store0', load_stores(stores_path))
+
+        store = infos['store1'].open()
+        self.assertEqual(store.dir_struc, infos['store1'].dir_struc)
+        self.assertEqual(store.hashtype, HashTypes.SHA1)
+        self.assertEqual(Store.create_from_string(str(infos['store1'])),
+                         store)
+
+        with open(os.path.join(stores_path, 'misnamed'), 'w') as file:
+            file.write(str(infos['store1']))
+        os.utime(stores_path, ns=(mtime_ns, mtime_ns + 2000))
+        self.assertRaises(DvczError, load_stores, stores_path)
+        self.assertRaises(DvczError, StoreInfo.create_from_string,
+                          'a::b::DIR_FLAT::NONESUCH')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,10 +3,13 @@
 
 """ Test the functioning of various user-related classes. """
 
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 from Crypto.PublicKey import RSA
-from dvcz.user import User
+from dvcz.user import PARSE_CACHE, Committer, ParseCache, User
 from dvcz import DvczError
 
 
@@ -19,6 +22,27 @@ class TestUser(unittest.TestCase):
     def tearDown(self):
         pass
 
+    def test_racing_first_use(self):
+        """
+        Verify that threads first using a User's keys together are all
+        given the same keys.
+        """
+        generate = RSA.generate
+
+        def slow_generate(key_bits):
+            """ Generate a key slowly enough for threads to collide. """
+            time.sleep(0.05)
+            return generate(key_bits)
+
+        user = User('fred', key_bits=1024)
+        with mock.patch.object(RSA, 'generate', side_effect=slow_generate):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                keys = list(executor.map(
+                    lambda _: (user.sk_priv, user.ck_priv), range(4)))
+        for sk_priv, ck_priv in keys:
+            self.assertIs(sk_priv, keys[0][0])
+            self.assertIs(ck_priv, keys[0][1])
+
     def do_test_good(self, login, sk_priv, ck_priv, key_bits):
         """
         Verify that a known-good set of parameters is accepted
@@ -51,6 +75,100 @@ class TestUser(unittest.TestCase):
         ck_priv = RSA.generate(1024)
         self.do_test_good('fred', sk_priv, ck_priv, 1024)
 
+    def test_lazy_keys(self):
+        """
+        Verify that keys are generated or imported only when used and
+        that serialization round-trips without importing keys.
+        """
+        sk_priv = RSA.generate(1024)
+        ser = User('fred', sk_priv, RSA.generate(1024), 1024).__str__()
+        with mock.patch.object(RSA, 'generate', side_effect=AssertionError), \
+                mock.patch.object(RSA, 'importKey',
+                                  side_effect=AssertionError):
+            User('placeholder', None, None, 2048)
+            user = User.create_from_string(ser)
+            self.assertEqual(user.__str__(), ser)
+            committer = Committer.create_from_string(
+                Committer('gorp', 'fred', user.sk_pem, user.ck_pem,
+                          None).__str__())
+            self.assertEqual(committer.sk_pem, user.sk_pem)
+
+        # keys are imported on first use ...
+        self.assertEqual(user.key_bits, 1024)
+        self.assertEqual(user.sk_priv.exportKey('PEM'),
+                         sk_priv.exportKey('PEM'))
+
+        # ... or generated, either on first use or on request
+        user = User('grinch', None, None, 1024)
+        user.generate_keys()
+        self.assertEqual(user.sk_priv.size() + 1, 1024)
+        self.assertEqual(user.ck_priv.size() + 1, 1024)
+
+        # a key of the wrong size is replaced, but only that key
+        user = User('charlie', sk_priv, RSA.generate(2048), 1024)
+        self.assertIs(user.sk_priv, sk_priv)
+        self.assertEqual(user.ck_priv.size() + 1, 1024)
+
+        # but an imported one is an error, not silently replaced
+        user = User('dora', sk_priv.exportKey('PEM'), None, 2048)
+        self.assertRaises(DvczError, lambda: user.sk_priv)
+
+    def test_parse_cache(self):
+        """
+        Verify that parsing the same serialization twice returns a copy
+        of the cached object without importing its keys again, and that
+        the cache is bounded and can be invalidated.
+        """
+        ser = User('fred', RSA.generate(1024), RSA.generate(1024),
+                   1024).__str__()
+        user = User.create_from_string(ser)
+        self.assertEqual(user.key_bits, 1024)         # imports sk_priv
+        with mock.patch.object(RSA, 'importKey', side_effect=AssertionError):
+            for text in [ser, ser.rstrip()]:
+                user_b = User.create_from_string(text)
+                self.assertIsNot(user_b, user)
+                self.assertEqual(user_b, user)
+                self.assertIs(user_b.sk_priv, user.sk_priv)
+
+        # callers do not share state
+        user_b = User.create_from_string(ser)
+        user_b.generate_keys()
+        # pylint: disable=protected-access
+        self.assertIsNone(User.create_from_string(ser)._ck_priv)
+
+        # the same keys serialized as a Committer are cached separately
+        c_ser = Committer('gorp', 'fred', user.sk_pem, user.ck_pem,
+                          None).__str__()
+        committer = Committer.create_from_string(c_ser)
+        self.assertIsInstance(committer, Committer)
+        hits = PARSE_CACHE.hits
+        self.assertEqual(Committer.create_from_string(c_ser), committer)
+        self.assertEqual(PARSE_CACHE.hits, hits + 1)
+
+        PARSE_CACHE.invalidate(ser)
+        misses = PARSE_CACHE.misses
+        self.assertEqual(User.create_from_string(ser), user)
+        self.assertEqual(Committer.create_from_string(c_ser), committer)
+        self.assertEqual(PARSE_CACHE.misses, misses + 1)
+        PARSE_CACHE.invalidate()
+        self.assertEqual(len(PARSE_CACHE), 0)
+
+        # a bad serialization is not cached
+        self.assertRaises(DvczError, User.create_from_string,
+                          ser.replace(User.END_LINE, 'junk'))
+        self.assertRaises(DvczError, Committer.create_from_string, '\n\n')
+        self.assertEqual(len(PARSE_CACHE), 0)
+
+        # the least recently used entry is discarded first
+        cache = ParseCache(2)
+        for text in ['a', 'b', 'a', 'c']:
+            cache.get(User, [text], list)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.get(User, ['a'], list)
+        self.assertEqual(cache.hits, 2)
+        self.assertRaises(DvczError, ParseCache, 0)
+
     def do_test_bad_login(self, login, sk_priv, ck_priv, key_bits):
         """Verify that bad login strings are rejected. """
         try:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# dvcz/test_workspace.py
+
+""" Test committing many projects in one process. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from buildlist import generate_rsa_key
+from rnglib import SimpleRNG
+from dvcz.workspace import Workspace, read_proj_list
+
+
+class TestWorkspace(unittest.TestCase):
+    """ Test committing many projects in one process. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(run_dir):
+            run_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.run_dir = os.path.abspath(run_dir)
+        self.u_path = os.path.join(self.run_dir, 'U')
+        self.key_path = os.path.join(self.run_dir, 'skPriv.pem')
+        os.makedirs(self.run_dir, 0o755)
+        generate_rsa_key(self.key_path, 1024)
+        self.committer_id = self.rng.some_bytes(32).hex()
+
+        # two projects sharing one file through a hard link
+        self.proj_paths = []
+        for ndx in range(2):
+            proj_path = os.path.join(self.run_dir, 'proj%d' % ndx)
+            os.makedirs(os.path.join(proj_path, '.dvcz'), 0o755)
+            os.makedirs(os.path.join(proj_path, 'src'), 0o755)
+            with open(os.path.join(proj_path, '.dvcz', 'version'), 'w') as file:
+                file.write('0.1.%d\n2026-10-17\n' % ndx)
+            for count in range(4):
+                path = os.path.join(proj_path, 'src', 'file%d' % count)
+                with open(path, 'wb') as file:
+                    file.write(self.rng.some_bytes(1 + count * 100))
+            self.proj_paths.append(proj_path)
+        shared = os.path.join(self.proj_paths[0], 'shared')
+        with open(shared, 'wb') as file:
+            file.write(self.rng.some_bytes(4096))
+        os.link(shared, os.path.join(self.proj_paths[1], 'shared'))
+
+        # make the files old enough that their stat info can be trusted
+        past = time.time() - 60
+        for proj_path in self.proj_paths:
+            for dir_path, _, names in os.walk(proj_path):
+                for name in names:
+                    os.utime(os.path.join(dir_path, name), (past, past))
+
+    def tearDown(self):
+        pass
+
+    def test_commit_all(self):
+        """
+        Verify that each project is committed and logged, that a file
+        shared by projects is hashed and staged once, and that a bad
+        project does not stop the rest.
+        """
+        workspace = Workspace(self.key_path, self.u_path, self.committer_id,
+                              jobs=2, excl=['.dvcz'])
+        nonesuch = os.path.join(self.run_dir, 'nonesuch')
+        summary = workspace.commit_all(self.proj_paths + [nonesuch])
+        self.assertEqual(len(summary.results), 3)
+        self.assertEqual([_.path for _ in summary.failed], [nonesuch])
+
+        (first, second) = summary.results[:2]
+        self.assertEqual((first.name, first.version), ('proj0', '0.1.0.0'))
+        self.assertEqual((second.name, second.version), ('proj1', '0.1.1.0'))
+        self.assertEqual((first.files, first.hashed, first.shared), (5, 5, 0))
+        self.assertEqual((second.files, second.hashed, second.shared),
+                         (5, 4, 1))
+        self.assertEqual(second.deduped, 1)
+        self.assertEqual(summary.total('files'), 10)
+        for proj_path in self.proj_paths:
+            for name in ['builds', 'lastBuildList']:
+                self.assertTrue(
+                    os.path.exists(os.path.join(proj_path, '.dvcz', name)))
+        self.assertIn('1 failed', str(summary))
+
+        # committing again hashes nothing and bumps the build numbers
+        summary = Workspace(self.key_path, self.u_path, self.committer_id,
+                            excl=['.dvcz']).commit_all(self.proj_paths)
+        self.assertEqual(summary.failed, [])
+        self.assertEqual([_.version for _ in summary.results],
+                         ['0.1.0.1', '0.1.1.1'])
+        self.assertEqual(summary.total('hashed'), 0)
+        self.assertEqual(summary.total('cached'), 10)
+
+    def test_shared_in_store(self):
+        """
+        Verify that projects sharing a file already in the store are
+        committed without failures, though the file is never staged.
+        """
+        workspace = Workspace(self.key_path, self.u_path, self.committer_id,
+                              excl=['.dvcz'])
+        with open(os.path.join(self.proj_paths[0], 'shared'), 'rb') as file:
+            data = file.read()
+        key = hashlib.sha256(data).hexdigest()
+        workspace.store.put_data(data, key)
+
+        summary = workspace.commit_all(self.proj_paths)
+        self.assertEqual(summary.failed, [])
+        self.assertEqual([_.deduped for _ in summary.results], [1, 1])
+        self.assertFalse(
+            workspace.store.in_dir_for(self.committer_id).exists(key))
+
+    def test_read_proj_list(self):
+        """ Verify that comments and blank lines are skipped. """
+        path = os.path.join(self.run_dir, 'projects')
+        with open(path, 'w') as file:
+            file.write('# nightly\n%s\n\n  %s \n' % tuple(self.proj_paths))
+        self.assertEqual(read_proj_list(path), self.proj_paths)
+
+
+if __name__ == '__main__':
+    unittest.main()